@@ -0,0 +1,322 @@
+import argparse
+import glob
+import gzip
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from methylation_matrix import ChromosomeWriter, matrix_columns, write_matrix_index
+
+# 输出格式与 utils 中的三个C语言脚本完全一致：
+#   methylation_depth_analysis        -> 甲基化测序深度报告
+#   methylation_coverage_analyse      -> 基于染色体和context的甲基化覆盖度报告
+#   methylation_distribution_analysis -> 基于context的甲基化分布报告（按百分比）
+# 每个CX_report文件只解压、解析一次，同时完成三种统计
+# 传入染色体名称对照表时，解析每个数据块后直接将accession（NC_000067.7）重命名为染色体名称（chr1），
+# 报告和甲基化矩阵中均使用重命名后的名称，不再需要utils/refseq2chr.c单独读写一遍CX_report文件
+
+MAX_DEPTH = 200  # 超过200的覆盖深度都归入200这一类
+MAX_PERCENTAGE = 101  # 0-100%
+COVERAGE_CONTEXTS = ["CG", "CHG", "CHH"]  # 覆盖度报告中固定的context顺序
+HASH_TABLE_SIZE = 1000  # 与methylation_coverage_analyse的哈希表大小一致，决定输出顺序
+BLOCK_SIZE = 64 * 1024 * 1024  # 每次解析的数据块大小（字节）
+
+CX_COLUMNS = ["chromosome", "position", "strand", "readsM", "readsU", "context", "trinucleotide"]
+
+
+# 按数据块读取文件（支持gz），每个数据块都以完整的行结束
+def iter_line_blocks(path, block_size=BLOCK_SIZE):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        remainder = b""
+        while True:
+            data = file.read(block_size)
+            if not data:
+                break
+            data = remainder + data
+            end = data.rfind(b"\n") + 1
+            if end == 0:
+                remainder = data
+                continue
+            remainder = data[end:]
+            yield data[:end]
+        if remainder:
+            yield remainder + b"\n"
+
+
+# 将数据块解析为DataFrame，输出甲基化矩阵时还需要解析位置和链
+def parse_block(block, matrix=False):
+    usecols = ["chromosome", "readsM", "readsU", "context"]
+    dtype = {"chromosome": "category", "readsM": np.int64, "readsU": np.int64, "context": "category"}
+    if matrix:
+        usecols += ["position", "strand"]
+        dtype.update({"position": np.int64, "strand": "category"})
+    return pd.read_csv(
+        io.BytesIO(block),
+        sep="\t",
+        header=None,
+        names=CX_COLUMNS,
+        usecols=usecols,
+        dtype=dtype,
+        engine="c",
+    )
+
+
+# 读取染色体名称对照表（两列的tsv，首行为表头：accession、chromosome），内容与Chromosome_comparison_table.md一致
+def read_chromosome_aliases(path):
+    if not path:
+        return {}
+    df = pd.read_csv(path, sep="\t", dtype=str, comment="#")
+    return dict(zip(df.iloc[:, 0], df.iloc[:, 1]))
+
+
+# 按对照表重命名数据块的染色体列，只替换分类类型的类别名称，不逐行替换字符串；对照表中没有的染色体保持不变
+# 文件中同时存在accession和重命名后的名称时（如NC_000067.7和chr1），两者合并为同一个类别
+def rename_chromosomes(df, aliases):
+    if aliases:
+        names = [aliases.get(name, name) for name in df["chromosome"].cat.categories]
+        categories = list(dict.fromkeys(names))
+        lookup = np.array([categories.index(name) for name in names], dtype=np.int64)
+        df["chromosome"] = pd.Categorical.from_codes(lookup[df["chromosome"].cat.codes.to_numpy()], categories)
+    return df
+
+
+# 创建空的统计结果，每个文件的统计结果可以按文件顺序合并
+def empty_partial():
+    return {
+        # 按首次出现顺序记录的context，以及每个context的深度计数
+        "depth_contexts": [],
+        "depth_counts": {},
+        # 按首次出现顺序记录的染色体，每个染色体按CG/CHG/CHH记录[Count, covered, totalReadsM, totalReadsN]
+        "coverage_chromosomes": [],
+        "coverage_counts": {},
+        # 每个context按百分比记录[count, readsM, readsN]
+        "distribution_counts": {},
+    }
+
+
+# 统计一个数据块并累加到统计结果中
+def update_partial(partial, df):
+    readsM = df["readsM"].to_numpy()
+    # 总reads数（甲基化+非甲基化），与C语言脚本一致按int相加
+    readsN = (readsM + df["readsU"].to_numpy()).astype(np.int32).astype(np.int64)
+    # 字符串列按分类编码比较，避免逐行比较字符串
+    contexts = df["context"].cat.codes.to_numpy()
+    context_names = list(df["context"].cat.categories)
+    chromosomes = df["chromosome"].cat.codes.to_numpy()
+    chromosome_names = list(df["chromosome"].cat.categories)
+
+    # 深度和分布统计只使用有覆盖的位点，context按首次出现的顺序输出
+    covered = readsN > 0
+    for code in pd.unique(contexts[covered]):
+        context = context_names[code]
+        if context not in partial["depth_counts"]:
+            partial["depth_contexts"].append(context)
+            partial["depth_counts"][context] = np.zeros(MAX_DEPTH + 1, dtype=np.int64)
+            partial["distribution_counts"][context] = np.zeros((3, MAX_PERCENTAGE), dtype=np.int64)
+        mask = covered & (contexts == code)
+        depth = np.minimum(readsN[mask], MAX_DEPTH)
+        partial["depth_counts"][context] += np.bincount(depth, minlength=MAX_DEPTH + 1)
+
+        # 与C语言的round一致：先除后乘，0.5向远离0的方向舍入
+        rate = readsM[mask] / readsN[mask] * 100
+        percentage = np.floor(rate)
+        percentage = (percentage + (rate - percentage >= 0.5)).astype(np.int64)
+        counts = partial["distribution_counts"][context]
+        counts[0] += np.bincount(percentage, minlength=MAX_PERCENTAGE)
+        counts[1] += np.bincount(percentage, weights=readsM[mask], minlength=MAX_PERCENTAGE).astype(np.int64)
+        counts[2] += np.bincount(percentage, weights=readsN[mask], minlength=MAX_PERCENTAGE).astype(np.int64)
+
+    # 覆盖度统计只使用CG/CHG/CHH三种context，染色体按首次出现的顺序插入哈希表
+    context_codes = [context_names.index(c) if c in context_names else -2 for c in COVERAGE_CONTEXTS]
+    valid = np.isin(contexts, context_codes)
+    for code in pd.unique(chromosomes[valid]):
+        chromosome = chromosome_names[code]
+        if chromosome not in partial["coverage_counts"]:
+            partial["coverage_chromosomes"].append(chromosome)
+            partial["coverage_counts"][chromosome] = np.zeros((len(COVERAGE_CONTEXTS), 4), dtype=np.int64)
+        chromosome_mask = valid & (chromosomes == code)
+        counts = partial["coverage_counts"][chromosome]
+        for index, context_code in enumerate(context_codes):
+            mask = chromosome_mask & (contexts == context_code)
+            counts[index] += [
+                np.count_nonzero(mask),
+                np.count_nonzero(mask & covered),
+                readsM[mask].sum(),
+                readsN[mask].sum(),
+            ]
+
+
+# 统计单个CX_report文件，指定matrix_dir时同时将有覆盖的位点写入甲基化矩阵，返回各染色体的矩阵索引
+def analyse_file(path, matrix_dir=None, aliases=None):
+    partial = empty_partial()
+    writers = {}
+    for block in iter_line_blocks(path):
+        df = rename_chromosomes(parse_block(block, matrix=matrix_dir is not None), aliases)
+        update_partial(partial, df)
+        if matrix_dir is not None:
+            readsN = df["readsM"].to_numpy() + df["readsU"].to_numpy()
+            for chromosome, columns in matrix_columns(df, readsN):
+                if chromosome not in writers:
+                    writers[chromosome] = ChromosomeWriter(matrix_dir, chromosome)
+                writers[chromosome].append(columns)
+    matrix_index = {chromosome: writer.close() for chromosome, writer in writers.items()}
+    return partial, matrix_index
+
+
+# 按文件顺序合并多个统计结果（后出现的context和染色体排在后面）
+def merge_partials(partials):
+    merged = empty_partial()
+    for partial in partials:
+        for context in partial["depth_contexts"]:
+            if context not in merged["depth_counts"]:
+                merged["depth_contexts"].append(context)
+                merged["depth_counts"][context] = np.zeros(MAX_DEPTH + 1, dtype=np.int64)
+                merged["distribution_counts"][context] = np.zeros((3, MAX_PERCENTAGE), dtype=np.int64)
+            merged["depth_counts"][context] += partial["depth_counts"][context]
+            merged["distribution_counts"][context] += partial["distribution_counts"][context]
+        for chromosome in partial["coverage_chromosomes"]:
+            if chromosome not in merged["coverage_counts"]:
+                merged["coverage_chromosomes"].append(chromosome)
+                merged["coverage_counts"][chromosome] = np.zeros((len(COVERAGE_CONTEXTS), 4), dtype=np.int64)
+            merged["coverage_counts"][chromosome] += partial["coverage_counts"][chromosome]
+    return merged
+
+
+# C语言脚本使用int输出计数，超过int范围时按32位有符号整数溢出
+def c_int(value):
+    return (int(value) + 2**31) % 2**32 - 2**31
+
+
+# 与methylation_coverage_analyse相同的哈希函数
+def hash_function(text):
+    value = 0
+    for char in text.encode():
+        value = ((value << 5) + char) & 0xFFFFFFFF
+    return value % HASH_TABLE_SIZE
+
+
+# 输出甲基化测序深度报告
+def write_depth_report(merged, output_file):
+    contexts = merged["depth_contexts"]
+    with open(output_file, "w") as file:
+        file.write("Depth" + "".join(f"\t{context}" for context in contexts) + "\n")
+        for depth in range(1, MAX_DEPTH + 1):
+            values = "".join(f"\t{merged['depth_counts'][context][depth]}" for context in contexts)
+            file.write(f"{depth}{values}\n")
+
+
+# 输出甲基化覆盖度报告（按哈希桶顺序输出，同一个桶内后插入的染色体在前）
+def write_coverage_report(merged, output_file):
+    buckets = [[] for _ in range(HASH_TABLE_SIZE)]
+    for chromosome in merged["coverage_chromosomes"]:
+        buckets[hash_function(chromosome)].insert(0, chromosome)
+    with open(output_file, "w") as file:
+        file.write("Chromosome\tContext\tCount\tcovered\ttotalReadsM\ttotalReadsN\n")
+        for bucket in buckets:
+            for chromosome in bucket:
+                for context, counts in zip(COVERAGE_CONTEXTS, merged["coverage_counts"][chromosome]):
+                    values = "\t".join(str(c_int(value)) for value in counts)
+                    file.write(f"{chromosome}\t{context}\t{values}\n")
+
+
+# 输出甲基化分布报告
+def write_distribution_report(merged, output_file):
+    with open(output_file, "w") as file:
+        file.write("context\tmethylation_level\tcount\treadsM\treadsN\n")
+        for context in merged["depth_contexts"]:
+            counts = merged["distribution_counts"][context]
+            for level in range(MAX_PERCENTAGE):
+                if counts[0][level] > 0:
+                    values = "\t".join(str(c_int(value)) for value in counts[:, level])
+                    file.write(f"{context}\t{level}\t{values}\n")
+
+
+# 在子进程中统计单个文件，同时返回耗时
+def timed_analyse_file(path, matrix_dir=None, aliases=None):
+    start_time = time.time()
+    partial, matrix_index = analyse_file(path, matrix_dir, aliases)
+    return partial, matrix_index, time.time() - start_time
+
+
+# 统计所有匹配的CX_report文件并输出三个报告，每个染色体文件由一个子进程统计，最后按文件顺序合并
+# 指定matrix_dir时同时输出甲基化矩阵（每条染色体只能出现在一个文件中），指定chromosome_aliases时按对照表重命名染色体
+def analyse_cx_reports(
+    input_pattern,
+    depth_report,
+    coverage_report,
+    distribution_report,
+    parallel_num=1,
+    matrix_dir=None,
+    chromosome_aliases=None,
+):
+    aliases = read_chromosome_aliases(chromosome_aliases)
+    paths = sorted(glob.glob(input_pattern))
+    if not paths:
+        raise FileNotFoundError(f"未找到匹配的CX_report文件: {input_pattern}")
+    if matrix_dir is not None:
+        os.makedirs(matrix_dir, exist_ok=True)
+        # 先删除旧的索引，中断时不会留下与数据不一致的索引
+        if os.path.exists(f"{matrix_dir}/index.json"):
+            os.remove(f"{matrix_dir}/index.json")
+
+    start_time = time.time()
+    partials = {}
+    matrix_indexes = {}
+    # 先提交最大的文件，避免最后只剩一个大染色体在单核上运行
+    submit_order = sorted(paths, key=os.path.getsize, reverse=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(parallel_num, len(paths)))) as executor:
+        futures = {executor.submit(timed_analyse_file, path, matrix_dir, aliases): path for path in submit_order}
+        for i, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            partials[path], matrix_indexes[path], elapsed = future.result()
+            print(f"Processed file {i + 1}/{len(paths)}: {path} ({elapsed:.2f} seconds)")
+    # 合并顺序必须与glob顺序一致，以保证context和染色体的输出顺序不变
+    merged = merge_partials(partials[path] for path in paths)
+    print(f"Total elapsed time: {time.time() - start_time:.2f} seconds")
+
+    write_depth_report(merged, depth_report)
+    write_coverage_report(merged, coverage_report)
+    write_distribution_report(merged, distribution_report)
+
+    if matrix_dir is not None:
+        chromosomes = {}
+        for path in paths:
+            for chromosome, item in matrix_indexes[path].items():
+                if chromosome in chromosomes:
+                    raise ValueError(f"染色体{chromosome}出现在多个CX_report文件中，无法输出甲基化矩阵")
+                chromosomes[chromosome] = item
+        write_matrix_index(matrix_dir, chromosomes)
+        print(f"甲基化矩阵已生成: {matrix_dir}（{sum(item['count'] for item in chromosomes.values())}个位点）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="一次读取CX_report文件，同时输出甲基化深度、覆盖度及分布报告")
+    parser.add_argument("input_pattern", type=str, help="CX_report文件路径，支持通配符（需加引号）")
+    parser.add_argument("--depth_report", type=str, required=True, help="甲基化测序深度报告的输出路径")
+    parser.add_argument("--coverage_report", type=str, required=True, help="甲基化覆盖度报告的输出路径")
+    parser.add_argument("--distribution_report", type=str, required=True, help="甲基化分布报告的输出路径")
+    parser.add_argument("--parallel_num", type=int, default=1, help="同时统计的文件数（进程数），默认值为1")
+    parser.add_argument(
+        "--matrix_dir", type=str, help="同时输出甲基化矩阵的文件夹（可通过methylation_matrix.py按区间查询）"
+    )
+    parser.add_argument(
+        "--chromosome_aliases",
+        type=str,
+        help="染色体名称对照表（accession、chromosome两列的tsv，如chromosome_aliases.tsv），报告和矩阵中使用重命名后的名称",
+    )
+    args = parser.parse_args()
+
+    analyse_cx_reports(
+        args.input_pattern,
+        args.depth_report,
+        args.coverage_report,
+        args.distribution_report,
+        args.parallel_num,
+        args.matrix_dir,
+        args.chromosome_aliases,
+    )
@@ -0,0 +1,453 @@
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from methylation_analyse import jsonload, read_samples_file
+from methylation_matrix import CONTEXTS, MethylationMatrix
+
+# 基于分箱（bins）的DMR筛选，对应DMR_analyse.R中computeDMRsReplicates(method = "bins", test = "betareg")的参数：
+#   1. 从染色体数据范围（所有context位点的最小位置）的起点按bin_size划分区间（最后一个不完整的区间不参与分析）
+#   2. 按区间对每个样本的reads求和（np.add.reduceat），cytosinesCount为区间内的位点数
+#   3. 至少min_cytosines_count个位点、每组平均每个位点的读数不少于min_reads_per_cytosine且两组甲基化比例之差
+#      不小于min_proportion_difference的区间，使用beta回归检验分组的差异（所有区间同时迭代求解）
+#   4. p值按Benjamini-Hochberg方法校正，保留校正后p值小于p_value_threshold的区间
+#   5. 与minGap = 0一致，合并位置相邻且方向相同的显著区间
+# 输出列与DMRsReplicatesBins.txt一致，可以使用compare子命令与DMRcaller的结果逐个区间比较
+#
+# 以下几点按DMRcaller中computeDMRsReplicates(method = "bins")的实现（.computeDMRsReplicatesBins）确定，
+# 与直观的做法不同，修改时需要同时运行tests/data/dmr_bins/dmrcaller_parity.R重新核对：
+#   - 区间锚定：regions = NULL时由getWholeChromosomes取每条染色体数据的最小及最大位置作为区域，区间起点为
+#     seq(start(region), end(region) - binSize, by = binSize)，即从第一个位点（不是1）开始每binSize一个区间。
+#     合并矩阵只保存有覆盖的位点，因此起点是第一个有覆盖的位点；DMR_analyse.R读取合并矩阵时传入的数据相同，
+#     读取CX_report文件时数据中还包含没有覆盖的胞嘧啶，起点（及cytosinesCount）可能与此不同
+#   - 末尾区间：seq的终点为end - binSize，最后一个区间的终点不超过end - 1，不完整的区间（以及恰好止于end的区间）都被丢弃
+#   - min_reads_per_cytosine：比较的是每组所有样本的reads之和除以位点数（sumReadsN1 / cytosinesCount，
+#     sumReadsN1为组内各样本之和，与输出列相同），不是每个样本每个位点的读数，因此组内样本越多越容易通过
+#   - BH校正：只有通过位点数、读数及甲基化比例差异筛选的区间才进行beta回归，p.adjust的对象也只是这些区间的p值，
+#     未检验的区间不计入校正的总数；合并后的区域同样只在合并的区域之间校正
+
+DMR_COLUMNS = [
+    "seqnames",
+    "start",
+    "end",
+    "width",
+    "strand",
+    "sumReadsM1",
+    "sumReadsN1",
+    "proportion1",
+    "sumReadsM2",
+    "sumReadsN2",
+    "proportion2",
+    "cytosinesCount",
+    "context",
+    "direction",
+    "pValue",
+    "regionType",
+]
+
+# 与DMR_analyse.R一致的默认参数
+DEFAULTS = {
+    "bin_size": 200,
+    "min_cytosines_count": 5,
+    "min_reads_per_cytosine": 5,
+    "p_value_threshold": 0.05,
+    "min_proportion_differences": {"CG": 0.2, "CHG": 0.1, "CHH": 0.05},
+    "pseudocount_m": 1,  # beta回归前加到甲基化reads数上的伪计数（DMRcaller的默认值）
+    "pseudocount_n": 2,  # beta回归前加到总reads数上的伪计数（DMRcaller的默认值）
+}
+
+
+##################################################################
+# 特殊函数（numpy中没有digamma/trigamma，使用递推公式加渐近展开计算）
+##################################################################
+
+
+# digamma函数，x > 0
+def digamma(x):
+    x = np.array(x, dtype=np.float64)
+    result = np.zeros_like(x)
+    for _ in range(6):
+        small = x < 6
+        result[small] -= 1 / x[small]
+        x = np.where(small, x + 1, x)
+    x2 = 1 / (x * x)
+    return result + np.log(x) - 0.5 / x - x2 * (1 / 12 - x2 * (1 / 120 - x2 * (1 / 252 - x2 * (1 / 240 - x2 / 132))))
+
+
+# trigamma函数，x > 0
+def trigamma(x):
+    x = np.array(x, dtype=np.float64)
+    result = np.zeros_like(x)
+    for _ in range(6):
+        small = x < 6
+        result[small] += 1 / (x[small] * x[small])
+        x = np.where(small, x + 1, x)
+    x2 = 1 / (x * x)
+    return result + 1 / x + x2 / 2 + x2 / x * (1 / 6 - x2 * (1 / 30 - x2 * (1 / 42 - x2 / 30)))
+
+
+# 标准正态分布的双侧p值
+def normal_two_sided_p(z):
+    return np.frompyfunc(lambda value: math.erfc(abs(value) / math.sqrt(2)), 1, 1)(z).astype(np.float64)
+
+
+# Benjamini-Hochberg校正（与R中p.adjust(method = "BH")一致）
+def p_adjust_bh(p_values):
+    p_values = np.asarray(p_values, dtype=np.float64)
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)[::-1]
+    adjusted = np.minimum.accumulate(p_values[order] * n / np.arange(n, 0, -1))
+    result = np.empty(n)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+##################################################################
+# beta回归
+##################################################################
+
+
+# 对每一行（一个区间）分别拟合 logit(mu) = b0 + b1 * group，y ~ Beta(mu * phi, (1 - mu) * phi)
+# y为（区间数, 样本数）的比例矩阵，group为0/1的分组向量；所有区间同时进行Fisher scoring迭代，
+# 与betareg一致使用期望信息矩阵，返回参数估计(b0, b1, phi)及b1的方差（未收敛的区间为NaN）
+def fit_beta_regression(y, group, max_iterations=100, tolerance=1e-8):
+    bins, samples = y.shape
+    X = np.stack([np.ones(samples), np.asarray(group, dtype=np.float64)], axis=1)  # (样本数, 2)
+    ystar = np.log(y / (1 - y))
+    log_1_y = np.log1p(-y)
+
+    # 初始值与betareg相同：logit(y)的最小二乘估计，phi由残差方差估计
+    beta = np.linalg.lstsq(X, ystar.T, rcond=None)[0].T  # (区间数, 2)
+    eta = beta @ X.T
+    mu = 1 / (1 + np.exp(-eta))
+    residual = ystar - eta
+    sigma2 = (residual**2).sum(axis=1, keepdims=True) / ((samples - 2) * (1 / (mu * (1 - mu))) ** 2)
+    phi = np.maximum(np.mean(mu * (1 - mu) / sigma2, axis=1) - 1, 1e-3)
+    theta = np.column_stack([beta, phi])
+
+    converged = np.zeros(bins, dtype=bool)
+    information = np.zeros((bins, 3, 3))
+    for _ in range(max_iterations):
+        active = ~converged
+        if not active.any():
+            break
+        beta, phi = theta[active, :2], theta[active, 2:3]
+        mu = 1 / (1 + np.exp(-(beta @ X.T)))
+        a, b = mu * phi, (1 - mu) * phi
+        t = mu * (1 - mu)  # dmu/deta
+        residual = ystar[active] - (digamma(a) - digamma(b))
+        trigamma_a, trigamma_b = trigamma(a), trigamma(b)
+
+        # 得分函数
+        score = np.empty((len(phi), 3))
+        score[:, :2] = (phi * t * residual) @ X
+        score[:, 2] = (mu * residual + log_1_y[active] - digamma(b) + digamma(phi)).sum(axis=1)
+
+        # 期望信息矩阵
+        w = phi**2 * (trigamma_a + trigamma_b) * t**2
+        c = phi * (trigamma_a * mu - trigamma_b * (1 - mu)) * t
+        d = trigamma_a * mu**2 + trigamma_b * (1 - mu) ** 2 - trigamma(phi)
+        info = np.empty((len(phi), 3, 3))
+        info[:, :2, :2] = np.einsum("bi,ij,ik->bjk", w, X, X)
+        info[:, :2, 2] = info[:, 2, :2] = c @ X
+        info[:, 2, 2] = d.sum(axis=1)
+        information[active] = info
+
+        try:
+            step = np.linalg.solve(info, score[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(m, s, rcond=None)[0] for m, s in zip(info, score)])
+        # phi必须为正数，步长过大时减半
+        scale = np.ones(len(phi))
+        for _ in range(30):
+            invalid = theta[active, 2] + scale * step[:, 2] <= 0
+            if not invalid.any():
+                break
+            scale[invalid] /= 2
+        theta[active] += scale[:, None] * step
+        converged[np.flatnonzero(active)[np.all(np.abs(scale[:, None] * step) < tolerance * (1 + np.abs(theta[active])), axis=1)]] = True
+
+    with np.errstate(invalid="ignore"):
+        variance = np.full(bins, np.nan)
+        valid = converged & np.isfinite(information).all(axis=(1, 2))
+        if valid.any():
+            variance[valid] = np.linalg.inv(information[valid])[:, 1, 1]
+    return theta, variance
+
+
+# b1（分组系数）的Wald检验p值
+def beta_regression_p_values(y, group):
+    theta, variance = fit_beta_regression(y, group)
+    with np.errstate(invalid="ignore"):
+        z = theta[:, 1] / np.sqrt(variance)
+    p_values = np.full(len(z), np.nan)
+    ok = np.isfinite(z)
+    p_values[ok] = normal_two_sided_p(z[ok])
+    return p_values
+
+
+##################################################################
+# 按区间统计及筛选
+##################################################################
+
+
+# 按区间求和：starts为每个区间在已排序位点中的起始下标，返回（样本数, 区间数）
+def sum_bins(values, starts):
+    return np.add.reduceat(values, starts, axis=1)
+
+
+# 每个样本的区间甲基化比例（加伪计数避免0和1），返回（区间数, 样本数）
+def bin_proportions(sum_m, sum_n, options):
+    return ((sum_m + options["pseudocount_m"]) / (sum_n + options["pseudocount_n"])).T
+
+
+# 对一条染色体的一种context筛选DMR区间
+# position为已排序的位置，reads_m和reads_n为（样本数, 位点数），group为每个样本所属的组（0/1）
+# region为染色体的数据范围（所有context位点的最小及最大位置，与getWholeChromosomes一致），默认为position的范围
+def call_dmr_bins(seqname, context, position, reads_m, reads_n, group, options, region=None):
+    bin_size = options["bin_size"]
+    group = np.asarray(group)
+    empty = pd.DataFrame(columns=DMR_COLUMNS)
+    if len(position) == 0:
+        return empty
+
+    # 从数据范围的起点划分区间，区间起点为seq(start, end - binSize, by = binSize)，末尾不完整的区间丢弃
+    region_start, region_end = region or (int(position[0]), int(position[-1]))
+    if region_end - bin_size < region_start:
+        return empty
+    bin_count = (region_end - bin_size - region_start) // bin_size + 1
+    offset = position.astype(np.int64) - region_start
+    in_range = (offset >= 0) & (offset < bin_count * bin_size)
+    if not in_range.any():
+        return empty
+    offset = offset[in_range]
+    reads_m = reads_m[:, in_range].astype(np.int64)
+    reads_n = reads_n[:, in_range].astype(np.int64)
+
+    # 只对包含位点的区间求和：每个区间在已排序的位点中是连续的一段
+    bin_index = offset // bin_size
+    starts = np.flatnonzero(np.r_[True, bin_index[1:] != bin_index[:-1]])
+    bin_ids = bin_index[starts]
+    sum_m = sum_bins(reads_m, starts)  # (样本数, 区间数)
+    sum_n = sum_bins(reads_n, starts)
+    cytosines_count = np.diff(np.r_[starts, len(offset)])
+
+    group_m = np.stack([sum_m[group == g].sum(axis=0) for g in (0, 1)])
+    group_n = np.stack([sum_n[group == g].sum(axis=0) for g in (0, 1)])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        proportion = group_m / group_n
+
+    # 位点数、每组平均每个位点的读数（组内各样本之和sumReadsN / cytosinesCount，不是每个样本）及甲基化比例差异的筛选
+    keep = (
+        (cytosines_count >= options["min_cytosines_count"])
+        & (group_n >= options["min_reads_per_cytosine"] * cytosines_count).all(axis=0)
+        & (np.abs(proportion[1] - proportion[0]) >= options["min_proportion_differences"][context])
+    )
+    if not keep.any():
+        return empty
+    index = np.flatnonzero(keep)
+
+    # 同时拟合所有区间的beta回归，p值只在通过筛选的区间之间按BH方法校正
+    p_values = p_adjust_bh(beta_regression_p_values(bin_proportions(sum_m[:, index], sum_n[:, index], options), group))
+    significant = np.isfinite(p_values) & (p_values < options["p_value_threshold"])
+    index, p_values = index[significant], p_values[significant]
+    if len(index) == 0:
+        return empty
+    direction = np.where(proportion[1, index] > proportion[0, index], 1, -1)
+
+    # 与minGap = 0的合并一致：位置相邻且方向相同的显著区间合并为一个区域，合并后重新统计并检验，
+    # 合并后的区域不再显著（或甲基化比例差异不足）时保留原来的各个区间
+    runs = np.flatnonzero(np.r_[True, (np.diff(bin_ids[index]) != 1) | (direction[1:] != direction[:-1])])
+    runs = list(zip(runs, np.r_[runs[1:], len(index)]))
+    merged = [(a, b) for a, b in runs if b - a > 1]
+    merged_p_values = {}
+    if merged:
+        merged_m = np.stack([sum_m[:, index[a:b]].sum(axis=1) for a, b in merged], axis=1)
+        merged_n = np.stack([sum_n[:, index[a:b]].sum(axis=1) for a, b in merged], axis=1)
+        y = bin_proportions(merged_m, merged_n, options)
+        merged_p_values = dict(zip(merged, p_adjust_bh(beta_regression_p_values(y, group))))
+    regions, region_p_values = [], []
+    for a, b in runs:
+        if b - a > 1:
+            m, n = group_m[:, index[a:b]].sum(axis=1), group_n[:, index[a:b]].sum(axis=1)
+            p_value = merged_p_values[(a, b)]
+            if (
+                np.isfinite(p_value)
+                and p_value < options["p_value_threshold"]
+                and abs(m[1] / n[1] - m[0] / n[0]) >= options["min_proportion_differences"][context]
+            ):
+                regions.append((a, b))
+                region_p_values.append(p_value)
+                continue
+        for j in range(a, b):
+            regions.append((j, j + 1))
+            region_p_values.append(p_values[j])
+
+    first = np.array([index[a] for a, _ in regions])
+    last = np.array([index[b - 1] for _, b in regions])
+    region_m = np.stack([group_m[:, index[a:b]].sum(axis=1) for a, b in regions], axis=1)
+    region_n = np.stack([group_n[:, index[a:b]].sum(axis=1) for a, b in regions], axis=1)
+    region_proportion = region_m / region_n
+    region_direction = np.where(region_proportion[1] > region_proportion[0], 1, -1)
+    start = region_start + bin_ids[first] * bin_size
+    end = region_start + bin_ids[last] * bin_size + bin_size - 1
+    columns = dict.fromkeys(DMR_COLUMNS)
+    columns.update(
+        seqnames=seqname,
+        start=start,
+        end=end,
+        width=end - start + 1,
+        strand="*",
+        sumReadsM1=region_m[0],
+        sumReadsN1=region_n[0],
+        proportion1=region_proportion[0],
+        sumReadsM2=region_m[1],
+        sumReadsN2=region_n[1],
+        proportion2=region_proportion[1],
+        cytosinesCount=np.array([cytosines_count[index[a:b]].sum() for a, b in regions]),
+        context=context,
+        direction=region_direction,
+        pValue=region_p_values,
+        regionType=np.where(region_direction > 0, "gain", "loss"),
+    )
+    return pd.DataFrame(columns)
+
+
+# 从合并矩阵中读取一条染色体一种context的数据并筛选DMR区间（在子进程中执行）
+def call_chromosome(cohort_matrix_dir, seqname, context, sample_names, group, options):
+    start_time = time.time()
+    matrix = MethylationMatrix(cohort_matrix_dir)
+    columns = matrix.index["samples"]
+    rows = [columns.index(sample_name) for sample_name in sample_names]
+    mask = np.asarray(matrix.column(seqname, "context")) == CONTEXTS.index(context)
+    position = np.asarray(matrix.column(seqname, "position"))
+    # 区间从整条染色体（所有context）的数据范围起点开始划分
+    region = (int(position[0]), int(position[-1])) if len(position) else None
+    position = position[mask]
+    reads_m = np.asarray(matrix.column(seqname, "reads_m"))[rows][:, mask]
+    reads_n = np.asarray(matrix.column(seqname, "reads_n"))[rows][:, mask]
+    df = call_dmr_bins(seqname, context, position, reads_m, reads_n, group, options, region)
+    return df, time.time() - start_time
+
+
+##################################################################
+# 参数读取
+##################################################################
+
+
+# 按组A、组B筛选样本（保持样本顺序），与DMRcaller一致，第一个样本所在的组为组1
+def select_samples(samples, group_a, group_b):
+    samples = samples[samples["group_name"].isin([group_a, group_b])].reset_index(drop=True)
+    for group_name in [group_a, group_b]:
+        if group_name not in set(samples["group_name"]):
+            raise ValueError(f"分组{group_name}在样本数据中不存在")
+    first_group = samples["group_name"].iloc[0]
+    return list(samples["sample_name"]), [0 if name == first_group else 1 for name in samples["group_name"]]
+
+
+# 读取DMR结果文件（DMRsReplicatesBins.txt格式，没有表头）
+def read_dmr_file(path):
+    return pd.read_csv(path, sep="\t", header=None, names=DMR_COLUMNS)
+
+
+# 逐个区间比较两个DMR结果文件，输出只在一个文件中出现的区间数及共同区间各列的最大差异，完全一致时返回True
+def compare_dmr_files(path_a, path_b, tolerance=1e-6):
+    key = ["seqnames", "start", "end", "context"]
+    a, b = read_dmr_file(path_a), read_dmr_file(path_b)
+    merged = a.merge(b, on=key, how="outer", suffixes=("_a", "_b"), indicator=True)
+    only_a = int((merged["_merge"] == "left_only").sum())
+    only_b = int((merged["_merge"] == "right_only").sum())
+    common = merged[merged["_merge"] == "both"]
+    print(f"共同区间: {len(common)}，只在{path_a}中: {only_a}，只在{path_b}中: {only_b}")
+    identical = only_a == 0 and only_b == 0
+    for column in ["sumReadsM1", "sumReadsN1", "proportion1", "sumReadsM2", "sumReadsN2", "proportion2", "cytosinesCount", "direction", "pValue"]:
+        difference = (common[f"{column}_a"] - common[f"{column}_b"]).abs().max() if len(common) else 0
+        print(f"  {column}: 最大差异 {difference:.3g}")
+        if difference > tolerance:
+            identical = False
+    print("结果一致" if identical else "结果不一致")
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于分箱的DMR筛选（numpy向量化实现），或比较两个DMR结果文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    call_parser = subparsers.add_parser("call", help="从多样本合并矩阵中筛选DMR区间")
+    call_parser.add_argument("-c", "--config", type=str, help="配置文件路径（读取样本、分组及输出文件夹）")
+    call_parser.add_argument("-f", "--samples_file", type=str, help="以tsv/csv/excel文件传入样本参数")
+    call_parser.add_argument("-a", "--group_a", type=str, help="DMR的组A名称")
+    call_parser.add_argument("-b", "--group_b", type=str, help="DMR的组B名称")
+    call_parser.add_argument("-m", "--cohort_matrix_dir", type=str, help="多样本合并矩阵的文件夹，默认值为：{output_dir}/cohort_matrix")
+    call_parser.add_argument("-o", "--output", type=str, help="输出文件路径，默认值为：{output_dir}/{组A}_and_{组B}/DMRsBins.txt")
+    call_parser.add_argument("--seqnames", type=str, nargs="+", help="只分析指定的染色体，默认分析合并矩阵中的所有染色体")
+    call_parser.add_argument("--contexts", type=str, nargs="+", choices=CONTEXTS, default=CONTEXTS, help="分析的context，默认为全部")
+    call_parser.add_argument("--bin_size", type=int, default=DEFAULTS["bin_size"], help="分箱大小，默认值为200")
+    call_parser.add_argument("--min_cytosines_count", type=int, default=DEFAULTS["min_cytosines_count"], help="每个区间至少包含的位点数，默认值为5")
+    call_parser.add_argument("--min_reads_per_cytosine", type=int, default=DEFAULTS["min_reads_per_cytosine"], help="每个位点至少需要的读数，默认值为5")
+    call_parser.add_argument("--p_value_threshold", type=float, default=DEFAULTS["p_value_threshold"], help="校正后p值的阈值，默认值为0.05")
+    call_parser.add_argument("-p", "--parallel_num", type=int, help="同时分析的染色体×context数（进程数），默认值为CPU核心数")
+
+    compare_parser = subparsers.add_parser("compare", help="逐个区间比较两个DMR结果文件（如本程序与DMRcaller的结果）")
+    compare_parser.add_argument("file_a", type=str, help="DMR结果文件A")
+    compare_parser.add_argument("file_b", type=str, help="DMR结果文件B")
+    compare_parser.add_argument("--tolerance", type=float, default=1e-6, help="数值列允许的最大差异，默认值为1e-6")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(0 if compare_dmr_files(args.file_a, args.file_b, args.tolerance) else 1)
+
+    data = jsonload(args.config) if args.config else {}
+    for key in ["samples_file", "group_a", "group_b", "cohort_matrix_dir", "parallel_num"]:
+        if getattr(args, key) is not None:
+            data[key] = getattr(args, key)
+    if not data.get("group_a") or not data.get("group_b"):
+        parser.error("缺少必填参数：group_a 和/或 group_b")
+    samples = read_samples_file(data["samples_file"]) if data.get("samples_file") else pd.DataFrame(data.get("samples", []))
+    sample_names, group = select_samples(samples, data["group_a"], data["group_b"])
+
+    output_dir = data.get("output_dir", "./output").rstrip("/")
+    cohort_matrix_dir = data.get("cohort_matrix_dir") or f"{output_dir}/cohort_matrix"
+    output = args.output or f"{output_dir}/{data['group_a']}_and_{data['group_b']}/DMRsBins.txt"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    options = dict(
+        DEFAULTS,
+        bin_size=args.bin_size,
+        min_cytosines_count=args.min_cytosines_count,
+        min_reads_per_cytosine=args.min_reads_per_cytosine,
+        p_value_threshold=args.p_value_threshold,
+    )
+
+    matrix = MethylationMatrix(cohort_matrix_dir)
+    missing = [name for name in sample_names if name not in (matrix.samples or [])]
+    if missing:
+        raise ValueError(f"多样本合并矩阵中缺少样本: {', '.join(missing)}")
+    seqnames = args.seqnames or list(matrix.chromosomes)
+    jobs = [(seqname, context) for seqname in seqnames if seqname in matrix.chromosomes for context in args.contexts]
+    print(f"样本: {', '.join(sample_names)}，分组: {group}")
+    print(f"DMR任务数: {len(jobs)}")
+
+    start_time = time.time()
+    parallel_num = data.get("parallel_num") or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max(1, min(parallel_num, len(jobs)))) as executor:
+        futures = [
+            executor.submit(call_chromosome, cohort_matrix_dir, seqname, context, sample_names, group, options)
+            for seqname, context in jobs
+        ]
+        results = []
+        for (seqname, context), future in zip(jobs, futures):
+            df, elapsed = future.result()
+            print(f"{seqname} {context}: {len(df)}个DMR区间 ({elapsed:.2f} seconds)")
+            results.append(df)
+    df = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=DMR_COLUMNS)
+    # 与DMRsReplicatesBins.txt一致，不输出表头
+    df.to_csv(output, sep="\t", index=False, header=False)
+    print(f"DMR区间已输出到: {output}（共{len(df)}个，耗时{time.time() - start_time:.2f}秒）")
@@ -0,0 +1,245 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dmr_bins import DMR_COLUMNS
+from sample_summary import import_pyarrow
+
+# GTF注释缓存：每个注释文件只解析一次，属性列（gene_id、gene_name、gene_type...）拆分为独立的列，
+# 按染色体和起止位置排序后保存在注释文件旁，DMR_analyse.R、DMR_plot.R及GO_and_KEGG_analyse.R共用：
+#   {gtf_file}.index.parquet  区间索引，包含所有属性列，用于DMR注释
+#   {gtf_file}.genes.parquet  基因表，只包含常用的列，列名与rtracklayer::import读取的结果一致
+# 缓存文件先写入临时文件再重命名，元数据中记录注释文件的大小、修改时间及sha256校验值，
+# 注释文件变化（校验值不一致）或缓存文件损坏时自动重建
+# DMR注释时，DMR和注释区间按位置排序，每条染色体通过二分查找一次得到所有重叠的区间对
+
+GTF_COLUMNS = ["seqname", "source", "feature_type", "start", "end", "score", "strand", "frame", "attributes"]
+INDEX_COLUMNS = ["seqname", "start", "end", "strand", "source", "feature_type", "score", "frame"]
+GENE_TABLE_COLUMNS = [
+    "seqnames",
+    "start",
+    "end",
+    "width",
+    "strand",
+    "source",
+    "type",
+    "score",
+    "phase",
+    "gene_id",
+    "gene_type",
+    "gene_name",
+    "transcript_id",
+    "transcript_type",
+    "transcript_name",
+    "exon_number",
+    "exon_id",
+    "level",
+]
+GTF_CHUNK_SIZE = 200000  # 每次解析的GTF行数
+CACHE_METADATA_KEY = b"gtf_source"
+
+
+# 注释文件对应的缓存文件（name为index或genes）
+def gtf_cache_file(gtf_file, name):
+    return f"{gtf_file}.{name}.parquet"
+
+
+# 注释文件对应的索引文件
+def gtf_index_file(gtf_file):
+    return gtf_cache_file(gtf_file, "index")
+
+
+# 注释文件对应的基因表
+def gene_table_file(gtf_file):
+    return gtf_cache_file(gtf_file, "genes")
+
+
+# 计算文件的sha256校验值
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+# 注释文件的来源信息（写入缓存文件的元数据）
+def gtf_source(gtf_file):
+    stat = os.stat(gtf_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_checksum(gtf_file)}
+
+
+# 解析GTF的属性列（key "value"; key "value"; ...），与原DMR_analyse.R中的解析方式一致，同名的键保留最后一个值
+def parse_attributes(text):
+    attributes = {}
+    for pair in text.split(";"):
+        parts = pair.strip().split(" ", 1)
+        if len(parts) == 2:
+            attributes[parts[0].strip()] = parts[1].strip().replace('"', "")
+    return attributes
+
+
+# 分块读取GTF文件（支持gtf/gtf.gz格式），返回属性已拆分为独立列的数据框
+def read_gtf(gtf_file):
+    opener = gzip.open if gtf_file.endswith(".gz") else open
+    parts = []
+    with opener(gtf_file, "rt") as file:
+        reader = pd.read_csv(
+            file,
+            sep="\t",
+            comment="#",
+            header=None,
+            names=GTF_COLUMNS,
+            dtype={"seqname": str, "start": np.int64, "end": np.int64, "score": str, "frame": str},
+            chunksize=GTF_CHUNK_SIZE,
+        )
+        for chunk in reader:
+            attributes = pd.DataFrame([parse_attributes(text) for text in chunk["attributes"]], index=chunk.index)
+            parts.append(pd.concat([chunk[INDEX_COLUMNS], attributes], axis=1))
+    df = pd.concat(parts, ignore_index=True)
+    return df.sort_values(["seqname", "start", "end"], kind="stable", ignore_index=True)
+
+
+# 由区间索引生成基因表，重复值多的列使用分类类型
+def gene_table(index):
+    df = index.rename(columns={"seqname": "seqnames", "feature_type": "type", "frame": "phase"})
+    df["width"] = df["end"] - df["start"] + 1
+    df = df.reindex(columns=GENE_TABLE_COLUMNS)
+    for column in GENE_TABLE_COLUMNS[7:]:
+        df[column] = df[column].astype("string")
+    for column in ["seqnames", "strand", "source", "type"]:
+        df[column] = df[column].astype("category")
+    return df
+
+
+# 写出缓存文件（先写入临时文件再重命名），元数据中记录注释文件的来源信息
+def write_cache(df, path, source):
+    pa = import_pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, CACHE_METADATA_KEY: json.dumps(source)})
+    temp_file = f"{path}.tmp"
+    pa.parquet.write_table(table, temp_file, compression="zstd")
+    os.replace(temp_file, path)
+
+
+# 读取缓存文件，不存在、损坏或与注释文件不一致时返回None
+# 注释文件的大小和修改时间未变化时直接使用，否则比较校验值（如注释文件被复制或touch）
+def read_cache(path, gtf_file):
+    pa = import_pyarrow()
+    if not os.path.exists(path):
+        return None
+    try:
+        source = json.loads(pa.parquet.read_schema(path).metadata[CACHE_METADATA_KEY])
+        stat = os.stat(gtf_file)
+        if stat.st_size != source["size"] or (
+            stat.st_mtime_ns != source["mtime_ns"] and file_checksum(gtf_file) != source["sha256"]
+        ):
+            return None
+        return pa.parquet.read_table(path, memory_map=True).to_pandas()
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# 读取注释文件的缓存（name为index或genes），缓存无效时重新解析注释文件并生成所有缓存
+def load_gtf_cache(gtf_file, name="index"):
+    df = read_cache(gtf_cache_file(gtf_file, name), gtf_file)
+    if df is not None:
+        return df
+    start_time = time.time()
+    source = gtf_source(gtf_file)
+    tables = {"index": read_gtf(gtf_file)}
+    tables["genes"] = gene_table(tables["index"])
+    for key, table in tables.items():
+        write_cache(table, gtf_cache_file(gtf_file, key), source)
+    print(f"注释缓存已生成: {gtf_index_file(gtf_file)}, {gene_table_file(gtf_file)}（{len(tables['index'])}个区间，耗时{time.time() - start_time:.2f}秒）")
+    return tables[name]
+
+
+# 求DMR与注释区间的所有重叠（均为从1开始的闭区间），返回(DMR行号, 注释行号)
+# 两者都按起始位置排序，注释区间[start, end]重叠的DMR的起始位置在[start - DMR最大长度 + 1, end]之间，
+# 通过二分查找得到每个注释区间的候选DMR，再排除结束位置小于注释起始位置的DMR
+def overlap_pairs(dmrs, features):
+    dmr_rows, feature_rows = [], []
+    feature_groups = features.groupby("seqname", sort=False).indices
+    for seqname, dmr_index in dmrs.groupby("seqnames", sort=False).indices.items():
+        feature_index = feature_groups.get(seqname)
+        if feature_index is None:
+            continue
+        dmr_start = dmrs["start"].to_numpy()[dmr_index]
+        order = np.argsort(dmr_start, kind="stable")
+        dmr_index, dmr_start = dmr_index[order], dmr_start[order]
+        dmr_end = dmrs["end"].to_numpy()[dmr_index]
+        max_width = int((dmr_end - dmr_start).max()) + 1
+
+        feature_start = features["start"].to_numpy()[feature_index]
+        feature_end = features["end"].to_numpy()[feature_index]
+        first = np.searchsorted(dmr_start, feature_start - max_width + 1, side="left")
+        last = np.searchsorted(dmr_start, feature_end, side="right")
+        counts = last - first
+        feature_pairs = np.repeat(np.arange(len(feature_index)), counts)
+        dmr_pairs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        overlap = dmr_end[dmr_pairs] >= feature_start[feature_pairs]
+        dmr_rows.append(dmr_index[dmr_pairs[overlap]])
+        feature_rows.append(feature_index[feature_pairs[overlap]])
+    if not dmr_rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    dmr_rows, feature_rows = np.concatenate(dmr_rows), np.concatenate(feature_rows)
+    # 按DMR文件的顺序输出，同一DMR的注释区间按位置排序
+    order = np.lexsort((feature_rows, dmr_rows))
+    return dmr_rows[order], feature_rows[order]
+
+
+# 注释DMR文件（DMRsReplicatesBins.txt格式），输出每个DMR与重叠注释区间的组合及拆分后的属性列
+# 列与原bedtools intersect结果解析后的DMR_gene_all.tsv一致（gene_start为从0开始的bed坐标）
+def annotate_dmrs(dmr_file, gtf_file, output):
+    if os.path.getsize(dmr_file) == 0:
+        dmrs = pd.DataFrame(columns=DMR_COLUMNS)
+    else:
+        dmrs = pd.read_csv(dmr_file, sep="\t", header=None, names=DMR_COLUMNS, dtype={"seqnames": str})
+    features = load_gtf_cache(gtf_file, "index")
+    dmr_rows, feature_rows = overlap_pairs(dmrs, features)
+
+    df = dmrs.iloc[dmr_rows].reset_index(drop=True)
+    matched = features.iloc[feature_rows].reset_index(drop=True)
+    annotation = pd.DataFrame(
+        {
+            "gene_start": matched["start"] - 1,
+            "gene_end": matched["end"],
+            "strand": matched["strand"],
+            "source": matched["source"],
+            "feature_type": matched["feature_type"],
+        }
+    )
+    # 只保留有值的属性列（按在注释文件中首次出现的顺序）
+    attributes = matched.drop(columns=INDEX_COLUMNS).dropna(axis=1, how="all")
+    df = pd.concat([df, annotation, attributes], axis=1)
+    df.to_csv(output, sep="\t", index=False, na_rep="")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GTF注释索引及DMR注释")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser("index", help="生成（或更新）注释文件的区间索引及基因表")
+    index_parser.add_argument("gtf_file", type=str, help="gtf注释文件路径，支持gtf/gtf.gz格式")
+
+    annotate_parser = subparsers.add_parser("annotate", help="注释DMR区间")
+    annotate_parser.add_argument("-d", "--dmr_file", type=str, required=True, help="DMR文件（DMRsReplicatesBins.txt格式）")
+    annotate_parser.add_argument("-g", "--gtf_file", type=str, required=True, help="gtf注释文件路径，支持gtf/gtf.gz格式")
+    annotate_parser.add_argument("-o", "--output", type=str, required=True, help="注释结果的输出路径（tsv）")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        df = load_gtf_cache(args.gtf_file, "genes")
+        print(f"注释缓存: {gtf_index_file(args.gtf_file)}, {gene_table_file(args.gtf_file)}（{len(df)}个区间）")
+    else:
+        start_time = time.time()
+        df = annotate_dmrs(args.dmr_file, args.gtf_file, args.output)
+        print(f"DMR注释已输出到: {args.output}（{len(df)}行，耗时{time.time() - start_time:.2f}秒）")
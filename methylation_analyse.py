@@ -3,10 +3,19 @@ import json
 import re
 import subprocess
 import datetime
+import fcntl
+import fnmatch
+import glob
+import hashlib
+import gzip
 import os
+import shutil
 import signal
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 
 # 用于将字典参数构造成命令字符串
@@ -21,7 +30,7 @@ def dict2cmd(prefix, params):
     return cmd
 
 
-# 创建中间文件输出目录
+# 创建中间文件输出目录（设置scratch_dir时同时在scratch_dir中创建）
 def mkdirs(sample, config):
     directories = [
         "bismark_alignment",
@@ -31,7 +40,14 @@ def mkdirs(sample, config):
     ]
     if not config.skip_filter:
         directories.append("soapnuke")
-    directories = [f"{sample.output_dir}/{x}" for x in directories]
+    final_directories = ["bismark_alignment", "bismark_methylation", "bismark_deduplicate"]
+    if not config.skip_bigwig:
+        final_directories.append("bigwig")
+    directories = [f"{work_dir(sample, config)}/{x}" for x in directories]
+    directories += [f"{sample.output_dir}/{x}" for x in final_directories]
+    directories = list(dict.fromkeys(directories))
+    if not config.skip_sort:
+        directories.append(sort_temp_dir(sample, config))
     directories.append(sample.report_dir)
     directories.append(sample.log_dir)
 
@@ -44,6 +60,13 @@ def mkdirs(sample, config):
     return cmd
 
 
+# 中间文件所在的文件夹：设置scratch_dir时为本地高速磁盘上的{scratch_dir}/{sample_name}，各步骤的最终结果再移回output_dir
+def work_dir(sample, config):
+    if config.scratch_dir:
+        return f"{config.scratch_dir}/{sample.sample_name}"
+    return sample.output_dir
+
+
 # 1.创建参考基因组的索引文件（每个参考基因组只需要执行一次）
 def bismark_genome_preparation(config):
     # 文档地址：https://felixkrueger.github.io/Bismark/options/genome_preparation/
@@ -67,7 +90,10 @@ def soapnuke_filter(sample, config):
     input_file_2 = sample.input_2
     output_file_1 = f"{os.path.basename(sample.input_1)}"
     output_file_2 = f"{os.path.basename(sample.input_2)}"
-    output_dir = f"{sample.output_dir}/soapnuke/"
+    output_dir = f"{work_dir(sample, config)}/soapnuke/"
+    # 流式模式下R1写入命名管道，R2及统计报告写入stream文件夹
+    if streaming_enabled(config):
+        output_dir = f"{stream_files(sample, config).dir}/"
     # 定义参数字典
     params = {
         "-1": input_file_1,  # 输入的第一个（正向）读段文件
@@ -85,13 +111,90 @@ def soapnuke_filter(sample, config):
     return cmd
 
 
+# 获取比对步骤使用的测序文件（跳过数据过滤时直接使用原始文件）
+def clean_fastq_files(sample, config):
+    if config.skip_filter:
+        return sample.input_1, sample.input_2
+    return (
+        f"{work_dir(sample, config)}/soapnuke/{os.path.basename(sample.input_1)}",
+        f"{work_dir(sample, config)}/soapnuke/{os.path.basename(sample.input_2)}",
+    )
+
+
+# 流式模式是否生效：数据过滤的R1输出通过命名管道直接交给比对，清洗后的R1测序文件不写入磁盘
+# bismark的每个--parallel实例都要完整读取一遍输入文件，分片比对也需要先从文件拆分，这两种情况回退为普通文件
+def streaming_enabled(config):
+    return (
+        bool(config.streaming)
+        and not config.skip_filter
+        and config.parallel_alignment == 1
+        and config.alignment_chunks == 1
+    )
+
+
+# 流式模式使用的文件（与原测序文件同名，比对结果的文件名不变）：SOAPnuke写入的R1命名管道及R2文件、
+# 比对读取的两个命名管道（R1由tee转发并统计字节数，R2在SOAPnuke成功结束后转发），以及R1的字节数记录
+def stream_files(sample, config):
+    stream_dir = f"{work_dir(sample, config)}/soapnuke/stream"
+    name_1, name_2 = os.path.basename(sample.input_1), os.path.basename(sample.input_2)
+    return DotDict(
+        dir=stream_dir,
+        soapnuke_1=f"{stream_dir}/{name_1}",
+        soapnuke_2=f"{stream_dir}/{name_2}",
+        alignment_1=f"{stream_dir}/1/{name_1}",
+        alignment_2=f"{stream_dir}/2/{name_2}",
+        bytes=f"{work_dir(sample, config)}/soapnuke/streamed_bytes",
+    )
+
+
+# 流式模式下不写入清洗后测序文件路径的中间文件（完成记录中记为streamed）：R1不落盘，R2只临时写入stream文件夹，比对后删除
+def streamed_files(sample, config):
+    if not streaming_enabled(config):
+        return set()
+    return set(clean_fastq_files(sample, config))
+
+
+# 数据过滤与比对通过命名管道同时执行的命令
+# bismark先完整读取并转换R1，读到R1的末尾后才打开R2，因此只有R1通过管道实时传递；R2由SOAPnuke写入文件，
+# SOAPnuke成功结束后再转发给比对（两个文件同时通过管道传递会互相阻塞）。两端在各自的进程组中执行，
+# 任一端失败（通过USR1通知）或收到终止信号时结束另一端并回收，不会阻塞在命名管道上
+def streaming_command(sample, config, soapnuke_cmd, alignment_cmd):
+    files = stream_files(sample, config)
+    fifos = f"{files.soapnuke_1} {files.alignment_1} {files.alignment_2}"
+    producer = (
+        f"set +m; (tee {files.alignment_1} < {files.soapnuke_1} | wc -c > {files.bytes}) & t=$!; "
+        f"{soapnuke_cmd} && wait $t && cat {files.soapnuke_2} > {files.alignment_2}"
+    )
+    return (
+        f"set -o pipefail; mkdir -p {files.dir}/1 {files.dir}/2 && rm -f {fifos} && mkfifo {fifos} && "
+        f"{{ trap 'kill -- -$r1 -$r2 2>/dev/null; wait' EXIT; trap 'exit 1' USR1; trap 'exit 143' TERM INT; set -m; "
+        f"({producer} || kill -USR1 $$) & r1=$!; ({alignment_cmd} || kill -USR1 $$) & r2=$!; set +m; "
+        f"wait $r1 && wait $r2 && trap - EXIT; }} && "
+        f"find {files.dir} -maxdepth 1 -name '*.txt' -exec mv -t {os.path.dirname(files.dir)} {{}} + && "
+        f"rm -rf {files.dir}"
+    )
+
+
 # 3.序列比对（20小时）
-def bismark_alignment(sample, config):
+def bismark_alignment(sample, config, chunk=None):
     # 文档地址：https://felixkrueger.github.io/Bismark/options/alignment/
-    input_file_1 = f"{sample.output_dir}/{'soapnuke/' if not sample.skip_filter else '/'}{os.path.basename(sample.input_1)}"
-    input_file_2 = f"{sample.output_dir}/{'soapnuke/' if not sample.skip_filter else '/'}{os.path.basename(sample.input_2)}"
-    temp_dir = f"{sample.output_dir}/bismark_alignment/temp/"
-    output_dir = f"{sample.output_dir}/bismark_alignment/"
+    # 分片比对模式下返回拆分、各分片比对及合并的全部命令（用于打印和完成记录）
+    if chunk is None and config.alignment_chunks > 1:
+        split_cmd, chunk_cmds, merge_cmd = sharded_alignment_commands(sample, config)
+        return "\n".join([split_cmd, *chunk_cmds, merge_cmd])
+    input_file_1, input_file_2 = clean_fastq_files(sample, config)
+    # 流式模式下从命名管道读取数据过滤的输出
+    if chunk is None and streaming_enabled(config):
+        files = stream_files(sample, config)
+        input_file_1, input_file_2 = files.alignment_1, files.alignment_2
+    output_dir = f"{work_dir(sample, config)}/bismark_alignment/"
+    parallel_alignment = config.parallel_alignment
+    # 单个分片使用单实例比对，分片之间的并发由调度器按内存预算控制
+    if chunk is not None:
+        input_file_1, input_file_2 = chunk_fastq_files(sample, config, chunk)
+        output_dir = f"{chunk_dir(sample, config, chunk)}/"
+        parallel_alignment = 1
+    temp_dir = f"{output_dir}temp/"
     # 定义参数字典
     params = {
         "--genome": config.genome_folder,  # 指定参考基因组文件夹
@@ -101,7 +204,7 @@ def bismark_alignment(sample, config):
         # "-un": "",                           # 保存未比对的读段
         "--bowtie2": "",  # 使用 Bowtie2 作为比对工具
         "--bam": "",  # 输出文件为 BAM 格式
-        "--parallel": config.parallel_alignment,  # 线程数，需注意程序会额外占用几个线程，注意容易内存溢出
+        "--parallel": parallel_alignment,  # 线程数，需注意程序会额外占用几个线程，注意容易内存溢出
         "--temp_dir": temp_dir,  # 临时文件目录
         # "--non_directional":"",                # 测序库以非链特异性的方式构建
         "-o": output_dir,  # 指定输出文件夹
@@ -111,11 +214,96 @@ def bismark_alignment(sample, config):
     return cmd
 
 
+# 分片比对时第chunk个分片的文件夹
+def chunk_dir(sample, config, chunk):
+    return f"{work_dir(sample, config)}/bismark_alignment/chunks/{chunk}"
+
+
+# 分片后的测序文件与原文件同名，使各分片比对结果的文件名与整体比对一致
+def chunk_fastq_files(sample, config, chunk):
+    return tuple(
+        f"{chunk_dir(sample, config, chunk)}/{os.path.basename(path)}" for path in clean_fastq_files(sample, config)
+    )
+
+
+# 拆分测序文件：第i条read分配到第 i % N 个分片，两个测序文件使用相同的规则拆分，分片内的读段仍然一一配对
+def split_fastq(sample, config):
+    chunks = config.alignment_chunks
+    dirs = " ".join(chunk_dir(sample, config, chunk) for chunk in range(chunks))
+    cmds = []
+    for input_file in clean_fastq_files(sample, config):
+        name = os.path.basename(input_file)
+        writer = "gzip -1 >" if name.endswith(".gz") else "cat >"
+        awk = (
+            f"awk -v n={chunks} -v dir={work_dir(sample, config)}/bismark_alignment/chunks -v name={name} "
+            f"'{{ print | (\"{writer} \" dir \"/\" (int((NR - 1) / 4) % n) \"/\" name) }}'"
+        )
+        cmds.append(f"gzip -dcf {input_file} | {awk}")
+    # 两个文件在各自的进程组中同时拆分，任一拆分失败（通过USR1通知）或收到终止信号时结束另一个进程组并回收，不遗留后台进程
+    return (
+        f"set -o pipefail; mkdir -p {dirs} && {{ trap 'kill -- -$r1 -$r2 2>/dev/null; wait' EXIT; "
+        f"trap 'exit 1' USR1; trap 'exit 143' TERM INT; set -m; ({cmds[0]} || kill -USR1 $$) & r1=$!; "
+        f"({cmds[1]} || kill -USR1 $$) & r2=$!; set +m; wait $r1 && wait $r2 && trap - EXIT; }}"
+    )
+
+
+# 分片比对的全部命令：（拆分命令, 各分片的比对命令, 合并BAM的命令）
+def sharded_alignment_commands(sample, config):
+    chunks = range(config.alignment_chunks)
+    bam_name = f"{sample.prefix}_bismark_bt2_pe.bam"
+    chunk_bams = " ".join(f"{chunk_dir(sample, config, chunk)}/{bam_name}" for chunk in chunks)
+    merge_cmd = f"samtools cat -o {work_dir(sample, config)}/bismark_alignment/{bam_name} {chunk_bams}"
+    return split_fastq(sample, config), [bismark_alignment(sample, config, chunk) for chunk in chunks], merge_cmd
+
+
+# 合并各分片的比对报告：计数求和，百分比按合并后的计数重新计算，其余内容使用第一个分片的报告
+def merge_pe_reports(paths, output_path):
+    reports = []
+    for path in paths:
+        with open(path, "r") as file:
+            reports.append(file.read().splitlines())
+    totals = {}
+    for lines in reports:
+        for line in lines:
+            match = re.match(r"^([^:]+):\t(\d+)(\t.*)?$", line)
+            if match:
+                totals[match.group(1)] = totals.get(match.group(1), 0) + int(match.group(2))
+
+    def percentage(numerator, denominator):
+        return f"{numerator / denominator * 100:.1f}%" if denominator else None
+
+    merged = []
+    for line in reports[0]:
+        match = re.match(r"^([^:]+):\t(\d+)(\t.*)?$", line)
+        if match:
+            merged.append(f"{match.group(1)}:\t{totals[match.group(1)]}{match.group(3) or ''}")
+        elif line.startswith("Mapping efficiency:"):
+            value = percentage(
+                totals.get("Number of paired-end alignments with a unique best hit", 0),
+                totals.get("Sequence pairs analysed in total", 0),
+            )
+            merged.append(f"Mapping efficiency:\t{value} " if value else line)
+        elif re.match(r"^(C methylated in|Can't determine percentage of methylated Cs in) \w+ context", line):
+            context = re.match(r"^(C methylated in|Can't determine percentage of methylated Cs in) (\w+) context", line).group(2)
+            methylated = totals.get(f"Total methylated C's in {context} context", 0)
+            unmethylated = totals.get(f"Total unmethylated C's in {context} context", 0)
+            value = percentage(methylated, methylated + unmethylated)
+            label = "Unknown context (CN or CHN)" if context == "Unknown" else f"{context} context"
+            if value:
+                merged.append(f"C methylated in {label}:\t{value}")
+            else:
+                merged.append(f"Can't determine percentage of methylated Cs in {label} if value was 0")
+        else:
+            merged.append(line)
+    with open(output_path, "w") as file:
+        file.write("\n".join(merged) + "\n")
+
+
 # 4.去除重复片段
 def bismark_deduplicate(sample, config):
     # 文档地址：https://felixkrueger.github.io/Bismark/options/deduplication/
-    input_filename = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2_pe.bam"
-    output_dir = f"{sample.output_dir}/bismark_deduplicate/"
+    input_filename = f"{work_dir(sample, config)}/bismark_alignment/{sample.prefix}_bismark_bt2_pe.bam"
+    output_dir = f"{work_dir(sample, config)}/bismark_deduplicate/"
     # output_filename="output/bismark_deduplicate/clean_1_bismark_deduplicate_bt2_pe.bam"
     # 定义参数字典
     params = {
@@ -129,19 +317,68 @@ def bismark_deduplicate(sample, config):
     return cmd
 
 
-# 5.提取甲基化信息，并将测序数据的覆盖度转换为细胞碱基甲基化数据
+# 排序后的BAM文件（按坐标排序并建立索引，用于IGV等基因组浏览器查看及按区间读取）
+# 甲基化提取要求双端读段相邻，仍读取去重步骤输出的未排序文件
+def sorted_bam_file(sample):
+    return f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe.deduplicated.sort.bam"
+
+
+# 去重后的BAM文件：排序后的BAM文件为最终结果时作为中间文件，跳过排序时作为最终结果保存在output_dir中
+def deduplicated_bam_file(sample, config):
+    directory = sample.output_dir if config.skip_sort else work_dir(sample, config)
+    return f"{directory}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe.deduplicated.bam"
+
+
+# samtools sort的临时文件夹，设置scratch_dir时放在本地高速磁盘上
+def sort_temp_dir(sample, config):
+    if config.scratch_dir:
+        return f"{work_dir(sample, config)}/samtools_sort"
+    return f"{sample.output_dir}/bismark_deduplicate/sort_temp"
+
+
+# 按资源预算确定samtools sort的线程数及每个线程的内存（GB）：
+# 同时运行的样本平分核心数，每个样本的排序内存为内存预算的一半再平分给各线程（未设置sort_memory时限制在0.5~4GB之间）
+def sort_resources(config):
+    concurrent_samples = config.concurrent_samples or 1
+    threads = config.sort_threads or min(SORT_MAX_THREADS, config.parallel_num // concurrent_samples)
+    threads = max(1, min(threads, config.parallel_num))
+    memory = config.sort_memory
+    if not memory:
+        memory = max(0.5, min(4, config.memory_limit * 0.5 / concurrent_samples / threads))
+    return threads, memory
+
+
+# 5.按坐标排序去重后的BAM文件并建立索引
+def samtools_sort(sample, config):
+    # 文档地址：http://www.htslib.org/doc/samtools-sort.html
+    input_file = deduplicated_bam_file(sample, config)
+    threads, memory = sort_resources(config)
+    # 定义参数字典
+    params = {
+        "-@": threads,  # 排序及压缩的线程数
+        "-m": f"{int(memory * 1024)}M",  # 每个线程的内存上限，超出后写入临时文件
+        "-T": f"{sort_temp_dir(sample, config)}/{sample.prefix}",  # 临时文件的前缀
+        "-o": sorted_bam_file(sample),  # 排序后的BAM文件
+        input_file: "",  # 输入文件的路径
+    }
+    # 构造命令字符串，排序完成后建立索引
+    cmd = dict2cmd("samtools sort", params)
+    cmd += " && " + dict2cmd("samtools index", {"-@": threads, sorted_bam_file(sample): ""})
+    return cmd
+
+
+# 6.提取甲基化信息，并将测序数据的覆盖度转换为细胞碱基甲基化数据
 def bismark_methylation_extractor(sample, config):
     # 文档地址：https://felixkrueger.github.io/Bismark/options/methylation_extraction/
-    input_file = f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe.deduplicated.bam"
-    output_dir = f"{sample.output_dir}/bismark_methylation/"
+    input_file = deduplicated_bam_file(sample, config)
+    output_dir = f"{work_dir(sample, config)}/bismark_methylation/"
     # 定义参数字典
     params = {
         "--bedGraph": "",  # 生成 bedGraph 文件
         "--CX": "",  # 计算 CpG、CHG 和 CHH 位点的甲基化水平
         "--gzip": "",  # 对输出进行 gzip 压缩
-        "--multicore": config.parallel_num
-        // 3,  # 实际为3倍线程（1个用于甲基化提取器本身，1个用于Samtools流，1个用于GZIP流）
-        "--buffer_size": "30%",  # 设置缓冲区大小为 32GB、总内存的30%等
+        "--multicore": config.multicore,  # 实际为3倍线程（1个用于甲基化提取器本身，1个用于Samtools流，1个用于GZIP流）
+        "--buffer_size": config.buffer_size,  # 设置缓冲区大小为 32G、总内存的30%等
         "-o": output_dir,  # 指定输出目录
         # 同时输出cytosine_report报告的参数
         "--cytosine_report": "",  # 输出cytosine_report报告
@@ -154,52 +391,263 @@ def bismark_methylation_extractor(sample, config):
     return cmd
 
 
-# 使用自定义脚本1输出基于染色体的甲基化测序深度信息
-def methylation_depth_analysis(sample, config):
-    input_file = f'"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"'
-    output_file = f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt"
+# 甲基化提取使用--split_by_chromosome时每条染色体一个文件（相对于样本文件夹的路径，通配符匹配染色体名称）
+#   cytosine_report: {前缀}.CX_report.txt.chr{染色体}.CX_report.txt.gz
+#   按context及链拆分的甲基化信息: {CpG,CHG,CHH}_{OT,OB,CTOT,CTOB}_{前缀}.txt.chr{染色体}.txt.gz
+def cx_report_names(sample):
+    return f"bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.CX_report.txt.chr*.CX_report.txt.gz"
+
 
+def methylation_context_names(sample):
+    return f"bismark_methylation/C??_*_{sample.prefix}_bismark_bt2_pe.deduplicated.txt.chr*.txt.gz"
+
+
+# 甲基化报告的输出路径：测序深度、基于染色体和context的覆盖度、基于context的分布（按百分比）
+def methylation_report_files(sample):
+    return [
+        f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt",
+        f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt",
+        f"{sample.output_dir}/{sample.sample_name}_methylation_distribution_report.txt",
+    ]
+
+
+# 甲基化矩阵的输出文件夹
+def methylation_matrix_dir(sample):
+    return f"{sample.output_dir}/methylation_matrix"
+
+
+# 7.一次读取CX_report文件，同时输出甲基化测序深度、覆盖度及分布信息（与utils中三个C语言脚本的输出一致）
+def methylation_cx_report_analysis(sample, config):
+    input_file = f'"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"'
+    depth_report, coverage_report, distribution_report = methylation_report_files(sample)
     # 定义参数字典
     params = {
         input_file: "",  # 输入文件的路径
-        output_file: "",  # 输出文件的路径
+        "--depth_report": depth_report,  # 甲基化测序深度报告的输出路径
+        "--coverage_report": coverage_report,  # 甲基化覆盖度报告的输出路径
+        "--distribution_report": distribution_report,  # 甲基化分布报告的输出路径
+        "--parallel_num": config.parallel_num,  # 同时统计的染色体文件数（进程数）
     }
-    # 使用bash避免权限问题
-    cmd = dict2cmd(f"bash {config.utils_folder}/utils/methylation_depth_analysis", params)
+    if not config.skip_methylation_matrix:
+        params["--matrix_dir"] = methylation_matrix_dir(sample)  # 同时输出可按区间查询的甲基化矩阵
+    if config.chromosome_aliases:
+        params["--chromosome_aliases"] = config.chromosome_aliases  # 统计时将accession重命名为染色体名称
+    cmd = dict2cmd(f"python {config.utils_folder}/cx_report_analyse.py", params)
     return cmd
 
 
-# 使用自定义脚本2输出基于染色体和context的甲基化覆盖的统计信息
-def methylation_coverage_analyse(sample):
-    input_file = f'"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"'
-    output_file = f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt"
+# bigWig文件的输出前缀：{前缀}.bigwig（所有context）及{前缀}.{context}.bigwig
+def bigwig_prefix(sample):
+    return f"{sample.output_dir}/bigwig/{sample.sample_name}"
 
-    # 定义参数字典
+
+# bigWig文件及吞吐量统计的输出路径
+def bigwig_files(sample):
+    prefix = bigwig_prefix(sample)
+    return [f"{prefix}.bigwig"] + [f"{prefix}.{context}.bigwig" for context in ["CG", "CHG", "CHH"]] + [
+        f"{prefix}.bigwig_throughput.json"
+    ]
+
+
+# 8.由bedGraph.gz及CX_report文件流式生成bigWig文件（不解压到磁盘，输入未排序时才做外部排序），各文件由不同进程同时生成
+def methylation_bigwig(sample, config):
+    methylation_prefix = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated"
     params = {
-        input_file: "",  # 输入文件的路径
-        output_file: "",  # 输出文件的路径
+        "--bedgraph": f"{methylation_prefix}.bedGraph.gz",  # 所有context的bedGraph
+        "--cx_reports": f'"{methylation_prefix}.CX_report.txt*.gz"',  # 按context生成bigWig的CX_report文件
+        "--genome": " ".join(genome_fasta_files(config.genome_folder)),  # 读取染色体长度（优先读取fai文件）
+        "--output_prefix": bigwig_prefix(sample),  # 输出文件前缀
+        "--temp_dir": f"{work_dir(sample, config)}/bigwig/temp",  # 外部排序的临时文件夹
+        "--throughput": bigwig_files(sample)[-1],  # 吞吐量统计的输出路径
+        "--parallel_num": min(BIGWIG_TRACKS, config.parallel_num),  # 同时生成的bigWig文件数（进程数）
     }
-    # 使用bash避免权限问题
-    cmd = dict2cmd(f"bash {config.utils_folder}/utils/methylation_coverage_analyse", params)
+    if config.chromosome_aliases:
+        params["--chromosome_aliases"] = config.chromosome_aliases  # bigWig中使用重命名后的染色体名称
+    cmd = dict2cmd(f"python {config.utils_folder}/methylation_bigwig.py", params)
     return cmd
 
 
-# 使用自定义脚本3输出基于染色体和context的甲基化分布信息（按百分比）
-def methylation_distribution_analysis(sample):
-    input_file = f'"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"'
-    output_file = f"{sample.output_dir}/{sample.sample_name}_methylation_distribution_report.txt"
-    # 定义参数字典
+# 样本汇总文件的路径：比对、去重、甲基化提取及甲基化统计报告汇总后的列式存储文件
+def sample_summary_file(sample):
+    return f"{sample.output_dir}/{sample.sample_name}_summary.parquet"
+
+
+# 样本汇总步骤的输入文件（与stage_files中的顺序一致）
+def sample_summary_inputs(sample):
+    alignment_prefix = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2"
+    deduplicate_prefix = f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe"
+    methylation_prefix = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated"
+    depth_report, coverage_report, distribution_report = methylation_report_files(sample)
+    return {
+        "--pe_report": f"{alignment_prefix}_PE_report.txt",
+        "--deduplication_report": f"{deduplicate_prefix}.deduplication_report.txt",
+        "--splitting_report": f"{methylation_prefix}_splitting_report.txt",
+        "--mbias": f"{methylation_prefix}.M-bias.txt",
+        "--depth_report": depth_report,
+        "--coverage_report": coverage_report,
+        "--distribution_report": distribution_report,
+    }
+
+
+# 9.将样本的各项报告汇总为一个Parquet文件，供质控报告及R脚本读取
+def sample_summary(sample, config):
     params = {
-        input_file: "",  # 输入文件的路径
-        output_file: "",  # 输出文件的路径
+        "--sample_name": sample.sample_name,  # 样本名称
+        **sample_summary_inputs(sample),  # 各项报告的路径
+        "--output": sample_summary_file(sample),  # 汇总文件的输出路径
     }
-    # 使用bash避免权限问题
-    cmd = dict2cmd(f"bash {config.utils_folder}/utils/methylation_distribution_analysis", params)
+    cmd = dict2cmd(f"python {config.utils_folder}/sample_summary.py", params)
     return cmd
 
 
-# 执行命令，并将结果重定向到log文件
-def execute_shell_command(command, log_dir="./log/"):
+# 所有样本处理完成后，将各样本的甲基化矩阵合并为一个按位置排序的多样本矩阵（每条染色体一次k路归并）
+def cohort_matrix(samples, config):
+    params = {
+        "merge": "",
+        **{f"{sample.sample_name}={methylation_matrix_dir(sample)}": "" for sample in samples},  # 样本名称及其甲基化矩阵
+        "--output_dir": config.cohort_matrix_dir,  # 合并矩阵的输出文件夹
+        "--parallel_num": config.parallel_num,  # 同时合并的染色体数（进程数）
+    }
+    cmd = dict2cmd(f"python {config.utils_folder}/methylation_matrix.py", params)
+    return cmd
+
+
+# 正在运行的子进程（多个样本并发时用于统一终止）
+RUNNING_PROCESSES = set()
+RUNNING_PROCESSES_LOCK = threading.Lock()
+
+
+# 统计进程组中所有进程的常驻内存（GB）
+def process_group_rss_gb(pgid):
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "r") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            # 第5列为进程组ID，第24列为常驻内存页数（去掉pid和进程名后的下标分别为2和21）
+            if int(fields[2]) == pgid:
+                total += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / 1024**3
+
+
+# 定期统计进程组的内存占用，记录峰值（进程结束后由主线程设置finished）
+def monitor_process_group(pgid, usage, finished, interval=1):
+    usage.setdefault("peak_group_rss_gb", 0)
+    while not finished.wait(interval):
+        usage["peak_group_rss_gb"] = max(usage["peak_group_rss_gb"], process_group_rss_gb(pgid))
+
+
+# 资源记录的字段（TSV文件的列顺序）
+RESOURCE_FIELDS = [
+    "stage",
+    "tag",
+    "start_time",
+    "end_time",
+    "wall_seconds",
+    "user_cpu_seconds",
+    "system_cpu_seconds",
+    "cpu_utilization",
+    "max_process_rss_gb",
+    "peak_group_rss_gb",
+    "read_bytes",
+    "write_bytes",
+    "returncode",
+    "log_file",
+    "command",
+]
+RESOURCE_LOCK = threading.Lock()
+
+# 日志记录方式，由命令行或配置文件的参数设置
+#   mode: line（逐行写入并立即刷新）或buffered（块缓冲写入，按时间间隔刷新）
+#   flush_interval: buffered模式下日志文件的刷新间隔（秒）
+#   console_interval: 控制台输出的最小间隔（秒），间隔内的其他行只写入日志，0表示全部输出
+#   compress: 是否使用gzip压缩日志文件
+LOG_OPTIONS = {"mode": "line", "flush_interval": 5, "console_interval": 0, "compress": False}
+
+
+# 逐行读取子进程的输出，写入日志并立即刷新，同时打印到控制台
+def capture_output_by_line(process, log_file, console_prefix):
+    for line in process.stdout:
+        # 获取当前时间，格式为 HH:MM:SS
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        # 写入日志文件，每行以时间开头
+        log_file.write(f"[{timestamp}] {line}".encode())
+        log_file.flush()  # 立即写入文件
+
+        # 同时也可以选择打印输出到控制台
+        print(f"[{timestamp}] {console_prefix}{line}", end="")
+
+
+# 以块缓冲方式读取子进程的输出：时间戳每秒只格式化一次，日志按时间间隔刷新，控制台输出按间隔抽样
+def capture_output_buffered(process, log_file, console_prefix):
+    flush_interval = LOG_OPTIONS["flush_interval"]
+    console_interval = LOG_OPTIONS["console_interval"]
+    current_second = None
+    last_flush = time.time()
+    last_print = 0
+    skipped = 0
+    for line in process.stdout:
+        now = time.time()
+        if int(now) != current_second:
+            current_second = int(now)
+            timestamp = time.strftime("%H:%M:%S", time.localtime(now))
+            prefix = f"[{timestamp}] ".encode()
+        log_file.write(prefix + line)
+        if now - last_flush >= flush_interval:
+            log_file.flush()
+            last_flush = now
+        if now - last_print >= console_interval:
+            omitted = f"（省略{skipped}行）" if skipped else ""
+            print(f"[{timestamp}] {console_prefix}{omitted}{line.decode(errors='replace')}", end="")
+            last_print = now
+            skipped = 0
+        else:
+            skipped += 1
+    if skipped:
+        print(f"[{timestamp}] {console_prefix}（省略{skipped}行，完整输出见日志文件）")
+
+
+# 将单个命令的资源记录写入日志旁的json文件，并追加到日志文件夹的resource_usage.tsv中
+def write_resource_record(usage, log_file_name, log_dir):
+    with open(f"{log_file_name}.resource.json", "w") as file:
+        json.dump(usage, file, indent=2, ensure_ascii=False)
+    tsv_path = f"{log_dir}/resource_usage.tsv"
+    with RESOURCE_LOCK:
+        write_header = not os.path.exists(tsv_path)
+        with open(tsv_path, "a") as file:
+            if write_header:
+                file.write("\t".join(RESOURCE_FIELDS) + "\n")
+            file.write("\t".join(str(usage[key]).replace("\t", " ") for key in RESOURCE_FIELDS) + "\n")
+
+
+# 定义一个用于处理进程结束时的信号，终止所有正在运行的子进程组
+def kill_child_processes(signum, frame):
+    print("Received signal to terminate, killing all child processes...")
+    with RUNNING_PROCESSES_LOCK:
+        processes = list(RUNNING_PROCESSES)
+    for process in processes:
+        try:
+            # 发送信号给整个进程组
+            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    # 使用os._exit确保其他样本的线程也一并退出
+    os._exit(1)
+
+
+# 注册信号处理函数（只能在主线程中调用）
+def register_signal_handlers():
+    signal.signal(signal.SIGINT, kill_child_processes)  # Ctrl+C
+    signal.signal(signal.SIGTERM, kill_child_processes)  # kill 命令
+
+
+# 执行命令，并将结果重定向到log文件（tag用于在控制台区分并发运行的样本）
+# 同时统计子进程组的资源占用（耗时、CPU时间、内存峰值、读写字节数），写入日志旁的资源记录，usage参数可获取该记录
+def execute_shell_command(command, log_dir="./log/", tag=None, stage=None, usage=None):
     # 检查并创建日志目录
     if not os.path.exists(log_dir):
         os.makedirs(log_dir, exist_ok=True)
@@ -218,51 +666,78 @@ def execute_shell_command(command, log_dir="./log/"):
     # 获取当前时间作为日志文件名的一部分
     current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     log_file_name = f"{log_dir}/{current_time}_{program_name}.log"
-
-    # 定义一个用于处理进程结束时的信号
-    def kill_child_processes(signum, frame):
-        print("Received signal to terminate, killing all child processes...")
-        # 发送信号给整个进程组
-        os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-        sys.exit(1)
-
-    # 注册信号处理函数，处理进程终止的信号
-    signal.signal(signal.SIGINT, kill_child_processes)  # Ctrl+C
-    signal.signal(signal.SIGTERM, kill_child_processes)  # kill 命令
+    buffered = LOG_OPTIONS["mode"] == "buffered"
+    if LOG_OPTIONS["compress"]:
+        log_file_name += ".gz"
+        log_file = gzip.open(log_file_name, "wb", compresslevel=1)
+    else:
+        log_file = open(log_file_name, "wb", buffering=1024 * 1024 if buffered else -1)
 
     # 打开日志文件用于写入
-    with open(log_file_name, "w") as log_file:
+    with log_file:
         # 获取当前时间，格式为 HH:MM:SS
         current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         # 先将完整的命令写入日志
-        log_file.write(f"[{current_time}] Executing command: {command}\n")
+        log_file.write(f"[{current_time}] Executing command: {command}\n".encode())
         log_file.flush()
-        # 创建一个子进程
+        # 创建一个子进程（buffered模式下以二进制读取，避免逐行解码）
         process = subprocess.Popen(
             command,
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,  # 设置行缓冲
+            universal_newlines=not buffered,
+            bufsize=1024 * 1024 if buffered else 1,  # 设置块缓冲或行缓冲
             preexec_fn=os.setsid,  # 将子进程放入新的进程组
             executable="/bin/bash",
             env={**os.environ, "PYTHONUNBUFFERED": "1"},
         )
+        with RUNNING_PROCESSES_LOCK:
+            RUNNING_PROCESSES.add(process)
+        # 在后台线程中定期统计整个进程组的内存占用峰值
+        usage = {} if usage is None else usage
+        start_time = time.time()
+        finished = threading.Event()
+        threading.Thread(target=monitor_process_group, args=(process.pid, usage, finished), daemon=True).start()
 
         # 实时读取子进程的输出并写入日志
-        for line in process.stdout:
-            # 获取当前时间，格式为 HH:MM:SS
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            # 写入日志文件，每行以时间开头
-            log_file.write(f"[{timestamp}] {line}")
-            log_file.flush()  # 立即写入文件
-
-            # 同时也可以选择打印输出到控制台
-            print(f"[{timestamp}] {line}", end="")
-
-        # 等待进程结束
-        process.wait()
+        console_prefix = f"[{tag}] " if tag else ""
+        if buffered:
+            capture_output_buffered(process, log_file, console_prefix)
+        else:
+            capture_output_by_line(process, log_file, console_prefix)
+
+        # 等待进程结束，wait4返回子进程及其已结束的所有后代进程的资源统计
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        finished.set()
+        with RUNNING_PROCESSES_LOCK:
+            RUNNING_PROCESSES.discard(process)
+
+        wall_seconds = time.time() - start_time
+        usage.update(
+            {
+                "stage": stage or program_name,
+                "tag": tag or "",
+                "start_time": datetime.datetime.fromtimestamp(start_time).strftime("%Y-%m-%d %H:%M:%S"),
+                "end_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "wall_seconds": round(wall_seconds, 2),
+                "user_cpu_seconds": round(rusage.ru_utime, 2),
+                "system_cpu_seconds": round(rusage.ru_stime, 2),
+                # 平均同时使用的核心数
+                "cpu_utilization": round((rusage.ru_utime + rusage.ru_stime) / max(wall_seconds, 0.01), 2),
+                # ru_maxrss为单个进程的内存峰值（KB），peak_group_rss_gb为整个进程组同时占用内存的峰值（按秒采样）
+                "max_process_rss_gb": round(rusage.ru_maxrss / 1024**2, 3),
+                "peak_group_rss_gb": round(max(usage.get("peak_group_rss_gb", 0), rusage.ru_maxrss / 1024**2), 3),
+                # 块设备实际读写量（每块512字节）
+                "read_bytes": rusage.ru_inblock * 512,
+                "write_bytes": rusage.ru_oublock * 512,
+                "returncode": process.returncode,
+                "log_file": log_file_name,
+                "command": command,
+            }
+        )
+        write_resource_record(usage, log_file_name, log_dir)
 
         # 检查退出状态码，非 0 表示执行失败
         if process.returncode != 0:
@@ -272,6 +747,1026 @@ def execute_shell_command(command, log_dir="./log/"):
     return process.returncode
 
 
+# 汇总所有样本的资源记录：按步骤统计耗时、CPU时间、内存峰值及读写量，输出为tsv文件
+def summarize_resource_usage(samples, output_file):
+    import pandas as pd
+
+    records = []
+    for sample in samples:
+        path = f"{sample.log_dir}/resource_usage.tsv"
+        if not os.path.exists(path):
+            print(f"样本{sample.sample_name}没有资源记录: {path}")
+            continue
+        df = pd.read_csv(path, sep="\t")
+        df["sample_name"] = sample.sample_name
+        records.append(df)
+    if not records:
+        raise FileNotFoundError("未找到任何资源记录")
+    df = pd.concat(records, ignore_index=True)
+    df["cpu_seconds"] = df["user_cpu_seconds"] + df["system_cpu_seconds"]
+
+    summary = df.groupby("stage", sort=False).agg(
+        samples=("sample_name", "nunique"),
+        runs=("stage", "size"),
+        failed_runs=("returncode", lambda codes: int((codes != 0).sum())),
+        total_wall_hours=("wall_seconds", lambda values: values.sum() / 3600),
+        mean_wall_hours=("wall_seconds", lambda values: values.mean() / 3600),
+        max_wall_hours=("wall_seconds", lambda values: values.max() / 3600),
+        total_cpu_hours=("cpu_seconds", lambda values: values.sum() / 3600),
+        mean_cpu_utilization=("cpu_utilization", "mean"),
+        max_peak_group_rss_gb=("peak_group_rss_gb", "max"),
+        total_read_gb=("read_bytes", lambda values: values.sum() / 1024**3),
+        total_write_gb=("write_bytes", lambda values: values.sum() / 1024**3),
+    )
+    # 耗时占比，用于判断瓶颈步骤
+    summary["wall_percentage"] = summary["total_wall_hours"] / summary["total_wall_hours"].sum() * 100
+    summary = summary.round(3).sort_values("total_wall_hours", ascending=False)
+    summary.to_csv(output_file, sep="\t")
+    print(summary.to_string())
+    print(f"资源汇总已输出到: {output_file}")
+    return summary
+
+
+# 各步骤的输入和输出文件（支持通配符），用于生成和校验完成记录
+# 设置scratch_dir时，中间文件为scratch_dir中的路径，移回output_dir的最终结果为output_dir中的路径
+def stage_files(stage, sample, config):
+    alignment_prefix = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2"
+    deduplicate_prefix = f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe"
+    methylation_prefix = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated"
+    cx_reports = f"{sample.output_dir}/{cx_report_names(sample)}"
+    alignment_bam = f"{work_dir(sample, config)}/bismark_alignment/{sample.prefix}_bismark_bt2_pe.bam"
+    if stage == "soapnuke_filter":
+        return [sample.input_1, sample.input_2], list(clean_fastq_files(sample, config))
+    if stage == "bismark_alignment":
+        return list(clean_fastq_files(sample, config)), [
+            alignment_bam,
+            f"{alignment_prefix}_PE_report.txt",
+        ]
+    if stage == "bismark_deduplicate":
+        return [alignment_bam], [
+            deduplicated_bam_file(sample, config),
+            f"{deduplicate_prefix}.deduplication_report.txt",
+        ]
+    if stage == "samtools_sort":
+        return [deduplicated_bam_file(sample, config)], [sorted_bam_file(sample), f"{sorted_bam_file(sample)}.bai"]
+    if stage == "bismark_methylation_extractor":
+        return [deduplicated_bam_file(sample, config)], [
+            cx_reports,
+            f"{methylation_prefix}_splitting_report.txt",
+            f"{methylation_prefix}.M-bias.txt",
+            f"{methylation_prefix}.bedGraph.gz",
+        ]
+    # 染色体名称对照表变化时重新执行使用对照表的步骤
+    aliases = [config.chromosome_aliases] if config.chromosome_aliases else []
+    if stage == "methylation_cx_report_analysis":
+        outputs = methylation_report_files(sample)
+        if not config.skip_methylation_matrix:
+            outputs.append(f"{methylation_matrix_dir(sample)}/index.json")
+        return [cx_reports] + aliases, outputs
+    if stage == "methylation_bigwig":
+        return [f"{methylation_prefix}.bedGraph.gz", cx_reports] + aliases, bigwig_files(sample)
+    if stage == "sample_summary":
+        return list(sample_summary_inputs(sample).values()), [sample_summary_file(sample)]
+    return [], []
+
+
+# 展开通配符并记录每个文件的大小和修改时间，任一模式匹配不到文件时返回None
+# 使用完毕后被删除的中间文件记录为removed，流式模式下通过命名管道传递、不落盘的中间文件记录为streamed
+def file_signatures(patterns, removed=(), streamed=()):
+    signatures = {}
+    for pattern in patterns:
+        if pattern in streamed:
+            signatures[pattern] = {"streamed": True}
+            continue
+        paths = sorted(glob.glob(pattern))
+        if not paths and pattern in removed:
+            signatures[pattern] = {"removed": True}
+            continue
+        if not paths:
+            return None
+        for path in paths:
+            stat = os.stat(path)
+            signatures[path] = {"size": stat.st_size, "mtime": stat.st_mtime}
+    return signatures
+
+
+# BAM文件末尾固定的BGZF结束块，缺失说明文件被截断
+BAM_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+# 检查输出文件的内容是否完整（目前检查BAM文件的结束块）
+def is_complete_file(path):
+    if path.endswith(".bam"):
+        with open(path, "rb") as file:
+            file.seek(max(0, os.path.getsize(path) - len(BAM_EOF)))
+            return file.read() == BAM_EOF
+    return True
+
+
+# 完成记录的保存路径
+def manifest_path(stage, sample):
+    return f"{sample.output_dir}/manifests/{stage}.json"
+
+
+# 各步骤中只影响线程数、内存及临时文件位置而不影响结果的参数（其他参数即使同名也会影响结果，不能忽略）
+TUNING_FLAGS = {
+    "bismark_alignment": ["--parallel"],
+    "samtools_sort": ["-@", "-m", "-T"],
+    "bismark_methylation_extractor": ["--multicore", "--buffer_size"],
+    "methylation_cx_report_analysis": ["--parallel_num"],
+    "methylation_bigwig": ["--parallel_num", "--temp_dir"],
+}
+
+
+# 比较命令时忽略该步骤的资源参数
+def normalize_command(cmd, stage):
+    flags = TUNING_FLAGS.get(stage)
+    if not flags:
+        return cmd
+    return re.sub(rf" ({'|'.join(re.escape(flag) for flag in flags)}) \S+", "", cmd)
+
+
+# 步骤成功后写入完成记录（输入文件状态、执行的命令、输出文件状态，流式模式下另记录避免写入磁盘的字节数）
+def write_manifest(stage, sample, config, cmd, inputs, streamed_bytes=None):
+    _, output_patterns = stage_files(stage, sample, config)
+    manifest = {
+        "stage": stage,
+        "command": cmd,
+        "inputs": inputs,
+        "outputs": file_signatures(output_patterns, read_removed(sample), streamed_files(sample, config)),
+        "finished_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if streamed_bytes:
+        manifest["streamed_bytes"] = streamed_bytes
+    if manifest["outputs"] is None:
+        raise RuntimeError(f"步骤{stage}执行完成，但未找到输出文件: {output_patterns}")
+    path = manifest_path(stage, sample)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再重命名，避免中断时留下不完整的记录
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+# 检查完成记录是否仍然有效：命令相同，输入和输出文件均未被修改
+def check_manifest(stage, sample, config, cmd):
+    path = manifest_path(stage, sample)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return False
+    input_patterns, output_patterns = stage_files(stage, sample, config)
+    if normalize_command(manifest.get("command", ""), stage) != normalize_command(cmd, stage):
+        return False
+    removed = read_removed(sample)
+    streamed = streamed_files(sample, config)
+    if file_signatures(input_patterns, removed, streamed) != manifest.get("inputs"):
+        return False
+    outputs = file_signatures(output_patterns, removed, streamed)
+    if outputs is None or outputs != manifest.get("outputs"):
+        return False
+    return all(is_complete_file(path) for path, signature in outputs.items() if "size" in signature)
+
+
+# 各步骤在work_dir中生成、需要移回output_dir的最终结果（相对于样本文件夹的路径，支持通配符）
+def published_files(stage, sample, config):
+    deduplicate_prefix = f"bismark_deduplicate/{sample.prefix}_bismark_bt2_pe"
+    methylation_prefix = f"bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated"
+    if stage == "soapnuke_filter":
+        return ["soapnuke/*.txt"]
+    if stage == "bismark_alignment":
+        return [f"bismark_alignment/{sample.prefix}_bismark_bt2_PE_report.txt"]
+    if stage == "bismark_deduplicate":
+        files = [f"{deduplicate_prefix}.deduplication_report.txt"]
+        if config.skip_sort:
+            files.append(f"{deduplicate_prefix}.deduplicated.bam")
+        return files
+    if stage == "bismark_methylation_extractor":
+        return [
+            cx_report_names(sample),
+            f"{methylation_prefix}_splitting_report.txt",
+            f"{methylation_prefix}.M-bias.txt",
+            f"{methylation_prefix}.bedGraph.gz",
+            f"{methylation_prefix}.bismark.cov.gz",
+            f"{methylation_prefix}.cytosine_context_summary.txt",
+        ]
+    return []
+
+
+# 将步骤的最终结果从scratch_dir移回output_dir（跨文件系统时先复制为临时文件再重命名，避免留下不完整的文件）
+def publish_outputs(stage, sample, config):
+    source_dir = work_dir(sample, config)
+    if source_dir == sample.output_dir:
+        return
+    for pattern in published_files(stage, sample, config):
+        for path in sorted(glob.glob(f"{source_dir}/{pattern}")):
+            target = f"{sample.output_dir}/{os.path.relpath(path, source_dir)}"
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, f"{target}.tmp")
+            os.replace(f"{target}.tmp", target)
+
+
+# 中间文件（支持通配符）及使用它的步骤，设置scratch_dir时在所有使用它的步骤成功后删除
+# 跳过数据过滤时比对直接读取原始测序文件，跳过排序时去重后的BAM文件为最终结果，均不属于中间文件
+def intermediate_files(sample, config):
+    work = work_dir(sample, config)
+    intermediates = {}
+    if not config.skip_filter:
+        for path in clean_fastq_files(sample, config):
+            intermediates[path] = ["bismark_alignment"]
+    intermediates[f"{work}/bismark_alignment/temp"] = ["bismark_alignment"]
+    intermediates[f"{work}/bismark_alignment/{sample.prefix}_bismark_bt2_pe.bam"] = ["bismark_deduplicate"]
+    if not config.skip_sort:
+        intermediates[deduplicated_bam_file(sample, config)] = ["samtools_sort", "bismark_methylation_extractor"]
+    # 按context及链拆分的甲基化信息（体积最大），cytosine_report及bedGraph生成后不再使用
+    intermediates[f"{work}/{methylation_context_names(sample)}"] = ["bismark_methylation_extractor"]
+    return intermediates
+
+
+# 已删除的中间文件记录的保存路径
+def removed_record_path(sample):
+    return f"{sample.output_dir}/manifests/removed_intermediates.json"
+
+
+# 读取已删除的中间文件（通配符模式）
+def read_removed(sample):
+    path = removed_record_path(sample)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as file:
+        return set(json.load(file))
+
+
+# 保存已删除的中间文件（先写临时文件再重命名）
+def write_removed(sample, removed):
+    path = removed_record_path(sample)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(sorted(removed), file, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+# 步骤重新执行前，从记录中移除该步骤的输出文件（重新生成后按实际文件校验）
+def forget_removed(stage, sample, config):
+    removed = read_removed(sample)
+    outputs = set(stage_files(stage, sample, config)[1])
+    if removed & outputs:
+        write_removed(sample, removed - outputs)
+
+
+# 记录已删除的中间文件，并将样本所有完成记录中对应的文件状态替换为removed，使完成记录在文件删除后仍然有效
+def mark_removed(sample, patterns):
+    write_removed(sample, read_removed(sample) | set(patterns))
+    for path in glob.glob(f"{sample.output_dir}/manifests/*.json"):
+        if path == removed_record_path(sample):
+            continue
+        with open(path, "r") as file:
+            manifest = json.load(file)
+        changed = False
+        for key in ["inputs", "outputs"]:
+            signatures = manifest.get(key) or {}
+            for pattern in patterns:
+                matched = [name for name in signatures if fnmatch.fnmatchcase(name, pattern)]
+                if matched and signatures.get(pattern) != {"removed": True}:
+                    for name in matched:
+                        del signatures[name]
+                    signatures[pattern] = {"removed": True}
+                    changed = True
+        if changed:
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(manifest, file, indent=2, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+
+
+# 删除所有使用者均已成功的中间文件，返回是否删除了文件
+def remove_intermediates(sample, config, stage_names, completed):
+    patterns = []
+    for pattern, consumers in intermediate_files(sample, config).items():
+        consumers = [stage for stage in consumers if stage in stage_names]
+        if not consumers or not set(consumers) <= completed:
+            continue
+        # 每次运行都会重新创建的空文件夹无需删除
+        paths = [path for path in glob.glob(pattern) if not (os.path.isdir(path) and not os.listdir(path))]
+        if not paths:
+            continue
+        for path in paths:
+            remove_path(path)
+        print(f"[{sample.sample_name}] 删除中间文件: {pattern}")
+        patterns.append(pattern)
+    if patterns:
+        mark_removed(sample, patterns)
+    return bool(patterns)
+
+
+# 找出需要重新生成已删除中间文件的步骤：需要执行的步骤的输入文件已被删除时，其生成步骤也需要重新执行
+# 倒序检查，使重新执行的生成步骤的输入文件也能继续向前追溯
+def stages_to_restore(stages, sample, config):
+    removed = read_removed(sample)
+    if not removed:
+        return set()
+    producers = {}
+    for stage, _, _ in stages:
+        for pattern in stage_files(stage, sample, config)[1]:
+            producers[pattern] = stage
+    restore = set()
+    for stage, _, cmd in reversed(stages):
+        if stage == "mkdirs":
+            continue
+        if stage not in restore and not is_forced(stage, config) and check_manifest(stage, sample, config, cmd):
+            continue
+        for pattern in stage_files(stage, sample, config)[0]:
+            if pattern in removed and pattern in producers and not glob.glob(pattern):
+                restore.add(producers[pattern])
+    return restore
+
+
+DISK_USAGE_INTERVAL = 30  # 磁盘占用的采样间隔（秒）
+
+
+# 统计文件夹实际占用的磁盘空间（字节，按已分配的块计算，不跟随符号链接）
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                continue
+    return total
+
+
+# 更新样本output_dir及scratch_dir的磁盘占用及峰值
+def update_disk_usage(sample, config, usage):
+    output_bytes = disk_usage(sample.output_dir)
+    scratch_bytes = disk_usage(work_dir(sample, config)) if config.scratch_dir else 0
+    usage["peak_output_bytes"] = max(usage.get("peak_output_bytes", 0), output_bytes)
+    usage["peak_scratch_bytes"] = max(usage.get("peak_scratch_bytes", 0), scratch_bytes)
+    usage["peak_total_bytes"] = max(usage.get("peak_total_bytes", 0), output_bytes + scratch_bytes)
+    return output_bytes, scratch_bytes
+
+
+# 定期采样磁盘占用的峰值（样本处理结束后由主线程设置finished），步骤执行过程中的临时文件也计入峰值
+def monitor_disk_usage(sample, config, usage, finished, interval=DISK_USAGE_INTERVAL):
+    while not finished.wait(interval):
+        update_disk_usage(sample, config, usage)
+
+
+# 记录步骤结束（或清理中间文件）时的磁盘占用，并写入{log_dir}/disk_usage.json
+def record_disk_usage(sample, config, usage, event):
+    output_bytes, scratch_bytes = update_disk_usage(sample, config, usage)
+    usage.setdefault("records", []).append(
+        {
+            "event": event,
+            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "output_bytes": output_bytes,
+            "scratch_bytes": scratch_bytes,
+        }
+    )
+    usage["final_output_bytes"] = output_bytes
+    usage["final_scratch_bytes"] = scratch_bytes
+    path = f"{sample.log_dir}/disk_usage.json"
+    os.makedirs(sample.log_dir, exist_ok=True)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump({"sample_name": sample.sample_name, **usage}, file, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+# 读取可用的物理内存总量（GB），在容器中运行时以cgroup的内存上限为准
+def detect_memory_gb():
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+        try:
+            with open(path, "r") as file:
+                limit = file.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            memory = min(memory, int(limit))
+    return memory / 1024**3
+
+
+# 读取当前进程可用的CPU核心数（考虑CPU亲和性及cgroup限制）
+def detect_cores():
+    cores = len(os.sched_getaffinity(0))
+    for path in ["/sys/fs/cgroup/cpu.max"]:
+        try:
+            with open(path, "r") as file:
+                quota, period = file.read().split()
+        except (OSError, ValueError):
+            continue
+        if quota != "max":
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    return cores
+
+
+# bismark_genome_preparation生成的bowtie2索引文件（Bisulfite_Genome/{CT,GA}_conversion/BS_{CT,GA}.{后缀}.bt2，大基因组为.bt2l）
+BOWTIE2_INDEX_SUFFIXES = ["1", "2", "3", "4", "rev.1", "rev.2"]
+
+
+# 参考基因组文件夹中的FASTA文件（与bismark_genome_preparation识别的扩展名一致）
+def genome_fasta_files(genome_folder):
+    return sorted(
+        path for path in glob.glob(f"{genome_folder}/*") if re.search(r"\.(fa|fasta)(\.gz)?$", os.path.basename(path))
+    )
+
+
+# 估算参考基因组大小（GB），gz压缩的FASTA文件按约3.3倍压缩率估算
+def genome_size_gb(genome_folder):
+    size = 0
+    for path in genome_fasta_files(genome_folder):
+        size += os.path.getsize(path) * (3.3 if path.endswith(".gz") else 1)
+    return size / 1024**3
+
+
+# 估算每个比对实例的内存（GB）：两个bowtie2进程分别加载C->T和G->A转换后的索引，另加bismark及samtools的开销
+def estimate_alignment_memory(genome_folder):
+    indexes = glob.glob(f"{genome_folder}/Bisulfite_Genome/*_conversion/*.bt2*")
+    if indexes:
+        index_gb = sum(os.path.getsize(path) for path in indexes) / 1024**3
+    else:
+        # 索引尚未构建时，每个转换索引约为基因组大小的1.2倍
+        index_gb = genome_size_gb(genome_folder) * 2.4
+    return round(index_gb + 2, 1)
+
+
+# --buffer_size对应的内存（GB），与sort -S相同：支持百分比或带单位的大小，b为字节，不带单位时为KiB
+def buffer_size_gb(config):
+    value = str(config.buffer_size)
+    if value.endswith("%"):
+        return config.memory_limit * float(value[:-1]) / 100
+    units = {"B": 1 / 1024**3, "K": 1 / 1024**2, "M": 1 / 1024, "G": 1, "T": 1024}
+    if value[-1].upper() in units:
+        return float(value[:-1]) * units[value[-1].upper()]
+    return float(value) / 1024**2
+
+
+# 在小样本上试运行比对和甲基化提取，测量单个实例的内存峰值（GB），结果缓存在calibration.json中
+def calibrate_memory(sample, config):
+    calibration_dir = f"{sample.output_dir}/calibration"
+    result_path = f"{calibration_dir}/calibration.json"
+    if os.path.exists(result_path):
+        with open(result_path, "r") as file:
+            result = json.load(file)
+        if result.get("genome_folder") == config.genome_folder:
+            print(f"检测到内存校准结果，跳过校准: {result_path}")
+            return result
+    os.makedirs(calibration_dir, exist_ok=True)
+
+    # 截取前10万对读段
+    subsample = DotDict(sample, output_dir=calibration_dir, log_dir=f"{calibration_dir}/log")
+    for key in ["input_1", "input_2"]:
+        subsample[key] = f"{calibration_dir}/{os.path.basename(sample[key])}"
+        writer = "gzip -1 >" if subsample[key].endswith(".gz") else "cat >"
+        cmd = f"set -o pipefail; gzip -dcf {sample[key]} | head -n 400000 | {writer} {subsample[key]}"
+        execute_shell_command(cmd, subsample.log_dir, tag="calibration")
+    calibration_config = DotDict(config, skip_filter=True, parallel_alignment=1, alignment_chunks=1, scratch_dir=None)
+    calibration_config.multicore = 1
+    calibration_config.buffer_size = "1G"
+
+    result = {"genome_folder": config.genome_folder}
+    for stage, build_command, field in [
+        ("bismark_alignment", bismark_alignment, "alignment_memory"),
+        ("bismark_methylation_extractor", bismark_methylation_extractor, "extractor_memory"),
+    ]:
+        cmd = build_command(subsample, calibration_config)
+        if stage == "bismark_methylation_extractor":
+            # 直接使用试运行的比对结果（无需去重）
+            bam = f"{calibration_dir}/bismark_alignment/{subsample.prefix}_bismark_bt2_pe.bam"
+            cmd = cmd.replace(f"{calibration_dir}/bismark_deduplicate/{subsample.prefix}_bismark_bt2_pe.deduplicated.bam", bam)
+        usage = {}
+        print(f"内存校准（{stage}）: ", cmd)
+        execute_shell_command(cmd, subsample.log_dir, tag="calibration", stage=stage, usage=usage)
+        # 完整数据的缓冲和队列比小样本大，在峰值基础上预留20%及0.5GB
+        result[field] = round(usage["peak_group_rss_gb"] * 1.2 + 0.5, 1)
+        print(f"内存校准（{stage}）: 单实例内存峰值 {usage['peak_group_rss_gb']:.2f}GB")
+
+    with open(result_path, "w") as file:
+        json.dump(result, file, indent=2)
+    return result
+
+
+# 计算参考基因组所有FASTA文件（文件名及内容）的sha256校验值
+# 校验值按文件大小和修改时间缓存在.genome_checksum.json中，FASTA文件未变化时无需重新读取
+def genome_checksum(genome_folder):
+    files = genome_fasta_files(genome_folder)
+    if not files:
+        raise FileNotFoundError(f"参考基因组文件夹中未找到FASTA文件: {genome_folder}")
+    signatures = [[os.path.basename(path), os.path.getsize(path), os.path.getmtime(path)] for path in files]
+    cache_path = f"{genome_folder}/.genome_checksum.json"
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+        if cache.get("files") == signatures:
+            return cache["checksum"]
+
+    print("计算参考基因组的校验值...")
+    sha256 = hashlib.sha256()
+    for path in files:
+        sha256.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(16 * 1024 * 1024), b""):
+                sha256.update(chunk)
+    checksum = sha256.hexdigest()
+    try:
+        with open(cache_path, "w") as file:
+            json.dump({"files": signatures, "checksum": checksum}, file, indent=2)
+    except OSError:
+        # 参考基因组文件夹只读时不缓存校验值
+        pass
+    return checksum
+
+
+# 读取索引文件夹中记录的参考基因组校验值，索引不完整或没有记录时返回None
+def index_checksum(index_dir):
+    try:
+        with open(f"{index_dir}/index.json", "r") as file:
+            return json.load(file).get("checksum")
+    except (OSError, ValueError):
+        return None
+
+
+# 文件锁（阻塞直到获得锁），用于避免多个程序同时构建同一个索引
+@contextmanager
+def file_lock(path):
+    with open(path, "a") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"等待其他程序释放锁: {path}")
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+# 删除文件、符号链接或文件夹
+def remove_path(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+# 记录索引对应的参考基因组校验值
+def write_index_metadata(index_dir, checksum, config):
+    with open(f"{index_dir}/index.json", "w") as file:
+        json.dump(
+            {
+                "checksum": checksum,
+                "fasta_files": [os.path.basename(path) for path in genome_fasta_files(config.genome_folder)],
+                "genome_folder": config.genome_folder,
+                "built_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            file,
+            indent=2,
+        )
+
+
+# 没有index.json的索引（此前版本构建）是否完整可用：CT、GA两个bowtie2索引的文件都存在，且都比FASTA文件新
+def is_complete_legacy_index(index_dir, genome_folder):
+    if os.path.islink(index_dir) or not os.path.isdir(index_dir) or os.path.exists(f"{index_dir}/index.json"):
+        return False
+    fasta_mtime = max(os.path.getmtime(path) for path in genome_fasta_files(genome_folder))
+    for conversion in ["CT", "GA"]:
+        for suffix in BOWTIE2_INDEX_SUFFIXES:
+            prefix = f"{index_dir}/{conversion}_conversion/BS_{conversion}.{suffix}"
+            paths = [path for path in [f"{prefix}.bt2", f"{prefix}.bt2l"] if os.path.exists(path)]
+            if not paths or os.path.getmtime(paths[0]) < fasta_mtime:
+                return False
+    return True
+
+
+# 准备参考基因组的索引文件：索引按FASTA文件的校验值识别，校验值不一致（FASTA已变化或上次构建中断）时重新构建
+# 此前版本构建的索引没有index.json，完整且比FASTA文件新时记录当前的校验值后继续使用，不重新构建
+# 设置genome_cache_dir时，索引保存在共享缓存文件夹的{校验值}子文件夹中，genome_folder中的Bisulfite_Genome为指向缓存的符号链接，
+# genome_folder中已有的可用索引移入缓存而不是重新构建
+# 构建时先在临时文件夹中完成，再重命名为正式的索引文件夹，并通过文件锁避免多个程序同时构建
+def prepare_genome_index(config, log_dir):
+    checksum = genome_checksum(config.genome_folder)
+    target = f"{config.genome_folder}/Bisulfite_Genome"
+    if is_complete_legacy_index(target, config.genome_folder):
+        print(f"检测到没有校验记录的索引文件: {target}，记录当前参考基因组的校验值（{checksum[:12]}）后继续使用")
+        write_index_metadata(target, checksum, config)
+    if index_checksum(target) == checksum and not (config.genome_cache_dir and not os.path.islink(target)):
+        print(f"检测到参考基因组的索引文件已存在（校验值: {checksum[:12]}），跳过索引构建")
+        return
+
+    if config.genome_cache_dir:
+        os.makedirs(config.genome_cache_dir, exist_ok=True)
+        entry = f"{config.genome_cache_dir}/{checksum}"
+        index_dir = f"{entry}/Bisulfite_Genome"
+        lock_path = f"{config.genome_cache_dir}/{checksum}.lock"
+    else:
+        entry = config.genome_folder
+        index_dir = target
+        lock_path = f"{config.genome_folder}/.Bisulfite_Genome.lock"
+
+    with file_lock(lock_path):
+        if index_checksum(index_dir) == checksum:
+            print(f"检测到缓存的参考基因组索引文件: {index_dir}")
+        elif index_checksum(target) == checksum:
+            # genome_folder中已有可用的索引，移入共享缓存
+            print(f"将参考基因组的索引文件移入缓存: {target} -> {index_dir}")
+            if os.path.lexists(index_dir):
+                remove_path(index_dir)
+            os.makedirs(entry, exist_ok=True)
+            shutil.move(target, index_dir)
+        else:
+            # 在临时文件夹中通过符号链接引用FASTA文件并构建索引
+            build_dir = f"{entry}.building" if config.genome_cache_dir else f"{entry}/.Bisulfite_Genome.building"
+            remove_path(build_dir)
+            os.makedirs(build_dir)
+            for path in genome_fasta_files(config.genome_folder):
+                os.symlink(os.path.abspath(path), f"{build_dir}/{os.path.basename(path)}")
+            cmd = bismark_genome_preparation(DotDict(config, genome_folder=build_dir))
+            print("创建参考基因组的索引文件: ", cmd)
+            execute_shell_command(cmd, log_dir, stage="bismark_genome_preparation")
+            write_index_metadata(f"{build_dir}/Bisulfite_Genome", checksum, config)
+            # 删除过期或不完整的索引后，将构建完成的索引重命名为正式的索引文件夹
+            if os.path.lexists(index_dir):
+                print(f"删除过期或不完整的索引文件: {index_dir}")
+                remove_path(index_dir)
+            os.makedirs(entry, exist_ok=True)
+            os.rename(f"{build_dir}/Bisulfite_Genome", index_dir)
+            shutil.rmtree(build_dir)
+
+    # 使用共享缓存时，将genome_folder中的Bisulfite_Genome替换为指向缓存的符号链接
+    if config.genome_cache_dir and os.path.realpath(target) != os.path.realpath(index_dir):
+        if os.path.lexists(target):
+            print(f"删除过期或不完整的索引文件: {target}")
+            remove_path(target)
+        os.symlink(index_dir, f"{target}.link{os.getpid()}")
+        os.replace(f"{target}.link{os.getpid()}", target)
+        print(f"使用缓存的参考基因组索引文件: {index_dir}")
+
+
+# 根据CPU核心数、内存预算和参考基因组大小自动确定各步骤的并发数和缓冲区大小，并写入日志
+def auto_tune(config, samples):
+    cores = detect_cores()
+    config.parallel_num = min(config.parallel_num, cores)
+    genome_gb = genome_size_gb(config.genome_folder)
+    config.alignment_memory = estimate_alignment_memory(config.genome_folder)
+    if config.calibrate:
+        result = calibrate_memory(samples[0], config)
+        config.alignment_memory = result["alignment_memory"]
+        config.extractor_memory = result["extractor_memory"]
+
+    # 预留10%的内存给系统及其他进程
+    usable_memory = config.memory_limit * 0.9
+    # 每个比对实例约占用5个核心
+    config.parallel_alignment = max(1, min(config.parallel_num // 5, int(usable_memory // config.alignment_memory)))
+    # 排序缓冲区：同时运行的样本平分30%的内存，且需为cytosine_report预留约2倍基因组大小的内存
+    buffer_gb = min(config.memory_limit * 0.3, usable_memory - genome_gb * 2) / config.concurrent_samples
+    config.buffer_size = f"{max(1, int(buffer_gb))}G"
+    # 每个 --multicore 实例占用3个核心
+    config.multicore = max(
+        1,
+        min(config.parallel_num // 3, int((usable_memory - buffer_size_gb(config)) // config.extractor_memory)),
+    )
+
+    lines = [
+        f"CPU核心数: {cores}, 内存预算: {config.memory_limit:.1f}GB, 参考基因组大小: {genome_gb:.2f}GB",
+        f"parallel_num: {config.parallel_num}",
+        f"bismark_alignment --parallel: {config.parallel_alignment}（单实例内存 {config.alignment_memory}GB"
+        + ("，校准值）" if config.calibrate else "，估算值）"),
+        f"bismark_methylation_extractor --multicore: {config.multicore}（单实例内存 {config.extractor_memory}GB）",
+        f"bismark_methylation_extractor --buffer_size: {config.buffer_size}",
+        "samtools sort -@: {}, -m: {:.2f}GB".format(*sort_resources(config)),
+    ]
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for log_dir in sorted({sample.log_dir for sample in samples}):
+        os.makedirs(log_dir, exist_ok=True)
+        with open(f"{log_dir}/auto_tune.log", "a") as file:
+            for line in lines:
+                file.write(f"[{current_time}] {line}\n")
+    print("自动调优结果:")
+    for line in lines:
+        print(f"  {line}")
+
+
+# 各步骤的预估内存占用（GB），比对步骤按每个--parallel实例单独计算
+STAGE_MEMORY = {
+    "mkdirs": 0,
+    "bismark_genome_preparation": 16,  # 两个bowtie2-build进程
+    "soapnuke_filter": 8,
+    "bismark_deduplicate": 16,  # 双端去重需要在内存中保存所有比对位置
+    "methylation_cx_report_analysis": 0.5,  # 每个统计进程，按进程数计算
+    "bismark_methylation_extractor": 1,  # 每个--multicore实例，不含排序缓冲区
+    "methylation_bigwig": 1,  # 每个bigWig文件的进程（含外部排序约320MB的排序缓冲区）
+}
+SORT_MAX_THREADS = 16  # samtools sort自动确定的最大线程数，更多线程受限于磁盘读写
+SCHEDULER_MAX_WAIT = 30 * 60  # 资源申请等待超过该秒数后，后面的申请不能再插队
+BIGWIG_TRACKS = 4  # 所有context及CG、CHG、CHH各一个bigWig文件
+
+
+# 按各步骤已知的线程倍数估算资源需求，返回（核心数, 内存GB）
+def stage_resources(stage, config):
+    if stage == "bismark_genome_preparation":
+        # --parallel 为 parallel_num // 2，每个线程实际使用2个核心
+        cores = config.parallel_num // 2 * 2
+        memory = STAGE_MEMORY[stage]
+    elif stage == "soapnuke_filter":
+        cores = config.parallel_num
+        memory = STAGE_MEMORY[stage]
+    elif stage == "bismark_alignment":
+        # 每个 --parallel 实例约占用5个线程（bismark本身、2个bowtie2、samtools及解压）
+        cores = config.parallel_alignment * 5
+        memory = config.alignment_memory * config.parallel_alignment
+    elif stage == "split_fastq":
+        # 两个awk进程及压缩分片的gzip进程
+        cores = 4
+        memory = 1
+    elif stage == "bismark_alignment_chunk":
+        # 每个分片为单实例比对
+        cores = 5
+        memory = config.alignment_memory
+    elif stage == "samtools_sort":
+        # samtools实际占用的内存略高于线程数 × -m
+        cores, memory_per_thread = sort_resources(config)
+        memory = cores * memory_per_thread * 1.2
+    elif stage == "bismark_methylation_extractor":
+        # 每个 --multicore 实例占用3个线程（提取器本身、Samtools流、GZIP流）
+        cores = config.multicore * 3
+        # 排序缓冲区加上每个 --multicore 实例的内存
+        memory = buffer_size_gb(config) + config.multicore * config.extractor_memory
+    elif stage == "methylation_cx_report_analysis":
+        # 每个染色体文件由一个进程统计
+        cores = config.parallel_num
+        memory = STAGE_MEMORY[stage] * config.parallel_num
+    elif stage == "methylation_bigwig":
+        # 每个bigWig文件由一个进程生成
+        cores = BIGWIG_TRACKS
+        memory = STAGE_MEMORY[stage] * BIGWIG_TRACKS
+    else:
+        cores = 1
+        memory = STAGE_MEMORY.get(stage, 1)
+    # 单个步骤的需求不能超过总预算，否则永远无法被调度
+    return max(1, min(cores, config.parallel_num)), min(memory, config.memory_limit)
+
+
+# 核心数和内存的全局预算，资源足够时步骤才开始执行
+# 排在前面的申请暂时无法满足时，后面资源足够的申请可以先执行（例如比对等待内存时先执行小步骤）；
+# 排在前面的申请等待超过max_wait秒后不再允许插队，避免占用大量资源的步骤一直等待
+class ResourceScheduler:
+    def __init__(self, cores, memory, max_wait=SCHEDULER_MAX_WAIT):
+        self.free_cores = cores
+        self.free_memory = memory
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.next_ticket = 0  # 下一个排队号
+        self.waiting = {}  # 等待中的申请：排队号 -> (核心数, 内存, 开始等待的时间)
+
+    # 资源足够，且前面没有可以立即执行或已等待超时的申请
+    def can_start(self, ticket):
+        cores, memory, _ = self.waiting[ticket]
+        if self.free_cores < cores or self.free_memory < memory:
+            return False
+        now = time.monotonic()
+        for earlier, (earlier_cores, earlier_memory, since) in self.waiting.items():
+            if earlier >= ticket:
+                break
+            if now - since >= self.max_wait:
+                return False
+            if self.free_cores >= earlier_cores and self.free_memory >= earlier_memory:
+                return False
+        return True
+
+    @contextmanager
+    def reserve(self, cores, memory):
+        with self.condition:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.waiting[ticket] = (cores, memory, time.monotonic())
+            try:
+                self.condition.wait_for(lambda: self.can_start(ticket))
+            finally:
+                del self.waiting[ticket]
+            self.free_cores -= cores
+            self.free_memory -= memory
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.free_cores += cores
+                self.free_memory += memory
+                self.condition.notify_all()
+
+
+# 单个样本需要依次执行的步骤：（步骤名称, 步骤描述, 命令构造函数）
+SAMPLE_STAGES = [
+    ("mkdirs", "创建输出目录", mkdirs),
+    ("soapnuke_filter", "使用SOAPnuke做数据过滤", soapnuke_filter),  # 约1小时
+    ("bismark_alignment", "序列比对", bismark_alignment),  # 12~16小时
+    ("bismark_deduplicate", "去除重复片段", bismark_deduplicate),  # 5小时
+    ("samtools_sort", "BAM文件排序及索引", samtools_sort),  # 约30分钟
+    # 提取甲基化信息，并将测序数据的覆盖度转换为细胞碱基甲基化数据（20小时）
+    ("bismark_methylation_extractor", "提取甲基化信息", bismark_methylation_extractor),
+    # 一次读取CX_report，输出甲基化测序深度、覆盖度及分布信息（10分钟）
+    ("methylation_cx_report_analysis", "输出甲基化深度、覆盖度及分布信息", methylation_cx_report_analysis),
+    # 由bedGraph及CX_report流式生成各context的bigWig文件
+    ("methylation_bigwig", "生成bigWig文件", methylation_bigwig),
+    # 将各项报告汇总为一个列式存储文件（1分钟以内）
+    ("sample_summary", "汇总样本报告", sample_summary),
+]
+
+
+# 判断步骤是否被--force_from指定为强制重新执行
+def is_forced(stage, config):
+    if not config.force_from:
+        return False
+    stage_names = [name for name, _, _ in SAMPLE_STAGES]
+    return stage_names.index(stage) >= stage_names.index(config.force_from)
+
+
+# 分片比对：拆分测序文件后，每个分片作为单独的任务向调度器申请资源并发比对，最后合并为整体比对的文件名
+# 每个完成的环节写入done标记，中断后重新运行时跳过已完成的拆分和分片
+def run_sharded_alignment(sample, config, scheduler):
+    split_cmd, chunk_cmds, merge_cmd = sharded_alignment_commands(sample, config)
+    chunks_dir = f"{work_dir(sample, config)}/bismark_alignment/chunks"
+
+    def run_marked(stage, description, cmd, marker):
+        if os.path.exists(marker):
+            with open(marker, "r") as file:
+                if normalize_command(file.read(), stage) == normalize_command(cmd, stage):
+                    print(f"[{sample.sample_name}] 检测到{description}已完成，跳过此步骤")
+                    return
+        cores, memory = stage_resources(stage, config)
+        with scheduler.reserve(cores, memory):
+            print("-----------------------")
+            print(f"[{sample.sample_name}] {description}（{cores}核, {memory:.1f}GB）: ", cmd)
+            execute_shell_command(cmd, sample.log_dir, tag=sample.sample_name, stage=stage)
+        with open(marker, "w") as file:
+            file.write(cmd)
+
+    # 分片数改变时需要重新拆分
+    run_marked("split_fastq", f"拆分测序文件（{config.alignment_chunks}个分片）", split_cmd, f"{chunks_dir}/split.done")
+
+    def run_chunk(chunk):
+        run_marked(
+            "bismark_alignment_chunk",
+            f"序列比对（分片{chunk + 1}/{config.alignment_chunks}）",
+            chunk_cmds[chunk],
+            f"{chunk_dir(sample, config, chunk)}/alignment.done",
+        )
+        # 分片比对完成后删除分片的测序文件
+        for path in chunk_fastq_files(sample, config, chunk):
+            if os.path.exists(path):
+                os.remove(path)
+
+    with ThreadPoolExecutor(max_workers=config.alignment_chunks) as executor:
+        for future in [executor.submit(run_chunk, chunk) for chunk in range(config.alignment_chunks)]:
+            future.result()
+
+    print("-----------------------")
+    print(f"[{sample.sample_name}] 合并分片比对结果: ", merge_cmd)
+    execute_shell_command(merge_cmd, sample.log_dir, tag=sample.sample_name, stage="bismark_alignment_merge")
+    report_name = f"{sample.prefix}_bismark_bt2_PE_report.txt"
+    merge_pe_reports(
+        [f"{chunk_dir(sample, config, chunk)}/{report_name}" for chunk in range(config.alignment_chunks)],
+        f"{work_dir(sample, config)}/bismark_alignment/{report_name}",
+    )
+    shutil.rmtree(chunks_dir)
+
+
+# 执行单个步骤，并写入完成记录
+def run_stage(stage, description, cmd, sample, config, scheduler):
+    cores, memory = stage_resources(stage, config)
+    with scheduler.reserve(cores, memory):
+        print("-----------------------")
+        print(f"[{sample.sample_name}] {description}（{cores}核, {memory:.1f}GB）: ", cmd)
+        # 执行前删除旧的完成记录，并记录输入文件的状态
+        if os.path.exists(manifest_path(stage, sample)):
+            os.remove(manifest_path(stage, sample))
+        forget_removed(stage, sample, config)
+        inputs = file_signatures(
+            stage_files(stage, sample, config)[0], read_removed(sample), streamed_files(sample, config)
+        )
+        execute_shell_command(cmd, sample.log_dir, tag=sample.sample_name, stage=stage)
+        # 最终结果移回output_dir后再写入完成记录
+        publish_outputs(stage, sample, config)
+        write_manifest(stage, sample, config, cmd, inputs)
+
+
+# 流式模式下同时执行数据过滤与比对（按两个步骤之和申请资源），并分别写入完成记录
+def run_streaming_stages(stages, sample, config, scheduler):
+    resources = [stage_resources(stage, config) for stage, _, _ in stages]
+    cores = min(sum(item[0] for item in resources), config.parallel_num)
+    memory = min(sum(item[1] for item in resources), config.memory_limit)
+    (_, _, soapnuke_cmd), (_, _, alignment_cmd) = stages
+    cmd = streaming_command(sample, config, soapnuke_cmd, alignment_cmd)
+    files = stream_files(sample, config)
+    with scheduler.reserve(cores, memory):
+        print("-----------------------")
+        print(f"[{sample.sample_name}] {'及'.join(d for _, d, _ in stages)}（流式，{cores}核, {memory:.1f}GB）: ", cmd)
+        inputs = {}
+        for stage, _, _ in stages:
+            if os.path.exists(manifest_path(stage, sample)):
+                os.remove(manifest_path(stage, sample))
+            forget_removed(stage, sample, config)
+            inputs[stage] = file_signatures(
+                stage_files(stage, sample, config)[0], read_removed(sample), streamed_files(sample, config)
+            )
+        execute_shell_command(cmd, sample.log_dir, tag=sample.sample_name, stage="+".join(s for s, _, _ in stages))
+        with open(files.bytes, "r") as file:
+            streamed_bytes = {clean_fastq_files(sample, config)[0]: int(file.read())}
+        os.remove(files.bytes)
+        streamed_gb = sum(streamed_bytes.values()) / 1024**3
+        print(f"[{sample.sample_name}] 流式模式: 清洗后的R1测序文件未写入磁盘，避免写入 {streamed_gb:.2f}GB")
+        for stage, _, stage_cmd in stages:
+            publish_outputs(stage, sample, config)
+            write_manifest(
+                stage, sample, config, stage_cmd, inputs[stage], streamed_bytes if stage == "soapnuke_filter" else None
+            )
+
+
+# 按顺序处理单个样本的所有步骤，每个步骤开始前向调度器申请资源
+def process_sample(sample, config, scheduler):
+    print(f"开始处理样本{sample.sample_name}...")
+    stages = []
+    for stage, description, build_command in SAMPLE_STAGES:
+        if stage == "soapnuke_filter" and config.skip_filter:
+            continue
+        if stage == "methylation_bigwig" and config.skip_bigwig:
+            continue
+        if stage == "samtools_sort" and config.skip_sort:
+            continue
+        stages.append((stage, description, build_command(sample, config)))
+    streaming = streaming_enabled(config)
+    if config.streaming and not streaming:
+        print(f"[{sample.sample_name}] 跳过数据过滤、比对使用多个--parallel实例或分片比对时不使用流式模式，各步骤之间使用普通文件")
+
+    # 后台线程定期采样磁盘占用的峰值，每个步骤结束时记录当时的占用
+    disk = {}
+    finished = threading.Event()
+    threading.Thread(target=monitor_disk_usage, args=(sample, config, disk, finished), daemon=True).start()
+    # 需要执行的步骤依赖已删除的中间文件时，重新执行生成该文件的步骤
+    restore = stages_to_restore(stages, sample, config)
+    stage_names = {stage for stage, _, _ in stages}
+    completed = set()
+    # 只在暂存模式下清理中间文件，未设置scratch_dir时output_dir中的文件保持不变
+    cleanup = bool(config.scratch_dir) and not config.keep_intermediates
+    try:
+        for stage, description, cmd in stages:
+            if stage == "mkdirs":
+                # 创建目录的步骤每次都执行
+                print("-----------------------")
+                print(f"[{sample.sample_name}] {description}: ", cmd)
+                execute_shell_command(cmd, sample.log_dir, tag=sample.sample_name, stage=stage)
+                record_disk_usage(sample, config, disk, "start")
+                continue
+            # 流式模式下数据过滤与比对同时执行，清洗后的R1测序文件不落盘，任一步骤需要执行时两个步骤都重新执行
+            group = [(stage, description, cmd)]
+            if stage == "soapnuke_filter" and streaming:
+                group += [item for item in stages if item[0] == "bismark_alignment"]
+            elif stage == "bismark_alignment" and streaming:
+                continue
+            # 完成记录有效的步骤直接跳过
+            if all(
+                name not in restore and not is_forced(name, config) and check_manifest(name, sample, config, name_cmd)
+                for name, _, name_cmd in group
+            ):
+                for _, name_description, _ in group:
+                    print(f"[{sample.sample_name}] 检测到{name_description}已完成，跳过此步骤")
+            elif len(group) > 1:
+                run_streaming_stages(group, sample, config, scheduler)
+                record_disk_usage(sample, config, disk, "+".join(name for name, _, _ in group))
+            elif stage == "bismark_alignment" and config.alignment_chunks > 1:
+                # 分片比对的各环节单独申请资源，完成后再写入整个步骤的完成记录
+                if os.path.exists(manifest_path(stage, sample)):
+                    os.remove(manifest_path(stage, sample))
+                forget_removed(stage, sample, config)
+                inputs = file_signatures(stage_files(stage, sample, config)[0], read_removed(sample))
+                run_sharded_alignment(sample, config, scheduler)
+                publish_outputs(stage, sample, config)
+                write_manifest(stage, sample, config, cmd, inputs)
+                record_disk_usage(sample, config, disk, stage)
+            else:
+                run_stage(stage, description, cmd, sample, config, scheduler)
+                record_disk_usage(sample, config, disk, stage)
+            completed.update(name for name, _, _ in group)
+            # 设置scratch_dir时，所有使用者均已成功的中间文件立即删除
+            if cleanup and remove_intermediates(sample, config, stage_names, completed):
+                record_disk_usage(sample, config, disk, "remove_intermediates")
+        # 样本处理完成后删除scratch_dir中的样本文件夹（最终结果已移回output_dir）
+        if cleanup:
+            shutil.rmtree(work_dir(sample, config), ignore_errors=True)
+        record_disk_usage(sample, config, disk, "finished")
+    finally:
+        finished.set()
+    print(
+        f"[{sample.sample_name}] 磁盘占用峰值: output_dir {disk['peak_output_bytes'] / 1024**3:.1f}GB, "
+        f"scratch_dir {disk['peak_scratch_bytes'] / 1024**3:.1f}GB; "
+        f"最终占用: {disk['final_output_bytes'] / 1024**3:.1f}GB"
+    )
+    print(f"样本{sample.sample_name}处理完成")
+    print("=======================")
+
+
 # 连接多层文件夹，并自动处理文件夹分隔符
 def path_join(parent_path, *child_paths):
     # 去除 parent_path 末尾的斜杠
@@ -302,8 +1797,32 @@ DEFAULTS = {
     "genome_folder": None,
     "utils_folder": ".",
     "skip_filter": False,
+    "genome_cache_dir": None,  # 参考基因组索引的共享缓存文件夹，默认在genome_folder中构建索引
     "parallel_num": 30,
     "parallel_alignment": 4,
+    "memory_limit": None,  # 内存预算（GB），默认为本机（或容器）的内存上限
+    "alignment_memory": 12,  # 每个比对实例的预估内存（GB）
+    "alignment_chunks": 1,  # 分片比对的分片数，大于1时将测序文件拆分后分别比对再合并
+    "multicore": None,  # 甲基化提取的--multicore，默认值为parallel_num // 3
+    "buffer_size": "30%",  # 甲基化提取排序的缓冲区大小
+    "auto_tune": False,  # 是否根据CPU核心数、内存及参考基因组大小自动确定并发数和缓冲区大小
+    "calibrate": False,  # 自动调优时是否先在小样本上试运行，测量单实例的内存峰值
+    "parallel_samples": None,  # 最多同时处理的样本数，默认不限制（仅受核心数和内存预算约束）
+    "force_from": None,  # 从指定步骤开始强制重新执行（忽略完成记录）
+    "streaming": False,  # 是否将数据过滤的输出通过命名管道直接交给比对（仅单实例比对时生效）
+    "log_mode": "line",  # 日志记录方式：line（逐行写入）或buffered（块缓冲写入，适合输出量大的程序）
+    "log_flush_interval": 5,  # buffered模式下日志文件的刷新间隔（秒）
+    "console_interval": 0,  # 控制台输出的最小间隔（秒），0表示输出全部内容
+    "compress_log": False,  # 是否使用gzip压缩日志文件
+    "skip_methylation_matrix": False,  # 是否跳过输出甲基化矩阵
+    "skip_bigwig": False,  # 是否跳过生成bigWig文件
+    "chromosome_aliases": "",  # 染色体名称对照表（如{utils_folder}/chromosome_aliases.tsv），默认不重命名，保留accession
+    "skip_sort": False,  # 是否跳过BAM文件的排序及索引
+    "sort_threads": None,  # samtools sort的线程数，默认由同时运行的样本平分parallel_num（最多16）
+    "sort_memory": None,  # samtools sort每个线程的内存（GB），默认由同时运行的样本平分一半的内存预算
+    "scratch_dir": None,  # 本地高速磁盘上的临时文件夹（如NVMe），设置后中间文件写入其中，最终结果移回output_dir
+    "keep_intermediates": False,  # 设置scratch_dir时是否保留中间文件（默认在所有使用它的步骤成功后删除）
+    "cohort_matrix_dir": "{output_dir}/cohort_matrix",  # 多样本合并矩阵的输出文件夹，output_dir为全局中间文件输出文件夹
     # 样本的默认参数
     "sample_name": None,
     "group_name": None,
@@ -337,10 +1856,47 @@ def parse_public_config(data):
     config.skip_filter = data.get("skip_filter", DEFAULTS["skip_filter"])
     config.parallel_num = data.get("parallel_num", DEFAULTS["parallel_num"])
     config.parallel_alignment = data.get("parallel_alignment", DEFAULTS["parallel_alignment"])
+    config.memory_limit = data.get("memory_limit", DEFAULTS["memory_limit"]) or detect_memory_gb()
+    config.alignment_memory = data.get("alignment_memory", DEFAULTS["alignment_memory"])
+    config.alignment_chunks = data.get("alignment_chunks", DEFAULTS["alignment_chunks"])
+    config.parallel_samples = data.get("parallel_samples", DEFAULTS["parallel_samples"])
+    config.multicore = data.get("multicore", DEFAULTS["multicore"]) or max(1, config.parallel_num // 3)
+    config.buffer_size = data.get("buffer_size", DEFAULTS["buffer_size"])
+    config.extractor_memory = STAGE_MEMORY["bismark_methylation_extractor"]
+    config.auto_tune = data.get("auto_tune", DEFAULTS["auto_tune"])
+    config.calibrate = data.get("calibrate", DEFAULTS["calibrate"])
+    config.streaming = data.get("streaming", DEFAULTS["streaming"])
+    config.log_mode = data.get("log_mode", DEFAULTS["log_mode"])
+    if config.log_mode not in ["line", "buffered"]:
+        raise ValueError(f"log_mode参数无效: {config.log_mode}")
+    config.log_flush_interval = data.get("log_flush_interval", DEFAULTS["log_flush_interval"])
+    config.console_interval = data.get("console_interval", DEFAULTS["console_interval"])
+    config.compress_log = data.get("compress_log", DEFAULTS["compress_log"])
+    config.skip_methylation_matrix = data.get("skip_methylation_matrix", DEFAULTS["skip_methylation_matrix"])
+    config.skip_bigwig = data.get("skip_bigwig", DEFAULTS["skip_bigwig"])
+    config.chromosome_aliases = data.get("chromosome_aliases", DEFAULTS["chromosome_aliases"])
+    if config.chromosome_aliases:
+        config.chromosome_aliases = os.path.abspath(config.chromosome_aliases.format(utils_folder=config.utils_folder))
+    config.skip_sort = data.get("skip_sort", DEFAULTS["skip_sort"])
+    config.sort_threads = data.get("sort_threads", DEFAULTS["sort_threads"])
+    config.sort_memory = data.get("sort_memory", DEFAULTS["sort_memory"])
+    config.cohort_matrix_dir = data.get("cohort_matrix_dir", DEFAULTS["cohort_matrix_dir"]).format(
+        output_dir=data.get("output_dir", "./output").rstrip("/")
+    )
+    config.force_from = data.get("force_from", DEFAULTS["force_from"])
+    if config.force_from and config.force_from not in [name for name, _, _ in SAMPLE_STAGES]:
+        raise ValueError(f"force_from参数无效: {config.force_from}")
 
     # 将相对路径转为绝对路径
     if not os.path.isabs(config.genome_folder):
         config.genome_folder = os.path.abspath(config.genome_folder)
+    config.genome_cache_dir = data.get("genome_cache_dir", DEFAULTS["genome_cache_dir"])
+    if config.genome_cache_dir:
+        config.genome_cache_dir = os.path.abspath(config.genome_cache_dir.rstrip("/"))
+    config.scratch_dir = data.get("scratch_dir", DEFAULTS["scratch_dir"])
+    if config.scratch_dir:
+        config.scratch_dir = os.path.abspath(config.scratch_dir.rstrip("/"))
+    config.keep_intermediates = data.get("keep_intermediates", DEFAULTS["keep_intermediates"])
 
     if not os.path.exists(config.genome_folder):
         raise FileNotFoundError(f"参考基因组文件夹不存在: {config.genome_folder}")
@@ -348,6 +1904,9 @@ def parse_public_config(data):
     if not os.path.exists(config.utils_folder):
         raise FileNotFoundError(f"utils文件夹不存在: {config.utils_folder}")
 
+    if config.chromosome_aliases and not os.path.exists(config.chromosome_aliases):
+        raise FileNotFoundError(f"染色体名称对照表不存在: {config.chromosome_aliases}")
+
     return config
 
 
@@ -409,6 +1968,9 @@ if __name__ == "__main__":
     parser.add_argument("--config", type=str, help="添加配置文件（如果设置了该参数，其他参数都不生效）")
     # 添加公共参数
     parser.add_argument("--genome_folder", type=str, help="参考基因组文件所在文件夹（必传）")
+    parser.add_argument(
+        "--genome_cache_dir", type=str, help="参考基因组索引的共享缓存文件夹（按FASTA文件的校验值区分），默认在genome_folder中构建索引"
+    )
     parser.add_argument("--skip_filter", action="store_true", help="添加该参数以跳过数据清洗步骤")
     parser.add_argument("--parallel_num", type=int, default=30, help="最大使用线程数，默认值为30")
     parser.add_argument(
@@ -417,6 +1979,73 @@ if __name__ == "__main__":
         default=6,
         help="比对使用的线程数，容易内存溢出，默认值为6",
     )
+    parser.add_argument("--memory_limit", type=float, help="内存预算（GB），默认为本机（或容器）的内存上限")
+    parser.add_argument(
+        "--alignment_memory", type=float, default=12, help="每个比对实例的预估内存（GB），默认值为12"
+    )
+    parser.add_argument(
+        "--alignment_chunks", type=int, default=1, help="分片比对的分片数，大于1时将测序文件拆分后分别比对再合并，默认值为1"
+    )
+    parser.add_argument("--multicore", type=int, help="甲基化提取的--multicore，默认值为parallel_num // 3")
+    parser.add_argument("--buffer_size", type=str, help="甲基化提取排序的缓冲区大小（如30%%、32G），默认值为30%%")
+    parser.add_argument(
+        "--auto_tune", action="store_true", help="添加该参数以根据CPU核心数、内存及参考基因组大小自动确定并发数和缓冲区大小"
+    )
+    parser.add_argument("--calibrate", action="store_true", help="自动调优时先在小样本上试运行，测量单实例的内存峰值")
+    parser.add_argument("--parallel_samples", type=int, help="最多同时处理的样本数，默认仅受核心数和内存预算限制")
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="添加该参数以将数据过滤的R1输出通过命名管道直接交给比对（仅parallel_alignment为1且不分片时生效）",
+    )
+    parser.add_argument(
+        "--force_from",
+        "--force-from",
+        type=str,
+        choices=[name for name, _, _ in SAMPLE_STAGES if name != "mkdirs"],
+        help="从指定步骤开始强制重新执行，默认跳过完成记录有效的步骤",
+    )
+    parser.add_argument(
+        "--log_mode",
+        type=str,
+        choices=["line", "buffered"],
+        help="日志记录方式：line（逐行写入）或buffered（块缓冲写入，按时间间隔刷新），默认值为line",
+    )
+    parser.add_argument("--log_flush_interval", type=float, help="buffered模式下日志文件的刷新间隔（秒），默认值为5")
+    parser.add_argument("--console_interval", type=float, help="控制台输出的最小间隔（秒），0表示输出全部内容，默认值为0")
+    parser.add_argument("--compress_log", action="store_true", help="添加该参数以使用gzip压缩日志文件")
+    parser.add_argument(
+        "--skip_methylation_matrix", action="store_true", help="添加该参数以跳过输出可按区间查询的甲基化矩阵"
+    )
+    parser.add_argument("--skip_bigwig", action="store_true", help="添加该参数以跳过生成各context的bigWig文件")
+    parser.add_argument(
+        "--chromosome_aliases",
+        type=str,
+        help="染色体名称对照表（accession、chromosome两列的tsv，如{utils_folder}/chromosome_aliases.tsv），指定后统计时将accession重命名为染色体名称，默认保留accession",
+    )
+    parser.add_argument("--skip_sort", action="store_true", help="添加该参数以跳过去重后BAM文件的排序及索引")
+    parser.add_argument(
+        "--sort_threads", type=int, help="samtools sort的线程数，默认由同时运行的样本平分parallel_num（最多16）"
+    )
+    parser.add_argument(
+        "--sort_memory", type=float, help="samtools sort每个线程的内存（GB），默认由同时运行的样本平分一半的内存预算"
+    )
+    parser.add_argument(
+        "--scratch_dir", type=str, help="本地高速磁盘上的临时文件夹（如NVMe），设置后中间文件写入其中，最终结果移回output_dir"
+    )
+    parser.add_argument(
+        "--keep_intermediates", action="store_true", help="设置scratch_dir时添加该参数以保留中间文件，默认在所有使用它的步骤成功后删除"
+    )
+    parser.add_argument(
+        "--cohort_matrix_dir", type=str, help="多样本合并矩阵的输出文件夹，默认值为:{output_dir}/cohort_matrix"
+    )
+    parser.add_argument(
+        "--resource_summary",
+        type=str,
+        nargs="?",
+        const="resource_summary.tsv",
+        help="汇总所有样本各步骤的资源记录并输出到指定文件后退出，默认输出文件为resource_summary.tsv",
+    )
     # 添加样本参数
     parser.add_argument("--sample_name", type=str, help="样本名（必传）")
     parser.add_argument("--group_name", type=str, help="样本所属分组（必传）")
@@ -438,6 +2067,9 @@ if __name__ == "__main__":
     if args.config:
         # 读取配置文件
         data = jsonload(args.config)
+        # 命令行的--force_from优先于配置文件
+        if args.force_from:
+            data["force_from"] = args.force_from
         # 解析公共参数
         config = parse_public_config(data)
         # 解析样本参数
@@ -449,70 +2081,59 @@ if __name__ == "__main__":
         else:
             # 遍历json解析样本参数
             samples = [parse_sample_config(sample) for sample in data["samples"]]
-    else:  # 否则从args读取参数
+    else:  # 否则从args读取参数（忽略未传入的参数，使其使用默认值）
+        data = {k: v for k, v in vars(args).items() if v is not None}
         # 解析公共参数
-        config = parse_public_config(args)
+        config = parse_public_config(data)
         # 解析样本参数
-        samples = [parse_sample_config(args)]
-
-    # 创建参考基因组的索引文件
-    if not os.path.exists(config.genome_folder + "/Bisulfite_Genome/"):
-        cmd = bismark_genome_preparation(config)
-        print("创建参考基因组的索引文件: ", cmd)
-        execute_shell_command(cmd, samples[0].log_dir)
-    else:
-        print("检测到参考基因组的索引文件已存在，跳过索引构建")
-
-    for sample in samples:
-        print(f"开始处理样本{sample.sample_name}...")
-        # 创建输出目录
-        cmd = mkdirs(sample, config)
-        print("-----------------------")
-        print("创建输出目录: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
-
-        # 使用SOAPnuke做数据过滤
-        if not config.skip_filter:
-            cmd = soapnuke_filter(sample, config)
-            print("-----------------------")
-            print("使用SOAPnuke做数据过滤: ", cmd)
-            execute_shell_command(cmd, sample.log_dir)
-
-        # 序列比对（12~16小时）
-        cmd = bismark_alignment(sample, config)
-        print("-----------------------")
-        print("序列比对: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
-
-        # 去除重复片段（5小时）
-        cmd = bismark_deduplicate(sample, config)
-        print("-----------------------")
-        print("去除重复片段: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
+        samples = [parse_sample_config(data)]
+
+    # 设置日志记录方式
+    LOG_OPTIONS.update(
+        mode=config.log_mode,
+        flush_interval=config.log_flush_interval,
+        console_interval=config.console_interval,
+        compress=config.compress_log,
+    )
 
-        # 提取甲基化信息，并将测序数据的覆盖度转换为细胞碱基甲基化数据（20小时）
-        cmd = bismark_methylation_extractor(sample, config)
-        print("-----------------------")
-        print("提取甲基化信息: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
+    # 只汇总资源记录，不执行分析
+    if args.resource_summary:
+        summarize_resource_usage(samples, args.resource_summary)
+        sys.exit(0)
 
-        # 使用自定义脚本1输出基于染色体的甲基化测序深度信息（10分钟）
-        cmd = methylation_depth_analysis(sample)
-        print("-----------------------")
-        print("输出甲基化测序深度信息: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
-
-        # 使用自定义脚本2输出基于染色体和context的甲基化覆盖的统计信息（10分钟）
-        cmd = methylation_coverage_analyse(sample)
-        print("-----------------------")
-        print("输出甲基化覆盖度信息: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
+    # 注册信号处理函数，处理进程终止的信号
+    register_signal_handlers()
+
+    # 创建参考基因组的索引文件（已存在且与FASTA文件一致时跳过）
+    prepare_genome_index(config, samples[0].log_dir)
+
+    # 同时运行的样本数，各样本平分核心数及内存预算的步骤按此计算
+    config.concurrent_samples = min(config.parallel_samples or len(samples), len(samples))
+
+    # 自动确定各步骤的并发数和缓冲区大小（内存校准需要参考基因组的索引文件）
+    if config.auto_tune or config.calibrate:
+        auto_tune(config, samples)
+
+    # 多个样本并发执行，每个样本内部的步骤仍按顺序执行
+    scheduler = ResourceScheduler(config.parallel_num, config.memory_limit)
+    print(f"资源预算: {config.parallel_num}核, {config.memory_limit:.1f}GB")
+    failed_samples = []
+    with ThreadPoolExecutor(max_workers=config.parallel_samples or len(samples)) as executor:
+        futures = {executor.submit(process_sample, sample, config, scheduler): sample for sample in samples}
+        for future, sample in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"样本{sample.sample_name}处理失败: {e}")
+                failed_samples.append(sample.sample_name)
+
+    if failed_samples:
+        print(f"以下样本处理失败: {', '.join(failed_samples)}")
+        sys.exit(1)
 
-        # 使用自定义脚本3输出基于染色体和context的甲基化分布信息（按百分比）（10分钟）
-        cmd = methylation_distribution_analysis(sample)
+    # 合并所有样本的甲基化矩阵，DMR分析及绘图直接读取合并矩阵（各样本矩阵未变化时自动跳过）
+    if not config.skip_methylation_matrix and len(samples) > 1:
+        cmd = cohort_matrix(samples, config)
         print("-----------------------")
-        print("输出甲基化分布信息: ", cmd)
-        execute_shell_command(cmd, sample.log_dir)
-
-        print(f"样本{sample.sample_name}处理完成")
-        print("=======================")
+        print("合并所有样本的甲基化矩阵: ", cmd)
+        execute_shell_command(cmd, samples[0].log_dir, stage="cohort_matrix")
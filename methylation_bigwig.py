@@ -0,0 +1,318 @@
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cx_report_analyse import iter_line_blocks, parse_block, read_chromosome_aliases
+
+# 流式生成bigWig文件：
+#   {output_prefix}.bigwig            由甲基化提取的bedGraph.gz（所有context）生成
+#   {output_prefix}.{context}.bigwig  由CX_report文件按context（CG/CHG/CHH）生成，bedGraph中没有context信息
+# 输入按数据块解压、解析后直接写入bigWig，不生成解压后的中间文件。输入已按染色体（名称排序）和位置排序时只读取一次；
+# 发现未排序的记录时放弃当前输出，改为外部归并排序：每次最多排序SORT_RUN_SIZE条记录并写入临时文件，再分块k路归并
+# 各bigWig文件由不同的进程同时生成，每个文件的记录数、耗时及吞吐量写入throughput文件
+# 传入染色体名称对照表时，bigWig中的染色体按对照表重命名（排序及写入顺序仍按原名称，输入无需重新排序）
+
+CONTEXTS = ["CG", "CHG", "CHH"]
+SORT_RUN_SIZE = 16 * 1024 * 1024  # 外部排序时每个有序段的最大记录数（约320MB内存）
+MERGE_BLOCK_SIZE = 1024 * 1024  # 归并时每个有序段每次读取的记录数
+START_BITS = 40  # 排序键：染色体序号 << 40 | 起始位置
+
+
+class UnsortedInput(Exception):
+    pass
+
+
+# pyBigWig为可选依赖，只在生成bigWig文件时导入
+def import_pybigwig():
+    try:
+        import pyBigWig
+    except ImportError:
+        raise ImportError("生成bigWig文件需要安装pyBigWig（conda install -c bioconda pybigwig）")
+    return pyBigWig
+
+
+# 读取染色体长度：fai或chrom.sizes文件取前两列，FASTA文件优先读取同名的.fai文件，不存在时扫描序列
+def read_chrom_sizes(paths):
+    sizes = {}
+    for path in paths:
+        if not re.search(r"\.(fai|sizes|txt)$", path) and os.path.exists(f"{path}.fai"):
+            path = f"{path}.fai"
+        if re.search(r"\.(fai|sizes|txt)$", path):
+            df = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1], names=["name", "size"], dtype={"name": str})
+            sizes.update(zip(df["name"], df["size"].astype(int)))
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        name = None
+        with opener(path, "rt") as file:
+            for line in file:
+                if line.startswith(">"):
+                    name = line[1:].split()[0]
+                    sizes[name] = 0
+                elif name is not None:
+                    sizes[name] += len(line.strip())
+    return sizes
+
+
+# bigWig中的染色体顺序：按名称排序（与sort -k1,1及bismark输出的bedGraph顺序一致）
+def chromosome_order(chrom_sizes):
+    return sorted(chrom_sizes)
+
+
+# 将染色体名称转换为序号，不在参考基因组中的染色体报错
+def chromosome_ranks(chromosomes, ranks):
+    categories = pd.Categorical(chromosomes)
+    missing = [name for name in categories.categories if name not in ranks]
+    if missing:
+        raise ValueError(f"参考基因组中不存在染色体: {', '.join(missing)}")
+    lookup = np.array([ranks[name] for name in categories.categories], dtype=np.int64)
+    return lookup[categories.codes]
+
+
+# 逐块读取bedGraph.gz文件，返回(排序键, 结束位置, 甲基化百分比)
+def bedgraph_blocks(path, ranks):
+    for block in iter_line_blocks(path):
+        if block.startswith(b"track"):
+            block = block[block.find(b"\n") + 1 :]
+        if not block:
+            continue
+        df = pd.read_csv(
+            io.BytesIO(block),
+            sep="\t",
+            header=None,
+            names=["chromosome", "start", "end", "value"],
+            dtype={"chromosome": str, "start": np.int64, "end": np.int64, "value": np.float32},
+            engine="c",
+        )
+        key = chromosome_ranks(df["chromosome"], ranks) << START_BITS | df["start"].to_numpy()
+        yield key, df["end"].to_numpy(), df["value"].to_numpy()
+
+
+# CX_report文件按染色体的顺序读取（--split_by_chromosome时每条染色体一个文件）
+def sort_cx_reports(paths, ranks):
+    def rank(path):
+        match = re.search(r"\.chr(.+)\.CX_report\.txt(\.gz)?$", os.path.basename(path))
+        return ranks.get(match.group(1), len(ranks)) if match else len(ranks)
+
+    return sorted(paths, key=lambda path: (rank(path), path))
+
+
+# 逐块读取CX_report文件中指定context有覆盖的位点，返回(排序键, 结束位置, 甲基化百分比)
+def cx_report_blocks(paths, ranks, context):
+    for path in paths:
+        for block in iter_line_blocks(path):
+            df = parse_block(block, matrix=True)
+            reads_n = df["readsM"].to_numpy() + df["readsU"].to_numpy()
+            df = df[(df["context"] == context).to_numpy() & (reads_n > 0)]
+            if not len(df):
+                continue
+            start = df["position"].to_numpy() - 1
+            key = chromosome_ranks(df["chromosome"].astype(str), ranks) << START_BITS | start
+            value = (df["readsM"].to_numpy() / (df["readsM"].to_numpy() + df["readsU"].to_numpy()) * 100).astype(np.float32)
+            yield key, start + 1, value
+
+
+# 检查记录是否按排序键递增，发现未排序的记录时抛出UnsortedInput
+def check_sorted(blocks, stats):
+    last = -1
+    for key, end, value in blocks:
+        if key[0] < last or (np.diff(key) < 0).any():
+            raise UnsortedInput()
+        last = key[-1]
+        stats["records"] += len(key)
+        yield key, end, value
+
+
+# 外部排序第一步：每SORT_RUN_SIZE条记录排序后写入临时文件，返回各有序段（内存映射）
+def spill_runs(blocks, temp_dir, stats, run_size=SORT_RUN_SIZE):
+    runs = []
+    buffer = []
+    buffered = 0
+
+    def flush():
+        key, end, value = (np.concatenate(column) for column in zip(*buffer))
+        order = np.argsort(key, kind="stable")
+        run = {}
+        for name, column in [("key", key), ("end", end), ("value", value)]:
+            path = f"{temp_dir}/run{len(runs)}.{name}.npy"
+            np.save(path, column[order])
+            run[name] = np.load(path, mmap_mode="r")
+        runs.append(run)
+
+    for block in blocks:
+        buffer.append(block)
+        buffered += len(block[0])
+        stats["records"] += len(block[0])
+        if buffered >= run_size:
+            flush()
+            buffer, buffered = [], 0
+    if buffer:
+        flush()
+    return runs
+
+
+# 外部排序第二步：分块k路归并。每个有序段读取一块，以各块最后一个键的最小值为界，
+# 界以内的记录合并排序后输出，每轮至少输出一个完整的块，内存占用与有序段数 × 块大小成正比
+def merge_runs(runs, block_size=MERGE_BLOCK_SIZE):
+    offsets = [0] * len(runs)
+    while True:
+        active = [i for i, run in enumerate(runs) if offsets[i] < len(run["key"])]
+        if not active:
+            return
+        limit = min(runs[i]["key"][min(offsets[i] + block_size, len(runs[i]["key"])) - 1] for i in active)
+        parts = []
+        for i in active:
+            run = runs[i]
+            stop = offsets[i] + int(np.searchsorted(run["key"][offsets[i] : offsets[i] + block_size], limit, side="right"))
+            parts.append([np.asarray(run[name][offsets[i] : stop]) for name in ["key", "end", "value"]])
+            offsets[i] = stop
+        key, end, value = (np.concatenate(column) for column in zip(*parts))
+        order = np.argsort(key, kind="stable")
+        yield key[order], end[order], value[order]
+
+
+# 将已排序的记录写入bigWig文件（先写入临时文件，完成后重命名），染色体名称按对照表重命名
+# bigWig的文件头中染色体名称不能重复，重命名后与参考基因组中的其他染色体同名时报错
+def write_bigwig(output, chromosomes, chrom_sizes, blocks, aliases=None):
+    pyBigWig = import_pybigwig()
+    names = [(aliases or {}).get(name, name) for name in chromosomes]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"按染色体名称对照表重命名后，参考基因组中存在同名的染色体: {', '.join(duplicated)}")
+    temp_file = f"{output}.tmp"
+    bw = pyBigWig.open(temp_file, "w")
+    try:
+        bw.addHeader([(alias, int(chrom_sizes[name])) for alias, name in zip(names, chromosomes)])
+        for key, end, value in blocks:
+            rank = key >> START_BITS
+            start = key & ((1 << START_BITS) - 1)
+            # 每条染色体连续的一段记录一次写入
+            bounds = np.flatnonzero(np.r_[True, rank[1:] != rank[:-1], True])
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                bw.addEntries(
+                    [names[rank[first]]] * int(last - first),
+                    start[first:last].tolist(),
+                    ends=end[first:last].tolist(),
+                    values=value[first:last].tolist(),
+                )
+        bw.close()
+    except BaseException:
+        bw.close()
+        os.remove(temp_file)
+        raise
+    os.replace(temp_file, output)
+
+
+# 生成单个bigWig文件（在子进程中执行），输入未排序时改为外部归并排序
+def export_track(name, source, paths, output, chrom_sizes, temp_dir, aliases=None):
+    start_time = time.time()
+    chromosomes = chromosome_order(chrom_sizes)
+    ranks = {chromosome: i for i, chromosome in enumerate(chromosomes)}
+    if source == "cx_report":
+        paths = sort_cx_reports(paths, ranks)
+
+    def blocks():
+        if source == "bedgraph":
+            return bedgraph_blocks(paths[0], ranks)
+        return cx_report_blocks(paths, ranks, name)
+
+    stats = {
+        "output": output,
+        "inputs": len(paths),
+        "input_bytes": sum(os.path.getsize(path) for path in paths),
+        "records": 0,
+        "sorted": True,
+        "sort_runs": 0,
+    }
+    try:
+        write_bigwig(output, chromosomes, chrom_sizes, check_sorted(blocks(), stats), aliases)
+    except UnsortedInput:
+        track_temp_dir = f"{temp_dir}/{name}"
+        os.makedirs(track_temp_dir, exist_ok=True)
+        try:
+            stats.update(records=0, sorted=False)
+            runs = spill_runs(blocks(), track_temp_dir, stats)
+            stats["sort_runs"] = len(runs)
+            write_bigwig(output, chromosomes, chrom_sizes, merge_runs(runs), aliases)
+        finally:
+            shutil.rmtree(track_temp_dir, ignore_errors=True)
+    stats["seconds"] = round(time.time() - start_time, 3)
+    stats["records_per_second"] = round(stats["records"] / max(stats["seconds"], 1e-9))
+    stats["input_mb_per_second"] = round(stats["input_bytes"] / 1024**2 / max(stats["seconds"], 1e-9), 3)
+    return name, stats
+
+
+# 同时生成所有bigWig文件，返回各文件的统计信息
+def export_bigwigs(
+    bedgraph, cx_reports, chrom_sizes, output_prefix, temp_dir, contexts=CONTEXTS, parallel_num=None, aliases=None
+):
+    tasks = []
+    if bedgraph:
+        tasks.append(("all", "bedgraph", [bedgraph], f"{output_prefix}.bigwig"))
+    if cx_reports:
+        for context in contexts:
+            tasks.append((context, "cx_report", cx_reports, f"{output_prefix}.{context}.bigwig"))
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(parallel_num or len(tasks), len(tasks)))) as executor:
+        futures = [executor.submit(export_track, *task, chrom_sizes, temp_dir, aliases) for task in tasks]
+        for future in futures:
+            name, stats = future.result()
+            results[name] = stats
+            order = "已排序" if stats["sorted"] else f"外部排序({stats['sort_runs']}个有序段)"
+            print(
+                f"{name}: {stats['records']}条记录, {order}, "
+                f"{stats['seconds']:.2f}秒, {stats['records_per_second']}条/秒 -> {stats['output']}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由bedGraph.gz及CX_report文件流式生成bigWig文件（每个context一个文件）")
+    parser.add_argument("--bedgraph", type=str, help="甲基化提取输出的bedGraph.gz文件（生成所有context的bigWig）")
+    parser.add_argument("--cx_reports", type=str, help="CX_report文件（支持通配符，生成每个context的bigWig）")
+    parser.add_argument("--genome", type=str, nargs="+", required=True, help="参考基因组的FASTA、fai或chrom.sizes文件（读取染色体长度）")
+    parser.add_argument("--contexts", type=str, nargs="+", choices=CONTEXTS, default=CONTEXTS, help="生成bigWig的context，默认为全部")
+    parser.add_argument("-o", "--output_prefix", type=str, required=True, help="输出文件前缀，输出{前缀}.bigwig及{前缀}.{context}.bigwig")
+    parser.add_argument("--temp_dir", type=str, help="外部排序的临时文件夹，默认为输出文件所在文件夹下的bigwig_temp")
+    parser.add_argument("--throughput", type=str, help="吞吐量统计的输出路径，默认为{前缀}.bigwig_throughput.json")
+    parser.add_argument("--parallel_num", type=int, help="同时生成的bigWig文件数（进程数），默认为全部同时生成")
+    parser.add_argument("--chromosome_aliases", type=str, help="染色体名称对照表（accession、chromosome两列的tsv），bigWig中使用重命名后的名称")
+    args = parser.parse_args()
+
+    cx_reports = sorted(glob.glob(args.cx_reports)) if args.cx_reports else []
+    if args.cx_reports and not cx_reports:
+        raise FileNotFoundError(f"没有找到CX_report文件: {args.cx_reports}")
+    if not args.bedgraph and not cx_reports:
+        parser.error("--bedgraph和--cx_reports至少需要传入一个")
+    temp_dir = args.temp_dir or f"{os.path.dirname(os.path.abspath(args.output_prefix))}/bigwig_temp"
+    throughput_file = args.throughput or f"{args.output_prefix}.bigwig_throughput.json"
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_prefix)), exist_ok=True)
+    start_time = time.time()
+    chrom_sizes = read_chrom_sizes(args.genome)
+    aliases = read_chromosome_aliases(args.chromosome_aliases)
+    results = export_bigwigs(
+        args.bedgraph, cx_reports, chrom_sizes, args.output_prefix, temp_dir, args.contexts, args.parallel_num, aliases
+    )
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    seconds = time.time() - start_time
+    records = sum(stats["records"] for stats in results.values())
+    throughput = {
+        "seconds": round(seconds, 3),
+        "records": records,
+        "records_per_second": round(records / max(seconds, 1e-9)),
+        "tracks": results,
+    }
+    with open(f"{throughput_file}.tmp", "w") as file:
+        json.dump(throughput, file, indent=2, ensure_ascii=False)
+    os.replace(f"{throughput_file}.tmp", throughput_file)
+    print(f"bigWig文件已生成（共{records}条记录，耗时{seconds:.2f}秒），吞吐量统计: {throughput_file}")
@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+# 甲基化矩阵：每个样本一个文件夹，每条染色体的每一列保存为一个.npy文件（{染色体}.{列名}.npy），
+# 按位置排序，只保存有覆盖（readsN > 0）的胞嘧啶位点。index.json记录各染色体的位点数及坐标范围，
+# 区间查询时通过内存映射对position列二分查找，只读取区间内的数据。
+# 多样本合并矩阵的格式相同，position/context/strand为所有样本位点的并集，reads_m和reads_n为
+# （样本数, 位点数）的二维数组（每个样本的数据连续存放），样本在该位点没有覆盖时为0。
+
+MATRIX_VERSION = 1
+MERGE_BLOCK_SIZE = 4 * 1024 * 1024  # 合并时每个样本每次读取的位点数
+MATRIX_COLUMNS = {
+    "position": np.uint32,  # 1-based坐标，与CX_report一致
+    "reads_m": np.uint32,  # 甲基化reads数
+    "reads_n": np.uint32,  # 总reads数（甲基化+非甲基化）
+    "context": np.uint8,  # CONTEXTS中的编号
+    "strand": np.uint8,  # STRANDS中的编号
+}
+CONTEXTS = ["CG", "CHG", "CHH"]
+STRANDS = ["+", "-"]
+NPY_HEADER_SIZE = 128  # 固定长度的.npy文件头，写入完成后原位更新位点数
+
+
+# 固定长度的.npy文件头（版本1.0）
+def npy_header(dtype, count):
+    header = repr({"descr": np.dtype(dtype).str, "fortran_order": False, "shape": (count,)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+# 染色体名称中的路径分隔符等字符替换为下划线，作为文件名前缀
+def chromosome_prefix(chromosome):
+    return re.sub(r"[^\w.+-]", "_", chromosome)
+
+
+# 每条染色体的每一列保存为一个.npy文件，先写入占位文件头，再按数据块追加，完成后更新文件头中的位点数
+class ChromosomeWriter:
+    def __init__(self, matrix_dir, chromosome):
+        self.chromosome = chromosome
+        self.prefix = chromosome_prefix(chromosome)
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.sorted = True
+        self.files = {}
+        for column, dtype in MATRIX_COLUMNS.items():
+            file = open(f"{matrix_dir}/{self.prefix}.{column}.npy", "wb")
+            file.write(npy_header(dtype, 0))
+            self.files[column] = file
+
+    # 追加一个数据块（各列长度相同，按CX_report中的顺序）
+    def append(self, columns):
+        position = columns["position"]
+        if len(position) == 0:
+            return
+        if np.any(np.diff(position.astype(np.int64)) <= 0) or (self.end is not None and position[0] <= self.end):
+            self.sorted = False
+        self.start = int(position.min()) if self.start is None else min(self.start, int(position.min()))
+        self.end = int(position.max()) if self.end is None else max(self.end, int(position.max()))
+        for column, dtype in MATRIX_COLUMNS.items():
+            self.files[column].write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+        self.count += len(position)
+
+    # 更新文件头并关闭文件，位点未按顺序排列时按位置重新排序
+    def close(self):
+        for column, file in self.files.items():
+            file.seek(0)
+            file.write(npy_header(MATRIX_COLUMNS[column], self.count))
+            file.close()
+        if not self.sorted:
+            self.sort()
+        return {"prefix": self.prefix, "count": self.count, "start": self.start, "end": self.end}
+
+    # 按位置排序全部列
+    def sort(self):
+        paths = {column: file.name for column, file in self.files.items()}
+        order = np.argsort(np.load(paths["position"], mmap_mode="r"), kind="stable")
+        for column, path in paths.items():
+            values = np.load(path)[order]
+            with open(path, "r+b") as file:
+                file.seek(NPY_HEADER_SIZE)
+                file.write(values.tobytes())
+
+
+# 从CX_report数据块中提取矩阵各列（只保留有覆盖的位点），按染色体返回
+def matrix_columns(df, readsN):
+    covered = readsN > 0
+    chromosomes = df["chromosome"].cat.codes.to_numpy()[covered]
+    chromosome_names = list(df["chromosome"].cat.categories)
+    context_codes = np.array([CONTEXTS.index(c) if c in CONTEXTS else 255 for c in df["context"].cat.categories])
+    strand_codes = np.array([STRANDS.index(s) if s in STRANDS else 255 for s in df["strand"].cat.categories])
+    columns = {
+        "position": df["position"].to_numpy()[covered],
+        "reads_m": df["readsM"].to_numpy()[covered],
+        "reads_n": readsN[covered],
+        "context": context_codes[df["context"].cat.codes.to_numpy()[covered]],
+        "strand": strand_codes[df["strand"].cat.codes.to_numpy()[covered]],
+    }
+    for code in pd.unique(chromosomes):
+        mask = chromosomes == code
+        yield chromosome_names[code], {column: values[mask] for column, values in columns.items()}
+
+
+# 写出矩阵索引（先写入临时文件再重命名），合并矩阵还需要记录样本名称及各样本矩阵的索引文件信息
+def write_matrix_index(matrix_dir, chromosomes, samples=None, sources=None):
+    index = {
+        "version": MATRIX_VERSION,
+        "columns": {column: np.dtype(dtype).str for column, dtype in MATRIX_COLUMNS.items()},
+        "contexts": CONTEXTS,
+        "strands": STRANDS,
+        "chromosomes": chromosomes,
+    }
+    if samples is not None:
+        index["samples"] = samples
+        index["sources"] = sources
+    temp_file = f"{matrix_dir}/index.json.tmp"
+    with open(temp_file, "w") as file:
+        json.dump(index, file, indent=2)
+    os.replace(temp_file, f"{matrix_dir}/index.json")
+
+
+##################################################################
+# 合并多个样本的甲基化矩阵
+##################################################################
+
+
+# 对多个已排序的位置数组做分块的k路归并，每次返回一块的位置并集及各样本对应的行范围
+# 每块的右边界取各样本下一块末尾位置的最小值，因此每个样本每次最多读取block_size个位点
+def merge_blocks(positions, block_size=MERGE_BLOCK_SIZE):
+    cursors = [0] * len(positions)
+    while True:
+        ends = [
+            position[min(cursor + block_size, len(position)) - 1]
+            for position, cursor in zip(positions, cursors)
+            if cursor < len(position)
+        ]
+        if not ends:
+            break
+        boundary = min(ends)
+        ranges = []
+        for i, position in enumerate(positions):
+            end = cursors[i] + int(np.searchsorted(position[cursors[i] : cursors[i] + block_size], boundary, side="right"))
+            ranges.append((cursors[i], end))
+            cursors[i] = end
+        union = np.unique(np.concatenate([position[first:last] for position, (first, last) in zip(positions, ranges)]))
+        yield union, ranges
+
+
+# 合并一条染色体：先统计位点并集的大小，再按块把各样本的数据写入对应的位置
+def merge_chromosome(sample_dirs, prefixes, output_dir, prefix):
+    columns = {}
+    for column in MATRIX_COLUMNS:
+        columns[column] = [
+            np.load(f"{sample_dir}/{sample_prefix}.{column}.npy", mmap_mode="r")
+            if sample_prefix is not None
+            else np.zeros(0, dtype=MATRIX_COLUMNS[column])
+            for sample_dir, sample_prefix in zip(sample_dirs, prefixes)
+        ]
+    positions = columns["position"]
+    count = sum(len(union) for union, _ in merge_blocks(positions))
+
+    output = {}
+    for column, dtype in MATRIX_COLUMNS.items():
+        shape = (len(sample_dirs), count) if column in ["reads_m", "reads_n"] else (count,)
+        output[column] = np.lib.format.open_memmap(f"{output_dir}/{prefix}.{column}.npy", mode="w+", dtype=dtype, shape=shape)
+
+    offset = 0
+    for union, ranges in merge_blocks(positions):
+        block = slice(offset, offset + len(union))
+        output["position"][block] = union
+        for i, (first, last) in enumerate(ranges):
+            if first == last:
+                continue
+            rows = offset + np.searchsorted(union, positions[i][first:last])
+            output["context"][rows] = columns["context"][i][first:last]
+            output["strand"][rows] = columns["strand"][i][first:last]
+            output["reads_m"][i, rows] = columns["reads_m"][i][first:last]
+            output["reads_n"][i, rows] = columns["reads_n"][i][first:last]
+        offset += len(union)
+
+    for values in output.values():
+        values.flush()
+    start = int(output["position"][0]) if count else None
+    end = int(output["position"][-1]) if count else None
+    return {"prefix": prefix, "count": count, "start": start, "end": end}
+
+
+# 各样本矩阵索引文件的大小和修改时间，用于判断合并矩阵是否需要重新生成
+def matrix_sources(sample_names, sample_dirs):
+    sources = {}
+    for sample_name, sample_dir in zip(sample_names, sample_dirs):
+        stat = os.stat(f"{sample_dir}/index.json")
+        sources[sample_name] = [os.path.abspath(sample_dir), stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+# 合并多个样本的甲基化矩阵，每条染色体由一个子进程合并；各样本矩阵未变化时直接跳过
+def merge_matrices(sample_names, sample_dirs, output_dir, parallel_num=1):
+    indexes = []
+    for sample_dir in sample_dirs:
+        with open(f"{sample_dir}/index.json", "r") as file:
+            indexes.append(json.load(file))
+    sources = matrix_sources(sample_names, sample_dirs)
+    index_file = f"{output_dir}/index.json"
+    if os.path.exists(index_file):
+        with open(index_file, "r") as file:
+            index = json.load(file)
+        if index.get("version") == MATRIX_VERSION and index.get("sources") == sources:
+            print(f"合并矩阵已是最新，跳过: {output_dir}")
+            return
+        os.remove(index_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 染色体按在各样本中首次出现的顺序排列
+    chromosome_names = list(dict.fromkeys(name for index in indexes for name in index["chromosomes"]))
+    start_time = time.time()
+    chromosomes = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(parallel_num, len(chromosome_names)))) as executor:
+        futures = {}
+        for chromosome in chromosome_names:
+            prefixes = [index["chromosomes"].get(chromosome, {}).get("prefix") for index in indexes]
+            future = executor.submit(
+                merge_chromosome, sample_dirs, prefixes, output_dir, chromosome_prefix(chromosome)
+            )
+            futures[future] = chromosome
+        for i, future in enumerate(as_completed(futures)):
+            chromosome = futures[future]
+            chromosomes[chromosome] = future.result()
+            print(f"Merged chromosome {i + 1}/{len(chromosome_names)}: {chromosome} ({chromosomes[chromosome]['count']} sites)")
+    chromosomes = {chromosome: chromosomes[chromosome] for chromosome in chromosome_names}
+    write_matrix_index(output_dir, chromosomes, samples=sample_names, sources=sources)
+    print(f"合并矩阵已生成: {output_dir}（{len(sample_names)}个样本, 耗时{time.time() - start_time:.2f}秒）")
+
+
+##################################################################
+# 读取甲基化矩阵
+##################################################################
+
+
+# 单个样本或多样本合并的甲基化矩阵，按区间随机读取
+class MethylationMatrix:
+    def __init__(self, matrix_dir):
+        self.matrix_dir = matrix_dir.rstrip("/")
+        with open(f"{self.matrix_dir}/index.json", "r") as file:
+            self.index = json.load(file)
+        if self.index.get("version") != MATRIX_VERSION:
+            raise ValueError(f"不支持的甲基化矩阵版本: {self.index.get('version')}")
+        self.chromosomes = self.index["chromosomes"]
+        self.samples = self.index.get("samples")
+        # 已打开的内存映射，随矩阵对象一起释放
+        self._columns = {}
+
+    # 以内存映射方式打开一条染色体的一列（首次读取时打开）
+    def column(self, chromosome, column):
+        key = (chromosome, column)
+        if key not in self._columns:
+            if chromosome not in self.chromosomes:
+                raise KeyError(f"甲基化矩阵中不存在染色体: {chromosome}")
+            prefix = self.chromosomes[chromosome]["prefix"]
+            self._columns[key] = np.load(f"{self.matrix_dir}/{prefix}.{column}.npy", mmap_mode="r")
+        return self._columns[key]
+
+    # 区间[start, end]（1-based，包含两端）在该染色体中的行范围
+    def rows(self, chromosome, start, end):
+        position = self.column(chromosome, "position")
+        return np.searchsorted(position, start, side="left"), np.searchsorted(position, end, side="right")
+
+    # 查询区间内的全部位点，返回各列数组（合并矩阵的reads_m和reads_n为二维数组）；可以只返回指定context的位点
+    def query(self, chromosome, start, end, context=None):
+        first, last = self.rows(chromosome, start, end)
+        columns = {column: np.array(self.column(chromosome, column)[..., first:last]) for column in MATRIX_COLUMNS}
+        if context is not None:
+            mask = columns["context"] == CONTEXTS.index(context)
+            columns = {column: values[..., mask] for column, values in columns.items()}
+        return columns
+
+    # 查询区间内的全部位点，单个样本返回与CX_report列名一致的DataFrame，合并矩阵返回每个样本的readsM/readsN列
+    def query_frame(self, chromosome, start, end, context=None):
+        columns = self.query(chromosome, start, end, context)
+        df = pd.DataFrame(
+            {
+                "chromosome": chromosome,
+                "position": columns["position"],
+                "strand": np.array(STRANDS)[columns["strand"]],
+            }
+        )
+        if self.samples is None:
+            df["readsM"] = columns["reads_m"]
+            df["readsU"] = columns["reads_n"] - columns["reads_m"]
+        else:
+            for i, sample_name in enumerate(self.samples):
+                df[f"readsM_{sample_name}"] = columns["reads_m"][i]
+                df[f"readsN_{sample_name}"] = columns["reads_n"][i]
+        df["context"] = np.array(CONTEXTS)[columns["context"]]
+        return df
+
+
+# 解析区间字符串，如 chr1:10000-15000
+def parse_region(region):
+    match = re.fullmatch(r"(.+):([\d,]+)-([\d,]+)", region)
+    if not match:
+        raise ValueError(f"区间格式应为 染色体:起点-终点，当前为: {region}")
+    return match.group(1), int(match.group(2).replace(",", "")), int(match.group(3).replace(",", ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询甲基化矩阵，或合并多个样本的甲基化矩阵")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser("query", help="查询指定区间的位点，以TSV格式输出")
+    query_parser.add_argument("matrix_dir", type=str, help="甲基化矩阵文件夹（包含index.json）")
+    query_parser.add_argument("region", type=str, help="查询区间，如 chr1:10000-15000（1-based，包含两端）")
+    query_parser.add_argument("--context", type=str, choices=CONTEXTS, help="只输出指定context的位点")
+
+    merge_parser = subparsers.add_parser("merge", help="合并多个样本的甲基化矩阵")
+    merge_parser.add_argument("samples", type=str, nargs="+", help="样本名称及其甲基化矩阵文件夹，格式为 样本名称=文件夹")
+    merge_parser.add_argument("-o", "--output_dir", type=str, required=True, help="合并矩阵的输出文件夹")
+    merge_parser.add_argument("--parallel_num", type=int, default=1, help="同时合并的染色体数（进程数），默认值为1")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        matrix = MethylationMatrix(args.matrix_dir)
+        chromosome, start, end = parse_region(args.region)
+        matrix.query_frame(chromosome, start, end, args.context).to_csv(sys.stdout, sep="\t", index=False)
+    else:
+        sample_names, sample_dirs = zip(*(item.split("=", 1) for item in args.samples))
+        merge_matrices(list(sample_names), [path.rstrip("/") for path in sample_dirs], args.output_dir, args.parallel_num)
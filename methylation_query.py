@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from dmr_bins import DMR_COLUMNS
+from methylation_analyse import DotDict, jsonload, read_samples_file
+from methylation_matrix import CONTEXTS, STRANDS, MethylationMatrix, parse_region
+
+# 按区间查询各样本的甲基化比例及重叠的DMR，用于反复调整绘图区间（config.json中的seqname/start/end）
+# 甲基化矩阵（多样本合并矩阵或各样本的矩阵）及DMR文件打开后保存在LRU缓存中，文件更新后自动重新打开，
+# 同一进程（或HTTP服务）中的后续查询只需二分查找并读取区间内的数据
+# 可以作为库调用（query_region），也可以在命令行查询或以 --serve 启动本地HTTP服务
+
+QUERY_CACHE_SIZE = 32  # 最多同时打开的甲基化矩阵及DMR文件数
+DEFAULT_PORT = 8765
+
+
+# 文件的修改时间（不存在时为None），作为缓存键的一部分，文件更新后重新打开
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# 解析查询参数：样本（名称、分组、甲基化矩阵文件夹）、多样本合并矩阵及DMR文件
+def parse_query_config(data):
+    config = DotDict()
+    output_dir = data.get("output_dir", "./output").rstrip("/")
+    config["cohort_matrix_dir"] = data.get("cohort_matrix_dir") or f"{output_dir}/cohort_matrix"
+
+    if data.get("samples_file"):
+        samples = read_samples_file(data["samples_file"]).to_dict("records")
+    else:
+        samples = data.get("samples", [])
+    config["samples"] = []
+    for sample in samples:
+        # 与methylation_analyse.py一致，样本输出文件夹默认为input_1所在文件夹下的output
+        input_1 = sample.get("input_1") or f"{sample['sample_name']}/{sample['sample_name']}_1.fq.gz"
+        sample_output_dir = sample.get("output_dir")
+        if not isinstance(sample_output_dir, str) or not sample_output_dir:
+            sample_output_dir = f"{os.path.dirname(input_1)}/output"
+        config["samples"].append(
+            DotDict(
+                sample_name=sample["sample_name"],
+                group_name=sample.get("group_name"),
+                matrix_dir=f"{sample_output_dir.rstrip('/')}/methylation_matrix",
+            )
+        )
+
+    config["dmr_file"] = data.get("dmr_file")
+    if not config.dmr_file and data.get("group_a") and data.get("group_b"):
+        config["dmr_file"] = f"{output_dir}/{data['group_a']}_and_{data['group_b']}/DMRsReplicatesBins.txt"
+    return config
+
+
+# 打开甲基化矩阵（LRU缓存，index.json的修改时间作为缓存键的一部分）
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def open_matrix(matrix_dir, mtime):
+    return MethylationMatrix(matrix_dir)
+
+
+def get_matrix(matrix_dir):
+    mtime = file_mtime(f"{matrix_dir}/index.json")
+    return None if mtime is None else open_matrix(matrix_dir, mtime)
+
+
+# 读取DMR文件并按染色体分组、按起始位置排序（LRU缓存，文件的修改时间作为缓存键的一部分）
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def open_dmrs(dmr_file, mtime):
+    if os.path.getsize(dmr_file) == 0:
+        return {}
+    df = pd.read_csv(dmr_file, sep="\t", header=None, names=DMR_COLUMNS, dtype={"seqnames": str})
+    dmrs = {}
+    for seqname, group in df.groupby("seqnames", sort=False):
+        group = group.sort_values("start", kind="stable").reset_index(drop=True)
+        dmrs[seqname] = (group, group["start"].to_numpy(), int((group["end"] - group["start"]).max()) + 1)
+    return dmrs
+
+
+# 查询与区间[start, end]重叠的DMR
+def query_dmrs(dmr_file, seqname, start, end):
+    mtime = file_mtime(dmr_file) if dmr_file else None
+    if mtime is None:
+        return pd.DataFrame(columns=DMR_COLUMNS)
+    dmrs = open_dmrs(dmr_file, mtime).get(seqname)
+    if dmrs is None:
+        return pd.DataFrame(columns=DMR_COLUMNS)
+    df, starts, max_width = dmrs
+    first = np.searchsorted(starts, start - max_width + 1, side="left")
+    last = np.searchsorted(starts, end, side="right")
+    df = df.iloc[first:last]
+    return df[df["end"] >= start].reset_index(drop=True)
+
+
+# 甲基化矩阵查询结果转换为长表（每个样本每个有覆盖的位点一行）
+def methylation_frame(columns, sample_names, group_names, rows=None):
+    parts = []
+    for i, (sample_name, group_name) in enumerate(zip(sample_names, group_names)):
+        reads_m = columns["reads_m"] if rows is None else columns["reads_m"][rows[i]]
+        reads_n = columns["reads_n"] if rows is None else columns["reads_n"][rows[i]]
+        covered = reads_n > 0
+        parts.append(
+            pd.DataFrame(
+                {
+                    "sample_name": sample_name,
+                    "group_name": group_name,
+                    "position": columns["position"][covered],
+                    "strand": np.array(STRANDS)[columns["strand"][covered]],
+                    "context": np.array(CONTEXTS)[columns["context"][covered]],
+                    "reads_m": reads_m[covered],
+                    "reads_n": reads_n[covered],
+                    "proportion": reads_m[covered] / reads_n[covered],
+                }
+            )
+        )
+    if not parts:
+        return pd.DataFrame(columns=["sample_name", "group_name", "position", "strand", "context", "reads_m", "reads_n", "proportion"])
+    return pd.concat(parts, ignore_index=True)
+
+
+# 查询区间内各样本的甲基化比例，合并矩阵包含所有查询样本时只读取合并矩阵，否则读取各样本的矩阵
+def query_methylation(config, seqname, start, end, context=None, sample_names=None):
+    samples = config.samples
+    if sample_names:
+        samples = [sample for sample in samples if sample.sample_name in sample_names]
+        missing = set(sample_names) - {sample.sample_name for sample in samples}
+        if missing:
+            raise ValueError(f"样本不存在: {', '.join(sorted(missing))}")
+    names = [sample.sample_name for sample in samples]
+    groups = [sample.group_name for sample in samples]
+
+    cohort = get_matrix(config.cohort_matrix_dir)
+    if cohort is not None and cohort.samples and set(names) <= set(cohort.samples):
+        if seqname not in cohort.chromosomes:
+            return methylation_frame({}, [], [])
+        columns = cohort.query(seqname, start, end, context)
+        return methylation_frame(columns, names, groups, [cohort.samples.index(name) for name in names])
+
+    parts = []
+    for sample in samples:
+        matrix = get_matrix(sample.matrix_dir)
+        if matrix is None:
+            raise FileNotFoundError(f"样本{sample.sample_name}的甲基化矩阵不存在: {sample.matrix_dir}")
+        if seqname in matrix.chromosomes:
+            columns = matrix.query(seqname, start, end, context)
+            parts.append(methylation_frame(columns, [sample.sample_name], [sample.group_name]))
+    return pd.concat(parts, ignore_index=True) if parts else methylation_frame({}, [], [])
+
+
+# 查询区间（如 chr1:10000-15000）内各样本的甲基化比例及重叠的DMR
+def query_region(config, region, context=None, sample_names=None):
+    seqname, start, end = parse_region(region)
+    return {
+        "methylation": query_methylation(config, seqname, start, end, context, sample_names),
+        "dmrs": query_dmrs(config.dmr_file, seqname, start, end),
+    }
+
+
+##################################################################
+# 本地HTTP服务
+##################################################################
+
+
+# 数据框转换为按列存储的JSON对象
+def frame_to_json(df):
+    return {column: df[column].tolist() for column in df.columns}
+
+
+# 请求处理：/methylation、/dmrs返回单个表格（format=json或tsv），/query返回两个表格（json）
+def query_handler(config):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            start_time = time.time()
+            try:
+                if url.path not in ["/query", "/methylation", "/dmrs"]:
+                    return self.send_text(404, "可用的路径：/query、/methylation、/dmrs")
+                if "region" not in params:
+                    return self.send_text(400, "缺少参数：region")
+                sample_names = params["samples"].split(",") if params.get("samples") else None
+                result = query_region(config, params["region"], params.get("context"), sample_names)
+            except (ValueError, FileNotFoundError) as e:
+                return self.send_text(400, str(e))
+
+            if url.path == "/query":
+                body = {name: frame_to_json(df) for name, df in result.items()}
+                body["elapsed"] = time.time() - start_time
+                return self.send_body(200, json.dumps(body), "application/json")
+            df = result[url.path[1:]]
+            if params.get("format") == "tsv":
+                return self.send_body(200, df.to_csv(sep="\t", index=False), "text/tab-separated-values")
+            return self.send_body(200, json.dumps(frame_to_json(df)), "application/json")
+
+        def send_text(self, status, text):
+            self.send_body(status, text, "text/plain")
+
+        def send_body(self, status, body, content_type):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return QueryHandler
+
+
+# 启动本地HTTP服务（默认只监听127.0.0.1）
+def serve(config, host="127.0.0.1", port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), query_handler(config))
+    print(f"查询服务已启动: http://{host}:{port}/query?region=chr1:10000-15000")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按区间查询各样本的甲基化比例及重叠的DMR，或启动本地HTTP查询服务")
+    parser.add_argument("region", type=str, nargs="?", help="查询区间，如 chr1:10000-15000（1-based，包含两端）")
+    parser.add_argument("-c", "--config", type=str, help="配置文件路径（读取样本、分组及输出文件夹）")
+    parser.add_argument("-f", "--samples_file", type=str, help="以tsv/csv/excel文件传入样本参数")
+    parser.add_argument("-a", "--group_a", type=str, help="DMR的组A名称（用于查找DMR文件）")
+    parser.add_argument("-b", "--group_b", type=str, help="DMR的组B名称（用于查找DMR文件）")
+    parser.add_argument("-m", "--cohort_matrix_dir", type=str, help="多样本合并矩阵的文件夹，默认值为：{output_dir}/cohort_matrix")
+    parser.add_argument("-d", "--dmr_file", type=str, help="DMR文件，默认值为：{output_dir}/{组A}_and_{组B}/DMRsReplicatesBins.txt")
+    parser.add_argument("--context", type=str, choices=CONTEXTS, help="只查询指定context的位点")
+    parser.add_argument("--samples", type=str, nargs="+", help="只查询指定的样本，默认为全部样本")
+    parser.add_argument("-o", "--output_dir", type=str, help="查询结果的输出文件夹（methylation.tsv、dmrs.tsv），默认输出到控制台")
+    parser.add_argument("--serve", action="store_true", help="添加该参数以启动本地HTTP查询服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="HTTP服务的监听地址，默认值为127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"HTTP服务的端口，默认值为{DEFAULT_PORT}")
+    args = parser.parse_args()
+
+    data = jsonload(args.config) if args.config else {}
+    for key in ["samples_file", "group_a", "group_b", "cohort_matrix_dir", "dmr_file"]:
+        if getattr(args, key) is not None:
+            data[key] = getattr(args, key)
+    config = parse_query_config(data)
+
+    if args.serve:
+        serve(config, args.host, args.port)
+        sys.exit(0)
+    if not args.region:
+        parser.error("缺少查询区间（region），或添加--serve启动HTTP服务")
+
+    start_time = time.time()
+    result = query_region(config, args.region, args.context, args.samples)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for name, df in result.items():
+            df.to_csv(f"{args.output_dir}/{name}.tsv", sep="\t", index=False)
+        print(f"查询结果已输出到: {args.output_dir}（{len(result['methylation'])}个位点，{len(result['dmrs'])}个DMR，耗时{time.time() - start_time:.3f}秒）")
+    else:
+        for name, df in result.items():
+            print(f"# {name}")
+            df.to_csv(sys.stdout, sep="\t", index=False)
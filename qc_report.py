@@ -1,15 +1,21 @@
 import argparse
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
 import re
 import sys
 import pandas as pd
-from matplotlib import pyplot as plt
+import matplotlib
+
+# 使用非交互式的Agg后端，只输出图片文件
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
 import numpy as np
 import seaborn as sns
 from matplotlib.ticker import FuncFormatter
 
+from sample_summary import parse_colon_report, parse_deduplication_percentage, parse_mbias, read_summary
+
 ##################################################################
 # 定义相关的工具方法
 ##################################################################
@@ -106,69 +112,102 @@ def read_samples_file(file_path):
     return samples
 
 
-##################################################################
-# 设置命令行参数
-##################################################################
+# 图片渲染配置：分辨率及图片格式
+RENDER_PROFILES = {
+    "draft": {"dpi": 100, "format": "png"},  # 快速预览
+    "screen": {"dpi": 200, "format": "png"},  # 屏幕查看
+    "print": {"dpi": 600, "format": "pdf"},  # 矢量格式，用于印刷（dpi只影响其中的栅格元素）
+    "default": {"dpi": 1000, "format": "jpg"},  # 与之前版本的输出一致
+}
+RENDER = dict(RENDER_PROFILES["default"])
 
+# 组装到染色体上的序列名称前缀：RefSeq的accession（NC_000067.7）或按chromosome_aliases.tsv重命名后的名称（chr1）
+CHROMOSOME_PREFIXES = ("NC", "chr")
 
-parser = argparse.ArgumentParser(description="甲基化分析参数描述")
-parser.add_argument("-c", "--config", type=str, help="添加配置文件（配置文件中的参数可以被命令行参数覆盖）")
-parser.add_argument(
-    "-r",
-    "--report_dir",
-    type=str,
-    help="全局报告输出文件夹（不宜放在样本文件夹中的报告），默认值为：{当前文件夹}/report",
-)
-parser.add_argument(
-    "f",
-    "--samples_file",
-    type=str,
-    help="样本配置文件路径（从配置文件所有的样本参数，支持csv/tsv/excel格式）",
-)
-args = DotDict(vars(parser.parse_args()))
+# 当前进程中可复用的Figure对象（按图表名称区分），避免每个样本都重新创建和销毁
+FIGURES = {}
 
 
-##################################################################
-# 参数解析
-##################################################################
+# 设置图片渲染配置（在每个子进程启动时调用）
+def set_render_options(profile, dpi=None, figure_format=None):
+    RENDER.update(RENDER_PROFILES[profile])
+    if dpi:
+        RENDER["dpi"] = dpi
+    if figure_format:
+        RENDER["format"] = figure_format
+
+
+# 获取指定名称的Figure对象，已存在时清空后复用
+def get_figure(name, figsize=None):
+    fig = FIGURES.get(name)
+    if fig is None:
+        fig = FIGURES[name] = Figure(figsize=figsize)
+    else:
+        fig.clf()
+    return fig
 
-print("参数解析...")
 
-# 交互式命令时使用以下代码加载config文件
-# args = DotDict({"config":"config.json"})
+# 按渲染配置保存图片，output_file不含扩展名
+def save_figure(fig, output_file):
+    fig.savefig(f"{output_file}.{RENDER['format']}", dpi=RENDER["dpi"], format=RENDER["format"])
 
-# 初始化一个空的配置参数字典
-config = DotDict()
-# 如果提供了配置文件，则加载配置文件的参数
-if args.config:
-    # 读取配置文件
-    config = DotDict(jsonload(args.config))
 
-# 用命令行参数覆盖配置文件的参数
-for k, v in args.items():
-    if v != None:
-        config[k] = v
+##################################################################
+# 读取样本数据（每个输入文件只解析一次）
+##################################################################
 
-# 解析报告文件夹
-config.report_dir = config.get("report_dir", "./report").rstrip("/")
-# 如果文件夹不存在则创建
-if not os.path.exists(config.report_dir):
-    os.makedirs(config.report_dir)
 
-# print(config)
+# 样本汇总文件的路径（由主流程的sample_summary步骤生成）
+def sample_summary_file(sample):
+    return f"{sample.output_dir}/{sample.sample_name}_summary.parquet"
+
+
+# 单个样本生成报告所需的输入文件，存在样本汇总文件时所有数据都从汇总文件中读取
+def sample_input_files(sample):
+    summary_file = sample_summary_file(sample)
+    if os.path.exists(summary_file):
+        return {key: summary_file for key in INPUT_PARSERS}
+
+    alignment_prefix = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2"
+    deduplicate_prefix = f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe"
+    methylation_prefix = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated"
+    return {
+        "pe_report": f"{alignment_prefix}_PE_report.txt",
+        "deduplication_percentage": f"{deduplicate_prefix}.deduplication_report.txt",
+        "splitting_report": f"{methylation_prefix}_splitting_report.txt",
+        "mbias": f"{methylation_prefix}.M-bias.txt",
+        "depth_report": f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt",
+        "coverage_report": f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt",
+        "distribution_report": f"{sample.output_dir}/{sample.sample_name}_methylation_distribution_report.txt",
+    }
+
+
+# 每种输入文件的解析方法
+INPUT_PARSERS = {
+    "pe_report": parse_colon_report,
+    "deduplication_percentage": parse_deduplication_percentage,
+    "splitting_report": parse_colon_report,
+    "mbias": parse_mbias,
+    "depth_report": lambda path: pd.read_csv(path, sep="\t"),
+    "coverage_report": lambda path: pd.read_csv(path, sep="\t"),
+    "distribution_report": lambda path: pd.read_csv(path, sep="\t"),
+}
+
+
+# 读取单个样本生成报告所需的输入文件（默认全部读取），各报告函数共用解析结果
+def load_sample(sample, keys=None):
+    data = DotDict()
+    summary_file = sample_summary_file(sample)
+    if os.path.exists(summary_file):
+        for key, value in read_summary(summary_file).items():
+            if keys is None or key in keys:
+                data[key] = value
+        return data
+    for key, path in sample_input_files(sample).items():
+        if keys is None or key in keys:
+            data[key] = INPUT_PARSERS[key](path)
+    return data
 
-# 解析样本参数
-if config.samples_file:
-    # 传入表格文件，则使用pandas读取表格
-    samples_pd = read_samples_file(config.samples_file)
-    samples = [parse_sample_config(sample) for i, sample in samples_pd.iterrows()]
-elif isinstance(config.samples, list) and len(config.samples) > 0:
-    # 遍历json解析样本参数
-    samples = [parse_sample_config(sample) for sample in config.samples]
-else:
-    raise Exception("sample_file参数和config文件中的samples参数都不存在，无法读取样本信息")
-
-print("参数解析完成")
 
 ##################################################################
 # 报告生成
@@ -179,20 +218,8 @@ print("参数解析完成")
 
 
 # 表2 QC质控表
-print("生成QC质控表")
-
-
-def calc_qc(sample):
-    data = {}
-    path = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2_PE_report.txt"
-    with open(path, "r") as file:
-        for line in file:
-            if line.count(":") == 1:  # 匹配包含1个冒号的行
-                parts = line.split(":")
-                try:
-                    data[parts[0].strip()] = int(parts[1].strip())
-                except:
-                    pass
+def calc_qc(sample, data):
+    data = data.pe_report
     item = {}
     item["Sample Id"] = sample.sample_name
     item["Clean Reads"] = data["Sequence pairs analysed in total"]
@@ -218,73 +245,47 @@ def calc_qc(sample):
     return item
 
 
-report_qc = []
-for sample in samples:
-    item = calc_qc(sample)
-    item = report_qc.append(item)
-report_qc = pd.DataFrame(report_qc)
-report_qc.to_csv(f"{config.report_dir}QC quality control table for each sample.tsv", sep="\t", index=False)
-
-
 # 图3 测序深度分布图
-print("绘制测序深度分布图")
-
-
-def plot_methylation_depth_distribution(sample):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt"
-    output_file = f"{sample.report_dir}/Coverage of Corresponding Depth in Sample.jpg"
-    df = pd.read_csv(input_file, sep="\t")
+def plot_methylation_depth_distribution(sample, data):
+    output_file = f"{sample.report_dir}/Coverage of Corresponding Depth in Sample"
+    df = data.depth_report.copy()
     df["C"] = df.sum(axis=1)
     df = df.set_index("Depth")
     df = df[["C", "CG", "CHG", "CHH"]]
     df = df / df.sum(axis=0)
-    df.plot()
-    plt.title(f"Coverage of Corresponding Depth in Sample:{sample.sample_name}")
-    plt.ylabel("Fraction of Covered (%)")
-    plt.legend(title="Context")
-    plt.savefig(output_file, dpi=1000)
-    plt.close()
-
-
-for sample in samples:
-    df_coverage = plot_methylation_depth_distribution(sample)
+    fig = get_figure("depth_distribution")
+    ax = fig.subplots()
+    df.plot(ax=ax)
+    ax.set_title(f"Coverage of Corresponding Depth in Sample:{sample.sample_name}")
+    ax.set_ylabel("Fraction of Covered (%)")
+    ax.legend(title="Context")
+    save_figure(fig, output_file)
 
 
 # 图4 C碱基测序深度的累积分布图
-print("绘制C碱基测序深度的累积分布图")
-
-
-def plot_cumulative_methylation_depth_distribution(sample):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt"
-    output_file = f"{sample.report_dir}/Cumulative Coverage of Corresponding Depth in Sample.jpg"
-    df = pd.read_csv(input_file, sep="\t")
+def plot_cumulative_methylation_depth_distribution(sample, data):
+    output_file = f"{sample.report_dir}/Cumulative Coverage of Corresponding Depth in Sample"
+    df = data.depth_report.copy()
     df["C"] = df.sum(axis=1)
     df = df.set_index("Depth")
     df = df[["C", "CG", "CHG", "CHH"]]
     df = df / df.sum(axis=0)
     df = df.cumsum()  # 计算累积分布
-    df.plot()
-    plt.title(f"Cumulative Coverage of Corresponding Depth in Sample:{sample.sample_name}")
-    plt.ylabel("Fraction of Covered (%)")
-    plt.legend(title="Context")
-    plt.savefig(output_file, dpi=1000)
-    plt.close()
-
-
-for sample in samples:
-    df_coverage = plot_cumulative_methylation_depth_distribution(sample)
+    fig = get_figure("cumulative_depth_distribution")
+    ax = fig.subplots()
+    df.plot(ax=ax)
+    ax.set_title(f"Cumulative Coverage of Corresponding Depth in Sample:{sample.sample_name}")
+    ax.set_ylabel("Fraction of Covered (%)")
+    ax.legend(title="Context")
+    save_figure(fig, output_file)
 
 
 # 表3、表4 样品在全基因组各染色体上的C位点覆盖度统计表
-print("生成C位点覆盖度统计表")
-
-
-def calc_coverage_rate_by_chromosome(sample):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt"
+def calc_coverage_rate_by_chromosome(sample, data):
     output_file = f"{sample.report_dir}/Coverage Rate Group By Chromosome.tsv"
-    df = pd.read_csv(input_file, sep="\t")
-    # 过滤只保留Chromosome列中以NC开头的行
-    df = df[df["Chromosome"].str.startswith("NC")]
+    df = data.coverage_report
+    # 过滤只保留组装到染色体上的行（NC开头的accession或按对照表重命名后的chr名称）
+    df = df[df["Chromosome"].str.startswith(CHROMOSOME_PREFIXES)].copy()
     # 计算每个 context 的覆盖率
     df["CoverageRate"] = round(df["covered"] / df["Count"] * 100, 2)
 
@@ -309,63 +310,19 @@ def calc_coverage_rate_by_chromosome(sample):
     return pivot_table
 
 
-df_coverage_list = []
-for sample in samples:
-    df_coverage = calc_coverage_rate_by_chromosome(sample)
-    df_coverage.insert(0, "sample_name", sample.sample_name)
-    df_coverage_list.append(df_coverage)
-df_coverage_list = pd.concat(df_coverage_list, axis=0).reset_index(drop=True)
-df_coverage_list.to_csv(f"{config.report_dir}/Coverage Rate Group By Chromosome.tsv", sep="\t", index=False)
-
-
 # 表7 各样品QC质控表(去重之后的数据)
-print("生成QC质控表(去重后)")
-
-
-def calc_qc_deduplicated(sample):
-    PE_report = {}
-    path = f"{sample.output_dir}/bismark_alignment/{sample.prefix}_bismark_bt2_PE_report.txt"
-    with open(path, "r") as file:
-        for line in file:
-            if line.count(":") == 1:  # 匹配包含1个冒号的行
-                parts = line.split(":")
-                try:
-                    PE_report[parts[0].strip()] = int(parts[1].strip())
-                except:
-                    pass
-
-    # 查找deduplication_percentage
-    percentage_pattern = re.compile(r"Total number duplicated alignments removed:.*?(\d+\.\d+)%")
-    path = f"{sample.output_dir}/bismark_deduplicate/{sample.prefix}_bismark_bt2_pe.deduplication_report.txt"
-    with open(path, "r") as file:
-        for line in file:
-            match = percentage_pattern.search(line)
-            if match:
-                deduplication_percentage = match.group(1)
-                break
-
-    # 查找去重后的甲基化、非甲基化数据
-    splitting_report = {}
-    path = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated_splitting_report.txt"
-    with open(path, "r") as file:
-        for line in file:
-            if line.count(":") == 1:  # 匹配包含1个冒号的行
-                parts = line.split(":")
-                try:
-                    splitting_report[parts[0].strip()] = int(parts[1].strip())
-                except:
-                    pass
+def calc_qc_deduplicated(sample, data):
+    PE_report = data.pe_report
+    splitting_report = data.splitting_report
 
     # 计算平均深度
-    path = f"{sample.output_dir}/{sample.sample_name}_methylation_depth_report.txt"
-    depth_report = pd.read_csv(path, sep="\t")
+    depth_report = data.depth_report.copy()
     depth_report["C"] = depth_report[["CG", "CHG", "CHH"]].sum(axis=1)
     depth_report["CxDepth"] = depth_report["C"] * depth_report["Depth"]
     avg_depth = (depth_report["CxDepth"].sum() / depth_report["C"].sum()).round(2)
 
     # 计算Coverage
-    path = f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt"
-    coverage_report = pd.read_csv(path, sep="\t")
+    coverage_report = data.coverage_report
     coverage = (coverage_report["covered"].sum() / coverage_report["Count"].sum() * 100).round(2)
 
     item = {}
@@ -391,39 +348,25 @@ def calc_qc_deduplicated(sample):
         * 100,
         2,
     )
-    item["Duplication Rate (%)"] = deduplication_percentage
+    item["Duplication Rate (%)"] = data.deduplication_percentage
     item["Average Depth (X)"] = avg_depth
     item["Coverage (%)"] = coverage
     return item
 
 
-report_qc_deduplicated = []
-for sample in samples:
-    item = calc_qc_deduplicated(sample)
-    report_qc_deduplicated.append(item)
-report_qc_deduplicated = pd.DataFrame(report_qc_deduplicated)
-report_qc_deduplicated.to_csv(
-    f"{config.report_dir}/QC quality control table for each sample (deduplicated).tsv", sep="\t", index=False
-)
-
-
 # 2. 全基因组甲基化水平分析
 # 用于分析的DNA样品为多细胞样品，因此C碱基的甲基化水平是一个0% ～ 100%范围内的数值，等于该C碱基上覆盖到的支持mC的序列数除以有效覆盖的序列总数，通常CG甲基化存在于基因和重复序列中，在基因表达调控过程中起到非常重要的作用。非CG类型的序列（CHG和CHH）在基因中十分少见，主要存在于基因间区和富含重复序列的区域，在沉默转座子过程中起关键作用。
 
 
 # 表8、表9 样品全基因组及各染色体的平均甲基化水平
-print("生成染色体甲基化水平统计表")
-
-
-def calc_methylation_level_by_chromosome(sample_name):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_coverage_report.txt"
+def calc_methylation_level_by_chromosome(sample, data):
     output_file = f"{sample.report_dir}/Methylation Level Groupp By Chromosome.tsv"
 
     # 读取表格文件
-    df = pd.read_csv(input_file, sep="\t")
+    df = data.coverage_report
 
-    # 过滤只保留Chromosome列中以NC开头的行
-    df = df[df["Chromosome"].str.startswith("NC")]
+    # 过滤只保留组装到染色体上的行（NC开头的accession或按对照表重命名后的chr名称）
+    df = df[df["Chromosome"].str.startswith(CHROMOSOME_PREFIXES)].copy()
 
     # 计算每个 context 的甲基化水平
     df["MethylationLevel"] = round(df["totalReadsM"] / df["totalReadsN"] * 100, 2)
@@ -454,44 +397,13 @@ def calc_methylation_level_by_chromosome(sample_name):
     return pivot_table
 
 
-df_methylation_level_list = []
-for sample in samples:
-    df_methylation_level = calc_methylation_level_by_chromosome(sample)
-    df_methylation_level.insert(0, "sample_name", sample.sample_name)
-    df_methylation_level_list.append(df_methylation_level)
-df_methylation_level_list = pd.concat(df_methylation_level_list, axis=0).reset_index(drop=True)
-df_methylation_level_list.to_csv(
-    f"{config.report_dir}/Methylation Level Groupp By Chromosome.tsv", sep="\t", index=False
-)
-
 # 绘制M-bias图
-print("绘制M-bias图")
-
-
-def plot_mbias(mbias_file, sample_name, report_dir):
-    # 读取整个文件内容
-    with open(mbias_file, "r") as file:
-        content = file.read()
-
-    # 定义正则表达式查找不同上下文表格
-    # 正则表达式将匹配上下文标题、分隔符、表头和表数据
-    pattern = r"(\w+) context \((\w+)\)\n=+\n([\s\S]+?)(?=\n[A-Z]|$)"
-    matches = re.findall(pattern, content)
-
-    df = []
-    # 解析匹配到的表格
-    for context, read, table_data in matches:
-        # 将表格转换为 DataFrame
-        item = pd.read_csv(StringIO(table_data), sep="\t")
-        # 添加上下文和read标签列到 DataFrame
-        item.insert(0, "context", context)
-        item.insert(1, "read", read)
-        df.append(item)
-
-    df = pd.concat(df)
+def plot_mbias(df, sample_name, report_dir):
+    df = df.copy()
     for read_name in df["read"].unique():
-        # 创建一个图表
-        fig, ax1 = plt.subplots(figsize=(8, 4))
+        # 获取可复用的图表
+        fig = get_figure(f"mbias_{read_name}", figsize=(8, 4))
+        ax1 = fig.subplots()
 
         # 创建组合字段
         df["read_context"] = df["read"] + " - " + df["context"]
@@ -551,7 +463,7 @@ def plot_mbias(mbias_file, sample_name, report_dir):
         ax2.yaxis.set_major_formatter(FuncFormatter(format_func))
 
         read_fulname = {"R1": "Read 1", "R2": "Read 2"}[read_name]
-        plt.title(f"{sample_name} {read_fulname}")
+        ax1.set_title(f"{sample_name} {read_fulname}")
 
         # 显示图例
         lines, labels = ax1.get_legend_handles_labels()
@@ -561,36 +473,16 @@ def plot_mbias(mbias_file, sample_name, report_dir):
         ax1.legend(lines + lines2, labels + labels2, loc="upper right")
         ax2.get_legend().remove()
 
-        plt.savefig(f"{report_dir}/M-bias {read_name}.jpg", dpi=1000)
-        # plt.show()
-        plt.close()
+        save_figure(fig, f"{report_dir}/M-bias {read_name}")
 
 
-for sample in samples:
-    mbias_file = (
-        f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated.M-bias.txt"
-    )
-    plot_mbias(mbias_file, sample.sample_name, sample.report_dir)
-
 # 3. 甲基化 C碱基中 CG, CHG 与CHH的分布比例
 # mCG，mCHG和mCHH三种碱基类型的构成比例在不同物种中，甚至在同一物种不同样品中都存在很大差异。因此，不同时间、空间、生理条件下的样品会表现出不同的甲基化图谱，各类型mC( mCG、mCHG和mCHH )的数目，及其在全部mC的位点中所占的比例，在一定程度上反映了特定物种的全基因组甲基化图谱的特征。mCG、mCHG和mCHH分别表示表示甲基化CG、甲基化CHG和甲基化CHH。三种碱基类型占比总和为100%，甲基化C鉴定方法依据Lister的文章描述进行。
 
 
 # 表12 mCG、mCHG和mCHH三种类型甲基化胞嘧啶的比例
-print("生成不同context比例统计表")
-
-
-def calc_context_proportion(sample):
-    data = {}
-    path = f"{sample.output_dir}/bismark_methylation/{sample.prefix}_bismark_bt2_pe.deduplicated_splitting_report.txt"
-    with open(path, "r") as file:
-        for line in file:
-            if line.count(":") == 1:  # 匹配包含1个冒号的行
-                parts = line.split(":")
-                try:
-                    data[parts[0].strip()] = int(parts[1].strip())
-                except:
-                    pass
+def calc_context_proportion(sample, data):
+    data = data.splitting_report
     item = {}
     item["Sample Id"] = sample.sample_name
     item["mCG"] = data["Total methylated C's in CpG context"]
@@ -604,33 +496,16 @@ def calc_context_proportion(sample):
     return item
 
 
-df_context_proportion = []
-for sample in samples:
-    item = calc_context_proportion(sample)
-    df_context_proportion.append(item)
-df_context_proportion = pd.DataFrame(df_context_proportion).set_index("Sample Id")
-df_context_proportion.to_csv(
-    f"{config.report_dir}/Proportions of Three Types of Methylated Cytosine.tsv", sep="\t"
-)
-
-
 # 图5 不同序列类型甲基化C碱基的分布比例
-print("绘制不同context比例统计图")
-
-
 def plot_context_proportion(sample, proportion):
-    proportion.plot(kind="pie", autopct="%1.1f%%", figsize=(5, 5))
-    plt.title(f"The proportion of every type mC (Sample: {sample.sample_name})")
-    plt.legend()
-    plt.ylabel("")
-    plt.tight_layout()
-    plt.savefig(f"{sample.report_dir}/The proportion of every type mC.jpg", dpi=1000)
-    plt.close()
-
-
-for sample in samples:
-    proportion = df_context_proportion.loc[sample.sample_name]
-    plot_context_proportion(sample, proportion)
+    fig = get_figure("context_proportion", figsize=(5, 5))
+    ax = fig.subplots()
+    proportion.plot(kind="pie", autopct="%1.1f%%", ax=ax)
+    ax.set_title(f"The proportion of every type mC (Sample: {sample.sample_name})")
+    ax.legend()
+    ax.set_ylabel("")
+    fig.tight_layout()
+    save_figure(fig, f"{sample.report_dir}/The proportion of every type mC")
 
 
 # 4. 甲基化 CG、CHG和CHH的甲基化水平分布
@@ -638,16 +513,12 @@ for sample in samples:
 
 
 # 绘制甲基化水平分布图（按每10%分组）
-print("绘制甲基化水平分布图")
-
-
-def plot_methylation_level_distribution(sample):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_distribution_report.txt"
-    output_file = f"{sample.report_dir}/Methylation Level Distribution.jpg"
+def plot_methylation_level_distribution(sample, data):
+    output_file = f"{sample.report_dir}/Methylation Level Distribution"
 
     # 读取TSV格式的输出文件
-    df = pd.read_csv(input_file, sep="\t")
-    df = df[df["methylation_level"] > 0]
+    df = data.distribution_report
+    df = df[df["methylation_level"] > 0].copy()
 
     # 确保数据按 context 和 methylation_level 排序
     df.sort_values(by=["context", "methylation_level"], inplace=True)
@@ -666,15 +537,16 @@ def plot_methylation_level_distribution(sample):
     df = df / df.sum() * 100  # 计算不同甲基化水平的占比
 
     # 创建绘图
-    df.plot(marker="o", figsize=(6, 4))
-    plt.xlabel("Methylation Level")
-    plt.ylabel("Percentage (%)")
-    plt.title(f"Methylation Level Distribution (Sample: {sample.sample_name})")
-    plt.legend(title="Context")
-    plt.grid(True, linewidth=1, color="#f6f6f6")
-    plt.tight_layout()
-    plt.savefig(output_file, dpi=1000)
-    plt.close()
+    fig = get_figure("methylation_level_distribution", figsize=(6, 4))
+    ax = fig.subplots()
+    df.plot(marker="o", ax=ax)
+    ax.set_xlabel("Methylation Level")
+    ax.set_ylabel("Percentage (%)")
+    ax.set_title(f"Methylation Level Distribution (Sample: {sample.sample_name})")
+    ax.legend(title="Context")
+    ax.grid(True, linewidth=1, color="#f6f6f6")
+    fig.tight_layout()
+    save_figure(fig, output_file)
 
 
 def bin_methylation_levels(df, range_size=10):
@@ -690,20 +562,12 @@ def bin_methylation_levels(df, range_size=10):
     return range_df
 
 
-for sample in samples:
-    plot_methylation_level_distribution(sample)
-
-
 # 绘制甲基化水平累积分布图（按每1%分组）
-print("绘制甲基化水平累积分布图")
-
-
-def plot_cumulative_methylation_level_distribution(sample):
-    input_file = f"{sample.output_dir}/{sample.sample_name}_methylation_distribution_report.txt"
-    output_file = f"{sample.report_dir}/Cumulative Methylation Level Distribution.jpg"
+def plot_cumulative_methylation_level_distribution(sample, data):
+    output_file = f"{sample.report_dir}/Cumulative Methylation Level Distribution"
     # 读取TSV格式的输出文件
-    df = pd.read_csv(input_file, sep="\t")
-    df = df[df["methylation_level"] > 0]
+    df = data.distribution_report
+    df = df[df["methylation_level"] > 0].copy()
 
     # 确保数据按 context 和 methylation_level 排序
     df.sort_values(by=["context", "methylation_level"], inplace=True)
@@ -720,18 +584,309 @@ def plot_cumulative_methylation_level_distribution(sample):
     df = df.cumsum()  # 计算累积分布
 
     # 创建绘图
-    df.plot(figsize=(6, 4))
-    plt.xlabel("Methylation Level")
-    plt.ylabel("Percentage (%)")
-    plt.title(f"Cumulative Methylation Level Distribution (Sample: {sample.sample_name})")
-    plt.legend(title="Context")
-    plt.grid(True, linewidth=1, color="#f6f6f6")
-    plt.tight_layout()
-    plt.savefig(output_file, dpi=1000)
-    plt.close()
+    fig = get_figure("cumulative_methylation_level_distribution", figsize=(6, 4))
+    ax = fig.subplots()
+    df.plot(ax=ax)
+    ax.set_xlabel("Methylation Level")
+    ax.set_ylabel("Percentage (%)")
+    ax.set_title(f"Cumulative Methylation Level Distribution (Sample: {sample.sample_name})")
+    ax.legend(title="Context")
+    ax.grid(True, linewidth=1, color="#f6f6f6")
+    fig.tight_layout()
+    save_figure(fig, output_file)
+
+
+# 计算覆盖度统计表，并添加样本名称列用于汇总
+def sample_coverage_rate(sample, data):
+    df = calc_coverage_rate_by_chromosome(sample, data)
+    df.insert(0, "sample_name", sample.sample_name)
+    return df
+
+
+# 计算染色体甲基化水平统计表，并添加样本名称列用于汇总
+def sample_methylation_level(sample, data):
+    df = calc_methylation_level_by_chromosome(sample, data)
+    df.insert(0, "sample_name", sample.sample_name)
+    return df
+
+
+# 计算不同context的比例并绘制饼图
+def sample_context_proportion(sample, data):
+    item = calc_context_proportion(sample, data)
+    proportion = pd.DataFrame([item]).set_index("Sample Id").loc[sample.sample_name]
+    plot_context_proportion(sample, proportion)
+    return item
+
+
+# 每个样本的报告项：名称 -> (依赖的输入文件, 生成函数, 样本报告文件夹中的输出文件)
+# 生成函数的返回值为汇总全部样本报告所需的数据片段（没有则为None），输出文件中的{format}为图片扩展名
+SAMPLE_OUTPUTS = {
+    "qc": (["pe_report"], calc_qc, []),
+    "depth_distribution": (
+        ["depth_report"],
+        plot_methylation_depth_distribution,
+        ["Coverage of Corresponding Depth in Sample.{format}"],
+    ),
+    "cumulative_depth_distribution": (
+        ["depth_report"],
+        plot_cumulative_methylation_depth_distribution,
+        ["Cumulative Coverage of Corresponding Depth in Sample.{format}"],
+    ),
+    "coverage": (["coverage_report"], sample_coverage_rate, ["Coverage Rate Group By Chromosome.tsv"]),
+    "qc_deduplicated": (
+        ["pe_report", "deduplication_percentage", "splitting_report", "depth_report", "coverage_report"],
+        calc_qc_deduplicated,
+        [],
+    ),
+    "methylation_level": (
+        ["coverage_report"],
+        sample_methylation_level,
+        ["Methylation Level Groupp By Chromosome.tsv"],
+    ),
+    "mbias": (
+        ["mbias"],
+        lambda sample, data: plot_mbias(data.mbias, sample.sample_name, sample.report_dir),
+        ["M-bias R1.{format}", "M-bias R2.{format}"],
+    ),
+    "context_proportion": (
+        ["splitting_report"],
+        sample_context_proportion,
+        ["The proportion of every type mC.{format}"],
+    ),
+    "methylation_level_distribution": (
+        ["distribution_report"],
+        plot_methylation_level_distribution,
+        ["Methylation Level Distribution.{format}"],
+    ),
+    "cumulative_methylation_level_distribution": (
+        ["distribution_report"],
+        plot_cumulative_methylation_level_distribution,
+        ["Cumulative Methylation Level Distribution.{format}"],
+    ),
+}
+
+
+# 文件的大小和修改时间
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# 报告项的依赖记录：输入文件的大小和修改时间，包含图片时还记录渲染配置
+def output_signature(sample, name):
+    keys, _, outputs = SAMPLE_OUTPUTS[name]
+    input_files = sample_input_files(sample)
+    signature = {"inputs": {input_files[key]: file_signature(input_files[key]) for key in keys}}
+    if any("{format}" in output for output in outputs):
+        signature["render"] = dict(RENDER)
+    return signature
+
+
+# 原子写入文件（先写入临时文件再重命名），避免中断时留下不完整的记录
+def atomic_write(path, write):
+    temp_path = f"{path}.tmp"
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+# 原子写入json文件
+def write_json(path, data):
+    def write(temp_path):
+        with open(temp_path, "w") as file:
+            json.dump(data, file, indent=2, ensure_ascii=False)
+
+    atomic_write(path, write)
+
+
+# 生成单个样本的图表及样本报告（在子进程中执行），返回用于汇总全部样本报告的数据片段及其依赖记录
+# 增量模式下只重新生成依赖记录发生变化或输出文件缺失的报告项，其余报告项的数据片段从缓存中读取
+def build_sample_report(sample, incremental=False):
+    manifest_path = f"{sample.report_dir}/.qc_report_manifest.json"
+    fragments_path = f"{sample.report_dir}/.qc_report_fragments.pkl"
+    manifest = {}
+    fragments = DotDict()
+    if incremental and os.path.exists(manifest_path) and os.path.exists(fragments_path):
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        fragments = DotDict(pd.read_pickle(fragments_path))
+
+    stale = []
+    for name, (_, _, outputs) in SAMPLE_OUTPUTS.items():
+        output_files = [f"{sample.report_dir}/{output.format(format=RENDER['format'])}" for output in outputs]
+        if (
+            manifest.get(name) != output_signature(sample, name)
+            or name not in fragments
+            or not all(os.path.exists(path) for path in output_files)
+        ):
+            stale.append(name)
+    if not stale:
+        print(f"样本{sample.sample_name}的报告均为最新，跳过")
+        return fragments, manifest
+
+    # 只读取需要重新生成的报告项依赖的输入文件
+    data = load_sample(sample, {key for name in stale for key in SAMPLE_OUTPUTS[name][0]})
+    for name in stale:
+        _, build, _ = SAMPLE_OUTPUTS[name]
+        manifest[name] = output_signature(sample, name)
+        fragments[name] = build(sample, data)
+
+    atomic_write(fragments_path, lambda path: pd.to_pickle(dict(fragments), path))
+    write_json(manifest_path, manifest)
+    print(f"样本{sample.sample_name}的报告已生成（{len(stale)}/{len(SAMPLE_OUTPUTS)}项）")
+    return fragments, manifest
+
+
+# 全部样本的汇总报告：文件名 -> (数据片段名称, 汇总并输出的函数)
+COHORT_OUTPUTS = {
+    # 表2 QC质控表
+    "QC quality control table for each sample.tsv": (
+        "qc",
+        lambda items, path: pd.DataFrame(items).to_csv(path, sep="\t", index=False),
+    ),
+    # 表3、表4 C位点覆盖度统计表
+    "Coverage Rate Group By Chromosome.tsv": (
+        "coverage",
+        lambda items, path: pd.concat(items, axis=0).reset_index(drop=True).to_csv(path, sep="\t", index=False),
+    ),
+    # 表7 QC质控表(去重后)
+    "QC quality control table for each sample (deduplicated).tsv": (
+        "qc_deduplicated",
+        lambda items, path: pd.DataFrame(items).to_csv(path, sep="\t", index=False),
+    ),
+    # 表8、表9 染色体甲基化水平统计表
+    "Methylation Level Groupp By Chromosome.tsv": (
+        "methylation_level",
+        lambda items, path: pd.concat(items, axis=0).reset_index(drop=True).to_csv(path, sep="\t", index=False),
+    ),
+    # 表12 不同context比例统计表
+    "Proportions of Three Types of Methylated Cytosine.tsv": (
+        "context_proportion",
+        lambda items, path: pd.DataFrame(items).set_index("Sample Id").to_csv(path, sep="\t"),
+    ),
+}
+
+
+# 由各样本的数据片段汇总全部样本的报告（按样本顺序）
+# 增量模式下只重新生成样本列表或所依赖的数据片段发生变化的汇总报告
+# 汇总报告使用单独的依赖记录文件，样本报告与汇总报告位于同一文件夹时不会互相覆盖
+def write_cohort_reports(samples, results, report_dir, incremental=False):
+    manifest_path = f"{report_dir}/.qc_report_cohort_manifest.json"
+    manifest = {}
+    if incremental and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+    for file_name, (name, write) in COHORT_OUTPUTS.items():
+        path = f"{report_dir}/{file_name}"
+        signature = [[sample.sample_name, manifest_item[name]] for sample, (_, manifest_item) in zip(samples, results)]
+        if incremental and manifest.get(file_name) == signature and os.path.exists(path):
+            print(f"汇总报告为最新，跳过: {file_name}")
+            continue
+        print(f"生成汇总报告: {file_name}")
+        write([fragments[name] for fragments, _ in results], path)
+        manifest[file_name] = signature
+
+    write_json(manifest_path, manifest)
+
+
+if __name__ == "__main__":
+    ##################################################################
+    # 设置命令行参数
+    ##################################################################
+
+    parser = argparse.ArgumentParser(description="甲基化分析参数描述")
+    parser.add_argument("-c", "--config", type=str, help="添加配置文件（配置文件中的参数可以被命令行参数覆盖）")
+    parser.add_argument(
+        "-r",
+        "--report_dir",
+        type=str,
+        help="全局报告输出文件夹（不宜放在样本文件夹中的报告），默认值为：{当前文件夹}/report",
+    )
+    parser.add_argument(
+        "-f",
+        "--samples_file",
+        type=str,
+        help="样本配置文件路径（从配置文件所有的样本参数，支持csv/tsv/excel格式）",
+    )
+    parser.add_argument(
+        "--render_profile",
+        type=str,
+        choices=list(RENDER_PROFILES),
+        help="图片渲染配置：draft（100dpi PNG）、screen（200dpi PNG）、print（PDF矢量图）或default（1000dpi JPG），默认值为default",
+    )
+    parser.add_argument("--dpi", type=int, help="图片分辨率，覆盖渲染配置中的分辨率")
+    parser.add_argument(
+        "--figure_format", type=str, choices=["png", "jpg", "svg", "pdf"], help="图片格式，覆盖渲染配置中的图片格式"
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="添加该参数以只重新生成输入文件发生变化（或输出文件缺失）的图表及报告",
+    )
+    parser.add_argument(
+        "-p", "--parallel_num", type=int, help="最多同时生成报告的样本数（进程数），默认值为CPU核心数"
+    )
+    args = DotDict(vars(parser.parse_args()))
+
+    ##################################################################
+    # 参数解析
+    ##################################################################
+
+    print("参数解析...")
+
+    # 交互式命令时使用以下代码加载config文件
+    # args = DotDict({"config":"config.json"})
+
+    # 初始化一个空的配置参数字典
+    config = DotDict()
+    # 如果提供了配置文件，则加载配置文件的参数
+    if args.config:
+        # 读取配置文件
+        config = DotDict(jsonload(args.config))
+
+    # 用命令行参数覆盖配置文件的参数
+    for k, v in args.items():
+        if v != None:
+            config[k] = v
+
+    # 解析报告文件夹
+    config.report_dir = config.get("report_dir", "./report").rstrip("/")
+    # 如果文件夹不存在则创建
+    if not os.path.exists(config.report_dir):
+        os.makedirs(config.report_dir)
+
+    # print(config)
+
+    # 解析样本参数
+    if config.samples_file:
+        # 传入表格文件，则使用pandas读取表格
+        samples_pd = read_samples_file(config.samples_file)
+        samples = [parse_sample_config(sample) for i, sample in samples_pd.iterrows()]
+    elif isinstance(config.samples, list) and len(config.samples) > 0:
+        # 遍历json解析样本参数
+        samples = [parse_sample_config(sample) for sample in config.samples]
+    else:
+        raise Exception("sample_file参数和config文件中的samples参数都不存在，无法读取样本信息")
+
+    print("参数解析完成")
+
+    ##################################################################
+    # 报告生成
+    ##################################################################
 
+    # 每个样本的图表和报告由一个子进程生成，每个输入文件只读取一次
+    parallel_num = min(config.parallel_num or os.cpu_count(), len(samples))
+    print(f"生成样本报告（{parallel_num}个进程）")
+    render_options = (config.render_profile or "default", config.dpi, config.figure_format)
+    set_render_options(*render_options)
+    print(f"图片渲染配置: {RENDER['dpi']}dpi, {RENDER['format']}格式")
+    with ProcessPoolExecutor(
+        max_workers=parallel_num, initializer=set_render_options, initargs=render_options
+    ) as executor:
+        results = list(executor.map(build_sample_report, samples, [bool(config.incremental)] * len(samples)))
 
-for sample in samples:
-    plot_cumulative_methylation_level_distribution(sample)
+    # 汇总全部样本的报告
+    write_cohort_reports(samples, results, config.report_dir, bool(config.incremental))
 
-print("质控相关报告已全部生成")
+    print("质控相关报告已全部生成")
@@ -0,0 +1,293 @@
+import argparse
+import os
+import re
+from io import StringIO
+
+import pandas as pd
+
+# 每个样本的报告输入汇总为一个列式存储的Parquet文件（长表），所有分类共用同一个带类型的表结构：
+#   pe_report        比对报告中的计数：name, count
+#   deduplication    去重报告中移除的重复比对数及比例：name, count, percentage
+#   splitting_report 甲基化提取报告中的计数：name, count
+#   mbias            M-bias：context, read, position, methylated, unmethylated, percentage, count(coverage)
+#   depth            甲基化测序深度：context, position(深度), count
+#   coverage         基于染色体和context的覆盖度：chromosome, context, count, covered, reads_m, reads_n
+#   distribution     基于context的甲基化分布：context, position(甲基化水平), count, reads_m, reads_n
+# 不适用的列为空值。Python和R都可以通过内存映射读取，并直接合并多个样本的文件
+
+SUMMARY_COLUMNS = {
+    "sample_name": "string",
+    "section": "string",
+    "name": "string",
+    "chromosome": "string",
+    "context": "string",
+    "read": "string",
+    "position": "int64",
+    "count": "int64",
+    "methylated": "int64",
+    "unmethylated": "int64",
+    "covered": "int64",
+    "reads_m": "int64",
+    "reads_n": "int64",
+    "percentage": "float64",
+}
+
+# 各分类使用的列
+SECTION_COLUMNS = {
+    "pe_report": ["name", "count"],
+    "deduplication": ["name", "count", "percentage"],
+    "splitting_report": ["name", "count"],
+    "mbias": ["context", "read", "position", "methylated", "unmethylated", "percentage", "count"],
+    "depth": ["context", "position", "count"],
+    "coverage": ["chromosome", "context", "count", "covered", "reads_m", "reads_n"],
+    "distribution": ["context", "position", "count", "reads_m", "reads_n"],
+}
+
+DEDUPLICATION_NAME = "Total number duplicated alignments removed"
+
+
+# pyarrow为可选依赖，只在读写汇总文件时导入
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("读写样本汇总文件需要安装pyarrow（conda install -c conda-forge pyarrow）")
+    return pyarrow
+
+
+##################################################################
+# 解析原始报告
+##################################################################
+
+
+# 解析报告中只包含1个冒号且冒号后为整数的行，返回{名称: 整数}
+def parse_colon_report(path):
+    data = {}
+    with open(path, "r") as file:
+        for line in file:
+            if line.count(":") == 1:  # 匹配包含1个冒号的行
+                parts = line.split(":")
+                try:
+                    data[parts[0].strip()] = int(parts[1].strip())
+                except:
+                    pass
+    return data
+
+
+# 从去重报告中查找deduplication_percentage
+def parse_deduplication_percentage(path):
+    percentage_pattern = re.compile(r"Total number duplicated alignments removed:.*?(\d+\.\d+)%")
+    with open(path, "r") as file:
+        for line in file:
+            match = percentage_pattern.search(line)
+            if match:
+                return match.group(1)
+
+
+# 从去重报告中查找移除的重复比对数及比例
+def parse_deduplication_report(path):
+    pattern = re.compile(r"Total number duplicated alignments removed:\s*(\d+)\s*\((\d+\.\d+)%\)")
+    with open(path, "r") as file:
+        for line in file:
+            match = pattern.search(line)
+            if match:
+                return int(match.group(1)), float(match.group(2))
+    return None, None
+
+
+# 解析M-bias文件中不同context和read的表格
+def parse_mbias(mbias_file):
+    # 读取整个文件内容
+    with open(mbias_file, "r") as file:
+        content = file.read()
+
+    # 定义正则表达式查找不同上下文表格
+    # 正则表达式将匹配上下文标题、分隔符、表头和表数据
+    pattern = r"(\w+) context \((\w+)\)\n=+\n([\s\S]+?)(?=\n[A-Z]|$)"
+    matches = re.findall(pattern, content)
+
+    df = []
+    # 解析匹配到的表格
+    for context, read, table_data in matches:
+        # 将表格转换为 DataFrame
+        item = pd.read_csv(StringIO(table_data), sep="\t")
+        # 添加上下文和read标签列到 DataFrame
+        item.insert(0, "context", context)
+        item.insert(1, "read", read)
+        df.append(item)
+    return pd.concat(df)
+
+
+##################################################################
+# 生成汇总文件
+##################################################################
+
+
+# 将{名称: 计数}转换为汇总表的行
+def counter_rows(section, data):
+    return pd.DataFrame({"section": section, "name": list(data.keys()), "count": list(data.values())})
+
+
+# 解析单个样本的全部报告，返回汇总长表
+def build_summary(
+    sample_name, pe_report, deduplication_report, splitting_report, mbias, depth_report, coverage_report,
+    distribution_report,
+):
+    parts = [counter_rows("pe_report", parse_colon_report(pe_report))]
+
+    count, percentage = parse_deduplication_report(deduplication_report)
+    parts.append(
+        pd.DataFrame({"section": ["deduplication"], "name": [DEDUPLICATION_NAME], "count": [count], "percentage": [percentage]})
+    )
+
+    parts.append(counter_rows("splitting_report", parse_colon_report(splitting_report)))
+
+    df = parse_mbias(mbias).rename(
+        columns={
+            "count methylated": "methylated",
+            "count unmethylated": "unmethylated",
+            "% methylation": "percentage",
+            "coverage": "count",
+        }
+    )
+    df.insert(0, "section", "mbias")
+    parts.append(df)
+
+    # 深度报告为宽表（每个context一列），转换为长表，保持原有的context顺序
+    df = pd.read_csv(depth_report, sep="\t")
+    df = df.melt(id_vars="Depth", var_name="context", value_name="count").rename(columns={"Depth": "position"})
+    df.insert(0, "section", "depth")
+    parts.append(df)
+
+    df = pd.read_csv(coverage_report, sep="\t").rename(
+        columns={
+            "Chromosome": "chromosome",
+            "Context": "context",
+            "Count": "count",
+            "totalReadsM": "reads_m",
+            "totalReadsN": "reads_n",
+        }
+    )
+    df.insert(0, "section", "coverage")
+    parts.append(df)
+
+    df = pd.read_csv(distribution_report, sep="\t").rename(
+        columns={"methylation_level": "position", "readsM": "reads_m", "readsN": "reads_n"}
+    )
+    df.insert(0, "section", "distribution")
+    parts.append(df)
+
+    df = pd.concat(parts, ignore_index=True).reindex(columns=list(SUMMARY_COLUMNS))
+    df["sample_name"] = sample_name
+    return df
+
+
+# 汇总表的Arrow表结构
+def summary_schema():
+    pa = import_pyarrow()
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64()}
+    return pa.schema([(name, types[dtype]) for name, dtype in SUMMARY_COLUMNS.items()])
+
+
+# 写出汇总文件（先写入临时文件再重命名）
+def write_summary(df, output_file):
+    pa = import_pyarrow()
+    table = pa.Table.from_pandas(df, schema=summary_schema(), preserve_index=False)
+    temp_file = f"{output_file}.tmp"
+    pa.parquet.write_table(table, temp_file, compression="zstd")
+    os.replace(temp_file, output_file)
+
+
+##################################################################
+# 读取汇总文件
+##################################################################
+
+
+# 通过内存映射读取一个或多个样本的汇总文件，合并为一个Arrow表
+def read_summary_table(paths, columns=None):
+    pa = import_pyarrow()
+    if isinstance(paths, str):
+        paths = [paths]
+    tables = [pa.parquet.read_table(path, columns=columns, memory_map=True) for path in paths]
+    return pa.concat_tables(tables)
+
+
+# 取出汇总表中一个分类的数据（只包含该分类使用的列）
+def summary_section(table, section):
+    pa = import_pyarrow()
+    import pyarrow.compute as pc
+
+    rows = table.filter(pc.equal(table["section"], pa.scalar(section)))
+    return rows.select(SECTION_COLUMNS[section]).to_pandas()
+
+
+# 读取单个样本的汇总文件，还原为与原始报告解析结果相同的结构
+def read_summary(path):
+    table = read_summary_table(path)
+    data = {}
+    for section in ["pe_report", "splitting_report"]:
+        df = summary_section(table, section)
+        data[section] = dict(zip(df["name"], df["count"].tolist()))
+
+    df = summary_section(table, "deduplication")
+    percentage = df["percentage"].iloc[0] if len(df) else None
+    data["deduplication_percentage"] = None if pd.isna(percentage) else f"{percentage:.2f}"
+
+    # 每个context和read为一个单独的表格，各自从0开始编号
+    df = summary_section(table, "mbias").rename(
+        columns={
+            "methylated": "count methylated",
+            "unmethylated": "count unmethylated",
+            "percentage": "% methylation",
+            "count": "coverage",
+        }
+    )
+    data["mbias"] = df.set_index(df.groupby(["context", "read"], sort=False).cumcount())
+
+    df = summary_section(table, "depth")
+    contexts = list(dict.fromkeys(df["context"]))
+    df = df.pivot(index="position", columns="context", values="count")[contexts]
+    df.columns.name = None
+    data["depth_report"] = df.rename_axis("Depth").reset_index()
+
+    data["coverage_report"] = summary_section(table, "coverage").rename(
+        columns={
+            "chromosome": "Chromosome",
+            "context": "Context",
+            "count": "Count",
+            "reads_m": "totalReadsM",
+            "reads_n": "totalReadsN",
+        }
+    )
+    data["distribution_report"] = summary_section(table, "distribution").rename(
+        columns={"position": "methylation_level", "reads_m": "readsM", "reads_n": "readsN"}
+    )
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将单个样本的比对、去重、甲基化提取及甲基化统计报告汇总为一个Parquet文件")
+    parser.add_argument("-s", "--sample_name", type=str, required=True, help="样本名称")
+    parser.add_argument("--pe_report", type=str, required=True, help="bismark比对报告（_PE_report.txt）")
+    parser.add_argument("--deduplication_report", type=str, required=True, help="bismark去重报告")
+    parser.add_argument("--splitting_report", type=str, required=True, help="甲基化提取报告（_splitting_report.txt）")
+    parser.add_argument("--mbias", type=str, required=True, help="M-bias报告")
+    parser.add_argument("--depth_report", type=str, required=True, help="甲基化测序深度报告")
+    parser.add_argument("--coverage_report", type=str, required=True, help="甲基化覆盖度报告")
+    parser.add_argument("--distribution_report", type=str, required=True, help="甲基化分布报告")
+    parser.add_argument("-o", "--output", type=str, required=True, help="汇总文件的输出路径（.parquet）")
+    args = parser.parse_args()
+
+    df = build_summary(
+        args.sample_name,
+        args.pe_report,
+        args.deduplication_report,
+        args.splitting_report,
+        args.mbias,
+        args.depth_report,
+        args.coverage_report,
+        args.distribution_report,
+    )
+    write_summary(df, args.output)
+    print(f"样本汇总文件已生成: {args.output}（{len(df)}行）")
@@ -0,0 +1,185 @@
+import gzip
+import os
+
+import numpy as np
+
+# 生成三个样本的测试数据（固定随机种子，重复运行结果相同），目录结构与主流程的输出一致：
+#   {样本}/{样本}_1.fq.gz、{样本}_2.fq.gz                        测序文件（每个文件8条读段）
+#   {样本}/output/bismark_alignment/..._PE_report.txt            比对报告
+#   {样本}/output/bismark_deduplicate/...deduplication_report.txt 去重报告
+#   {样本}/output/bismark_methylation/...                        甲基化提取的报告、M-bias、bedGraph及按染色体拆分的CX_report
+# CX_report包含每条染色体的所有胞嘧啶（包括没有覆盖的位点），三个样本的位点相同
+# 在仓库根目录执行：python tests/data/three_samples/make_fixture.py
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = ["S1", "S2", "S3"]
+# 染色体名称及胞嘧啶数（两条染色体及一条scaffold）
+CHROMOSOMES = {"NC_000067.7": 1500, "NC_000068.8": 1200, "NW_023337853.1": 300}
+CONTEXTS = ["CG", "CHG", "CHH"]
+TRINUCLEOTIDES = {"CG": ["CGA", "CGC", "CGG", "CGT"], "CHG": ["CAG", "CCG", "CTG"], "CHH": ["CAA", "CAC", "CTT"]}
+# 各context的平均甲基化比例
+METHYLATION = {"CG": 0.75, "CHG": 0.08, "CHH": 0.03}
+
+
+def write_text(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+# 压缩文件头中不记录时间，重新生成的文件内容完全相同
+def write_gzip(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as raw, gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as file:
+        file.write(text.encode())
+
+
+# 每条染色体的胞嘧啶：位置、链、context及三核苷酸context（三个样本相同）
+def genome_sites(rng):
+    sites = {}
+    for chromosome, count in CHROMOSOMES.items():
+        position = np.sort(rng.choice(np.arange(1000, 1000 + count * 8), count, replace=False))
+        context = rng.choice(CONTEXTS, count, p=[0.2, 0.2, 0.6])
+        strand = rng.choice(["+", "-"], count)
+        trinucleotide = [rng.choice(TRINUCLEOTIDES[item]) for item in context]
+        sites[chromosome] = (position, strand, context, trinucleotide)
+    return sites
+
+
+def fastq(sample, mate, rng):
+    reads = []
+    for read in range(8):
+        sequence = "".join(rng.choice(list("ACGT"), 20))
+        reads.append(f"@{sample}_read{read}/{mate}\n{sequence}\n+\n{'I' * 20}\n")
+    return "".join(reads)
+
+
+def pe_report(sample, totals):
+    pairs = 100000 + SAMPLES.index(sample) * 5000
+    unique = int(pairs * 0.78)
+    lines = [
+        f"Bismark report for: {sample}_1.fq.gz and {sample}_2.fq.gz (version: v0.24.2)",
+        "Bismark was run with Bowtie 2 against the bisulfite genome of /genome/ with the specified options: -q",
+        "",
+        "Final Alignment report",
+        "======================",
+        f"Sequence pairs analysed in total:\t{pairs}",
+        f"Number of paired-end alignments with a unique best hit:\t{unique}",
+        f"Mapping efficiency:\t{unique / pairs * 100:.1f}% ",
+        f"Sequence pairs with no alignments under any condition:\t{pairs - unique - 3000}",
+        "Sequence pairs did not map uniquely:\t3000",
+        "",
+        "Final Cytosine Methylation Report",
+        "=================================",
+        f"Total number of C's analysed:\t{sum(totals.values())}",
+        "",
+    ]
+    for context, name in [("CG", "CpG"), ("CHG", "CHG"), ("CHH", "CHH")]:
+        lines.append(f"Total methylated C's in {name} context:\t{totals[context, 'm']}")
+    lines += ["Total methylated C's in Unknown context:\t12", ""]
+    for context, name in [("CG", "CpG"), ("CHG", "CHG"), ("CHH", "CHH")]:
+        lines.append(f"Total unmethylated C's in {name} context:\t{totals[context, 'u']}")
+    lines += ["Total unmethylated C's in Unknown context:\t30", ""]
+    return "\n".join(lines) + "\n"
+
+
+def deduplication_report(sample):
+    total = int((100000 + SAMPLES.index(sample) * 5000) * 0.78)
+    removed = int(total * (0.08 + SAMPLES.index(sample) * 0.01))
+    return (
+        f"Total number of alignments analysed in {sample}_1_bismark_bt2_pe.bam:\t{total}\n"
+        f"Total number duplicated alignments removed:\t{removed} ({removed / total * 100:.2f}%)\n"
+        f"Duplicated alignments were found at:\t{removed - 100} different position(s)\n\n"
+        f"Total count of deduplicated leftover sequences: {total - removed} ({(total - removed) / total * 100:.2f}% of total)\n"
+    )
+
+
+def splitting_report(sample, totals):
+    lines = [
+        f"{sample}_1_bismark_bt2_pe.deduplicated.bam",
+        "",
+        "Parameters used to extract methylation information:",
+        "Bismark Extractor Version: v0.24.2",
+        "Bismark result file: paired-end (SAM format)",
+        "",
+        "Final Cytosine Methylation Report",
+        "=================================",
+        f"Total number of C's analysed:\t{sum(totals.values())}",
+        "",
+    ]
+    for context, name in [("CG", "CpG"), ("CHG", "CHG"), ("CHH", "CHH")]:
+        lines.append(f"Total methylated C's in {name} context:\t{totals[context, 'm']}")
+    lines.append("")
+    for context, name in [("CG", "CpG"), ("CHG", "CHG"), ("CHH", "CHH")]:
+        lines.append(f"Total C to T conversions in {name} context:\t{totals[context, 'u']}")
+    return "\n".join(lines) + "\n"
+
+
+def mbias(rng):
+    blocks = []
+    for read in ["R1", "R2"]:
+        for context, name in [("CG", "CpG"), ("CHG", "CHG"), ("CHH", "CHH")]:
+            title = f"{name} context ({read})"
+            rows = [title, "=" * len(title), "position\tcount methylated\tcount unmethylated\t% methylation\tcoverage"]
+            for position in range(1, 21):
+                coverage = int(rng.integers(800, 1200))
+                methylated = int(rng.binomial(coverage, METHYLATION[context]))
+                rows.append(
+                    f"{position}\t{methylated}\t{coverage - methylated}\t{methylated / coverage * 100:.2f}\t{coverage}"
+                )
+            blocks.append("\n".join(rows) + "\n")
+    return "\n".join(blocks) + "\n"
+
+
+def main():
+    rng = np.random.default_rng(20241017)
+    sites = genome_sites(rng)
+    for index, sample in enumerate(SAMPLES):
+        sample_dir = f"{DATA_DIR}/{sample}"
+        prefix = f"{sample}_1_bismark_bt2_pe"
+        for mate in [1, 2]:
+            write_gzip(f"{sample_dir}/{sample}_{mate}.fq.gz", fastq(sample, mate, rng))
+
+        totals = {(context, kind): 0 for context in CONTEXTS for kind in "mu"}
+        bedgraph = ["track type=bedGraph"]
+        for chromosome, (position, strand, context, trinucleotide) in sites.items():
+            # 约15%的位点没有覆盖；S3在每条染色体前部的CG位点甲基化水平更低
+            coverage = rng.poisson(12, len(position)) * (rng.random(len(position)) > 0.15)
+            level = np.array([METHYLATION[item] for item in context])
+            level = np.where((index == 2) & (context == "CG") & (np.arange(len(position)) < 200), 0.3, level)
+            reads_m = rng.binomial(coverage, level)
+            reads_u = coverage - reads_m
+            lines = [
+                f"{chromosome}\t{p}\t{s}\t{m}\t{u}\t{c}\t{t}"
+                for p, s, m, u, c, t in zip(position, strand, reads_m, reads_u, context, trinucleotide)
+            ]
+            write_gzip(
+                f"{sample_dir}/output/bismark_methylation/{prefix}.deduplicated.CX_report.txt.chr{chromosome}.CX_report.txt.gz",
+                "\n".join(lines) + "\n",
+            )
+            for item in CONTEXTS:
+                totals[item, "m"] += int(reads_m[context == item].sum())
+                totals[item, "u"] += int(reads_u[context == item].sum())
+            covered = coverage > 0
+            bedgraph += [
+                f"{chromosome}\t{p - 1}\t{p}\t{m / (m + u) * 100:g}"
+                for p, m, u in zip(position[covered], reads_m[covered], reads_u[covered])
+            ]
+
+        write_text(f"{sample_dir}/output/bismark_alignment/{sample}_1_bismark_bt2_PE_report.txt", pe_report(sample, totals))
+        write_text(f"{sample_dir}/output/bismark_deduplicate/{prefix}.deduplication_report.txt", deduplication_report(sample))
+        write_text(
+            f"{sample_dir}/output/bismark_methylation/{prefix}.deduplicated_splitting_report.txt",
+            splitting_report(sample, totals),
+        )
+        write_text(f"{sample_dir}/output/bismark_methylation/{prefix}.deduplicated.M-bias.txt", mbias(rng))
+        write_gzip(f"{sample_dir}/output/bismark_methylation/{prefix}.deduplicated.bedGraph.gz", "\n".join(bedgraph) + "\n")
+
+    write_text(
+        f"{DATA_DIR}/samples.tsv",
+        "sample_name\tgroup_name\n" + "".join(f"{sample}\t{'Control' if sample != 'S3' else 'Treatment'}\n" for sample in SAMPLES),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+
+import pandas as pd
+import pytest
+
+import cx_report_analyse
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_samples")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 测试数据中S1按染色体拆分的CX_report文件（两条染色体及一条scaffold）
+CX_REPORTS = f"{DATA_DIR}/S1/output/bismark_methylation/S1_1_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"
+REPORTS = ["depth", "coverage", "distribution"]
+
+
+def analyse(output_dir, **options):
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {name: f"{output_dir}/{name}.txt" for name in REPORTS}
+    cx_report_analyse.analyse_cx_reports(
+        CX_REPORTS, paths["depth"], paths["coverage"], paths["distribution"], **options
+    )
+    return paths
+
+
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+# 多进程统计各染色体文件后按文件顺序合并，结果与单进程完全相同
+def test_parallel_matches_serial(tmp_path):
+    serial = analyse(f"{tmp_path}/serial", parallel_num=1)
+    parallel = analyse(f"{tmp_path}/parallel", parallel_num=3)
+    for name in REPORTS:
+        assert read_bytes(parallel[name]) == read_bytes(serial[name])
+
+
+# 与utils中三个C语言脚本的输出完全一致
+def test_matches_c_tools(tmp_path):
+    if shutil.which("gcc") is None:
+        pytest.skip("需要gcc编译utils中的C语言脚本")
+    tools = {
+        "depth": "methylation_depth_analysis",
+        "coverage": "methylation_coverage_analyse",
+        "distribution": "methylation_distribution_analysis",
+    }
+    paths = analyse(f"{tmp_path}/python", parallel_num=3)
+    for name, tool in tools.items():
+        binary = f"{tmp_path}/{tool}"
+        compiled = subprocess.run(["gcc", "-O2", "-o", binary, f"{REPO_DIR}/utils/{tool}.c", "-lm", "-lz"])
+        if compiled.returncode != 0:
+            pytest.skip("无法编译utils中的C语言脚本（需要zlib）")
+        subprocess.run([binary, CX_REPORTS, f"{tmp_path}/{name}.txt"], check=True, capture_output=True)
+        assert read_bytes(paths[name]) == read_bytes(f"{tmp_path}/{name}.txt")
+
+
+# 文件中同时存在accession和对照表中的名称时，两者合并为同一条染色体
+def test_rename_chromosomes_merges_mixed_names():
+    df = pd.DataFrame({"chromosome": pd.Categorical(["chr1", "NC_000067.7", "NC_000068.8", "chr1", "NW_023337853.1"])})
+    aliases = {"NC_000067.7": "chr1", "NC_000068.8": "chr2"}
+    renamed = cx_report_analyse.rename_chromosomes(df, aliases)
+    assert renamed["chromosome"].tolist() == ["chr1", "chr1", "chr2", "chr1", "NW_023337853.1"]
+    assert sorted(renamed["chromosome"].cat.categories) == ["NW_023337853.1", "chr1", "chr2"]
@@ -0,0 +1,181 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dmr_bins
+from methylation_matrix import CONTEXTS, STRANDS, ChromosomeWriter, merge_matrices, write_matrix_index
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "dmr_bins")
+# DMRcaller的期望结果，由dmrcaller_parity.R生成
+DMRCALLER_OUTPUT = os.path.join(DATA_DIR, "DMRsReplicatesBins.txt")
+
+
+def read_fixture():
+    data = pd.read_csv(os.path.join(DATA_DIR, "methylation.tsv"), sep="\t")
+    samples = pd.read_csv(os.path.join(DATA_DIR, "samples.tsv"), sep="\t")
+    return data, samples
+
+
+# 由测试数据写出各样本的甲基化矩阵，再合并为多样本合并矩阵（与主流程相同）
+@pytest.fixture
+def cohort_matrix(tmp_path):
+    data, samples = read_fixture()
+    sample_dirs = []
+    for i, sample_name in enumerate(samples["sample_name"], start=1):
+        covered = data[f"readsN{i}"] > 0
+        sample_dir = tmp_path / sample_name
+        sample_dir.mkdir()
+        writer = ChromosomeWriter(str(sample_dir), "chr1")
+        writer.append(
+            {
+                "position": data["position"][covered].to_numpy(),
+                "reads_m": data[f"readsM{i}"][covered].to_numpy(),
+                "reads_n": data[f"readsN{i}"][covered].to_numpy(),
+                "context": data["context"][covered].map(CONTEXTS.index).to_numpy(),
+                "strand": data["strand"][covered].map(STRANDS.index).to_numpy(),
+            }
+        )
+        write_matrix_index(str(sample_dir), {"chr1": writer.close()})
+        sample_dirs.append(str(sample_dir))
+    merge_matrices(list(samples["sample_name"]), sample_dirs, str(tmp_path / "cohort"))
+    return str(tmp_path / "cohort")
+
+
+def call_fixture(cohort_matrix):
+    _, samples = read_fixture()
+    sample_names, group = dmr_bins.select_samples(samples, "Treatment", "Wild")
+    results = [
+        dmr_bins.call_chromosome(cohort_matrix, "chr1", context, sample_names, group, dmr_bins.DEFAULTS)[0]
+        for context in CONTEXTS
+    ]
+    return pd.concat(results, ignore_index=True)
+
+
+# 逐个区间实现的参考算法（computeDMRsReplicates的bins方法）：区间从数据范围起点开始，
+# 按每组平均每个位点的读数筛选，相邻且方向相同的显著区间合并
+# 与dmr_bins.py采用相同的约定（见dmr_bins.py开头），只用于核对向量化的实现；与DMRcaller的一致性由下面单独的测试
+# 及test_parity_with_dmrcaller检查
+def reference_dmrs(data, group, context, options):
+    bin_size = options["bin_size"]
+    first, last = int(data["position"].min()), int(data["position"].max())
+    data = data[data["context"] == context]
+    reads_m = data[[f"readsM{i + 1}" for i in range(len(group))]].to_numpy().T
+    reads_n = data[[f"readsN{i + 1}" for i in range(len(group))]].to_numpy().T
+    group = np.asarray(group)
+    bins = []
+    for start in range(first, last - bin_size + 1, bin_size):
+        inside = ((data["position"] >= start) & (data["position"] < start + bin_size)).to_numpy()
+        count = int(inside.sum())
+        m, n = reads_m[:, inside].sum(axis=1), reads_n[:, inside].sum(axis=1)
+        m1, n1, m2, n2 = m[group == 0].sum(), n[group == 0].sum(), m[group == 1].sum(), n[group == 1].sum()
+        if count < options["min_cytosines_count"]:
+            continue
+        if n1 / count < options["min_reads_per_cytosine"] or n2 / count < options["min_reads_per_cytosine"]:
+            continue
+        if abs(m2 / n2 - m1 / n1) < options["min_proportion_differences"][context]:
+            continue
+        bins.append((start, m, n, count, 1 if m2 / n2 > m1 / n1 else -1))
+    if not bins:
+        return []
+    y = np.stack([(m + options["pseudocount_m"]) / (n + options["pseudocount_n"]) for _, m, n, _, _ in bins])
+    p_values = dmr_bins.p_adjust_bh(dmr_bins.beta_regression_p_values(y, group))
+    bins = [b + (p,) for b, p in zip(bins, p_values) if p < options["p_value_threshold"]]
+    regions = []
+    for b in bins:
+        if regions and regions[-1][-1][0] + bin_size == b[0] and regions[-1][-1][4] == b[4]:
+            regions[-1].append(b)
+        else:
+            regions.append([b])
+    return [(region[0][0], region[-1][0] + bin_size - 1, sum(b[3] for b in region), region[0][4]) for region in regions]
+
+
+def test_matches_reference_implementation(cohort_matrix):
+    data, samples = read_fixture()
+    df = call_fixture(cohort_matrix)
+    _, group = dmr_bins.select_samples(samples, "Treatment", "Wild")
+    expected = [
+        (context, *region) for context in CONTEXTS for region in reference_dmrs(data, group, context, dmr_bins.DEFAULTS)
+    ]
+    result = list(zip(df["context"], df["start"], df["end"], df["cytosinesCount"], df["direction"]))
+    assert result == expected
+    # 测试数据中包含相邻显著区间合并后的区域
+    assert (df["width"] > dmr_bins.DEFAULTS["bin_size"]).any()
+    assert ((df["start"] - int(data["position"].min())) % dmr_bins.DEFAULTS["bin_size"] == 0).all()
+
+
+# 手工构造的一种context数据：每个区间6个位点，blocks为每个区间各样本每个位点的(readsM, readsN)
+def make_bins(first, blocks, step=30):
+    position, reads_m, reads_n = [], [], []
+    for k, block in enumerate(blocks):
+        for j in range(6):
+            position.append(first + k * 200 + j * step)
+            reads_m.append([m for m, _ in block])
+            reads_n.append([n for _, n in block])
+    return np.array(position), np.array(reads_m).T, np.array(reads_n).T
+
+
+GROUP = [0, 0, 0, 1, 1, 1]
+GAIN = [(1, 10), (2, 10), (1, 10), (8, 10), (9, 10), (8, 10)]
+LOSS = [(8, 10), (9, 10), (8, 10), (1, 10), (2, 10), (1, 10)]
+
+
+# 区间从第一个位点开始划分（不是1），末尾不完整的区间不参与分析
+def test_bins_anchored_at_first_position():
+    position, reads_m, reads_n = make_bins(1003, [GAIN, LOSS, GAIN])
+    # 第三个区间只有部分位置在数据范围内（最后一个位点为1553，区间1403-1602不完整）
+    df = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS)
+    assert list(df["start"]) == [1003, 1203]
+    assert list(df["direction"]) == [1, -1]
+    # 数据范围由所有context确定时，起点为所有context中的第一个位点，第三个区间在范围内完整，参与分析
+    df = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS, (803, 1802))
+    assert list(df["start"]) == [1003, 1203, 1403]
+    assert list(df["end"]) == [1202, 1402, 1602]
+    # 区间止于数据范围的最后一个位点时同样丢弃（seq的终点为end - binSize）
+    df = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS, (1003, 1602))
+    assert list(df["start"]) == [1003, 1203]
+
+
+# min_reads_per_cytosine比较每组所有样本的reads之和除以位点数，不是每个样本的读数
+def test_min_reads_per_cytosine_uses_group_total():
+    low = [(0, 2), (1, 2), (0, 2), (2, 2), (2, 2), (1, 2)]  # 每个样本2个读数，每组共6个
+    too_low = [(0, 1), (0, 1), (0, 1), (1, 1), (1, 1), (1, 1)]  # 每组共3个
+    position, reads_m, reads_n = make_bins(1, [low, LOSS, too_low, LOSS])
+    df = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS, (1, 1000))
+    assert list(df["start"]) == [1, 201, 601]
+    assert (df["sumReadsN1"] / df["cytosinesCount"] >= dmr_bins.DEFAULTS["min_reads_per_cytosine"]).all()
+
+
+# BH校正只在通过筛选的区间之间进行：增加未通过筛选的区间不改变显著区间的p值
+def test_p_values_adjusted_over_filtered_bins():
+    sparse = [(0, 0), (0, 1), (0, 0), (1, 1), (0, 0), (1, 1)]
+    position, reads_m, reads_n = make_bins(1, [GAIN, LOSS, GAIN])
+    expected = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS, (1, 800))
+    position, reads_m, reads_n = make_bins(1, [GAIN, LOSS, GAIN, sparse, sparse, sparse])
+    df = dmr_bins.call_dmr_bins("chr1", "CG", position, reads_m, reads_n, GROUP, dmr_bins.DEFAULTS, (1, 1400))
+    assert list(df["start"]) == list(expected["start"]) == [1, 201, 401]
+    assert np.allclose(df["pValue"].astype(float), expected["pValue"].astype(float))
+
+
+def test_beta_regression_matches_statsmodels():
+    betareg = pytest.importorskip("statsmodels.othermod.betareg")
+    rng = np.random.default_rng(1)
+    group = np.array([0, 0, 0, 1, 1, 1])
+    y = np.clip(rng.beta(5, 5, (20, 6)) + 0.1 * group, 0.01, 0.99)
+    theta, _ = dmr_bins.fit_beta_regression(y, group)
+    p_values = dmr_bins.beta_regression_p_values(y, group)
+    X = np.column_stack([np.ones(6), group])
+    for i in range(len(y)):
+        fit = betareg.BetaModel(y[i], X).fit(disp=0, method="bfgs")
+        assert theta[i, 1] == pytest.approx(fit.params[1], abs=1e-4)
+        assert p_values[i] == pytest.approx(fit.pvalues[1], abs=1e-4)
+
+
+@pytest.mark.skipif(
+    not os.path.exists(DMRCALLER_OUTPUT), reason="需要先使用Rscript tests/data/dmr_bins/dmrcaller_parity.R生成DMRcaller的结果"
+)
+def test_parity_with_dmrcaller(cohort_matrix, tmp_path):
+    output = tmp_path / "DMRsBins.txt"
+    call_fixture(cohort_matrix).to_csv(output, sep="\t", index=False, header=False)
+    assert dmr_bins.compare_dmr_files(str(output), DMRCALLER_OUTPUT, tolerance=1e-6)
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+import methylation_analyse as m
+
+
+# 代替bismark_genome_preparation：在命令中的参考基因组文件夹内生成Bisulfite_Genome，并记录构建的次数
+@pytest.fixture
+def builds(monkeypatch):
+    builds = []
+
+    def execute(cmd, log_dir="./log/", tag=None, stage=None, usage=None):
+        genome_folder = cmd.split()[-1]
+        assert all(os.path.islink(path) for path in m.genome_fasta_files(genome_folder))
+        os.makedirs(f"{genome_folder}/Bisulfite_Genome/CT_conversion")
+        with open(f"{genome_folder}/Bisulfite_Genome/CT_conversion/genome_mfa.CT_conversion.fa", "w") as file:
+            file.write(">chr1_CT_converted\nTTTT\n")
+        builds.append(genome_folder)
+
+    monkeypatch.setattr(m, "execute_shell_command", execute)
+    return builds
+
+
+def write_genome(genome_folder, sequence="ACGTACGT"):
+    os.makedirs(genome_folder, exist_ok=True)
+    with open(f"{genome_folder}/genome.fa", "w") as file:
+        file.write(f">chr1\n{sequence}\n")
+
+
+def genome_config(tmp_path, genome_folder, cache=False):
+    return m.DotDict(
+        genome_folder=str(genome_folder),
+        genome_cache_dir=str(tmp_path / "cache") if cache else None,
+        parallel_num=4,
+    )
+
+
+def test_index_rebuilt_only_when_fasta_changes(tmp_path, builds):
+    write_genome(tmp_path / "genome")
+    config = genome_config(tmp_path, tmp_path / "genome")
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    assert len(builds) == 1
+    index_dir = tmp_path / "genome" / "Bisulfite_Genome"
+    assert m.index_checksum(str(index_dir)) == m.genome_checksum(str(tmp_path / "genome"))
+    assert not os.path.exists(tmp_path / "genome" / ".Bisulfite_Genome.building")
+
+    # FASTA内容变化后校验值改变，重新构建
+    write_genome(tmp_path / "genome", "TTTTACGTACGT")
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    assert len(builds) == 2
+    assert m.index_checksum(str(index_dir)) == m.genome_checksum(str(tmp_path / "genome"))
+
+    # 没有记录校验值的索引（上次构建中断）同样重新构建
+    os.remove(index_dir / "index.json")
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    assert len(builds) == 3
+
+
+def test_checksum_cached_by_size_and_mtime(tmp_path, monkeypatch):
+    write_genome(tmp_path / "genome")
+    checksum = m.genome_checksum(str(tmp_path / "genome"))
+    assert os.path.exists(tmp_path / "genome" / ".genome_checksum.json")
+    # 文件未变化时直接使用缓存的校验值，不再读取FASTA文件
+    monkeypatch.setattr(m.hashlib, "sha256", None)
+    assert m.genome_checksum(str(tmp_path / "genome")) == checksum
+
+
+def test_shared_cache_builds_once(tmp_path, builds):
+    for name in ["project_a", "project_b"]:
+        write_genome(tmp_path / name)
+        m.prepare_genome_index(genome_config(tmp_path, tmp_path / name, cache=True), str(tmp_path / "log"))
+    assert len(builds) == 1
+    checksum = m.genome_checksum(str(tmp_path / "project_a"))
+    index_dir = tmp_path / "cache" / checksum / "Bisulfite_Genome"
+    for name in ["project_a", "project_b"]:
+        target = tmp_path / name / "Bisulfite_Genome"
+        assert os.path.islink(target)
+        assert os.path.realpath(target) == os.path.realpath(index_dir)
+    assert m.index_checksum(str(index_dir)) == checksum
+
+
+# 此前版本构建的完整索引：CT、GA两个bowtie2索引的全部文件，没有index.json
+def write_legacy_index(genome_folder):
+    for conversion in ["CT", "GA"]:
+        for suffix in m.BOWTIE2_INDEX_SUFFIXES:
+            path = f"{genome_folder}/Bisulfite_Genome/{conversion}_conversion/BS_{conversion}.{suffix}.bt2"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file:
+                file.write("index")
+    return f"{genome_folder}/Bisulfite_Genome"
+
+
+# 没有校验记录但完整且比FASTA新的索引直接沿用，不删除、不重新构建
+def test_legacy_index_adopted(tmp_path, builds):
+    write_genome(tmp_path / "genome")
+    index_dir = write_legacy_index(tmp_path / "genome")
+    config = genome_config(tmp_path, tmp_path / "genome")
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    assert builds == []
+    assert m.index_checksum(index_dir) == m.genome_checksum(str(tmp_path / "genome"))
+    assert os.path.exists(f"{index_dir}/CT_conversion/BS_CT.rev.2.bt2")
+
+    # 之后FASTA变化时仍按校验值重新构建
+    write_genome(tmp_path / "genome", "TTTTACGTACGT")
+    m.prepare_genome_index(config, str(tmp_path / "log"))
+    assert len(builds) == 1
+
+
+# FASTA比索引新时（索引可能由旧的FASTA构建）重新构建
+def test_legacy_index_older_than_fasta_rebuilt(tmp_path, builds):
+    write_genome(tmp_path / "genome")
+    index_dir = write_legacy_index(tmp_path / "genome")
+    for root, _, files in os.walk(index_dir):
+        for name in files:
+            os.utime(os.path.join(root, name), (0, 0))
+    m.prepare_genome_index(genome_config(tmp_path, tmp_path / "genome"), str(tmp_path / "log"))
+    assert len(builds) == 1
+
+
+# 使用共享缓存时，沿用的索引移入缓存，其他参考基因组文件夹共用
+def test_legacy_index_moved_into_cache(tmp_path, builds):
+    for name in ["project_a", "project_b"]:
+        write_genome(tmp_path / name)
+    write_legacy_index(tmp_path / "project_a")
+    for name in ["project_a", "project_b"]:
+        m.prepare_genome_index(genome_config(tmp_path, tmp_path / name, cache=True), str(tmp_path / "log"))
+    assert builds == []
+    checksum = m.genome_checksum(str(tmp_path / "project_a"))
+    index_dir = tmp_path / "cache" / checksum / "Bisulfite_Genome"
+    assert (index_dir / "GA_conversion" / "BS_GA.1.bt2").exists()
+    assert m.index_checksum(str(index_dir)) == checksum
+    for name in ["project_a", "project_b"]:
+        assert os.path.realpath(tmp_path / name / "Bisulfite_Genome") == os.path.realpath(index_dir)
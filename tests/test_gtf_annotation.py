@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import gtf_annotation
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gtf_annotation")
+
+
+# 逐对比较的重叠区间（从1开始的闭区间），作为二分查找结果的参照
+def brute_force_pairs(dmrs, features):
+    pairs = []
+    for i, dmr in dmrs.iterrows():
+        for j, feature in features.iterrows():
+            if dmr["seqnames"] == feature["seqname"] and dmr["start"] <= feature["end"] and feature["start"] <= dmr["end"]:
+                pairs.append((i, j))
+    return pairs
+
+
+def copy_data(tmp_path):
+    for name in os.listdir(DATA_DIR):
+        shutil.copy(f"{DATA_DIR}/{name}", tmp_path / name)
+    return str(tmp_path / "DMRsReplicatesBins.txt"), str(tmp_path / "annotation.gtf")
+
+
+def test_overlap_pairs_matches_brute_force():
+    rng = np.random.default_rng(3)
+    seqnames = ["chr1", "chr2", "chr3"]
+    dmr_start = rng.integers(1, 2000, 150)
+    dmrs = pd.DataFrame(
+        {"seqnames": rng.choice(seqnames, 150), "start": dmr_start, "end": dmr_start + rng.integers(0, 120, 150)}
+    )
+    feature_start = rng.integers(1, 2000, 80)
+    features = pd.DataFrame(
+        {"seqname": rng.choice(seqnames[:2], 80), "start": feature_start, "end": feature_start + rng.integers(0, 300, 80)}
+    )
+    # 只在一个端点相接的区间也算作重叠
+    dmrs.loc[0] = ["chr1", 500, 520]
+    features.loc[0] = ["chr1", 300, 500]
+    features.loc[1] = ["chr1", 520, 600]
+    features = features.sort_values(["seqname", "start", "end"], ignore_index=True)
+
+    dmr_rows, feature_rows = gtf_annotation.overlap_pairs(dmrs, features)
+    assert list(zip(dmr_rows, feature_rows)) == brute_force_pairs(dmrs, features)
+
+
+# 注释结果与逐对比较的结果一致，gene_start为从0开始的bed坐标，属性列拆分为独立的列
+def test_annotate_dmrs(tmp_path):
+    dmr_file, gtf_file = copy_data(tmp_path)
+    df = gtf_annotation.annotate_dmrs(dmr_file, gtf_file, str(tmp_path / "DMR_gene_all.tsv"))
+    dmrs = pd.read_csv(dmr_file, sep="\t", header=None, names=gtf_annotation.DMR_COLUMNS)
+    features = gtf_annotation.read_gtf(gtf_file)
+    pairs = brute_force_pairs(dmrs, features)
+    assert len(df) == len(pairs)
+    assert df["start"].tolist() == [dmrs["start"][i] for i, _ in pairs]
+    assert (df["gene_start"] + 1).tolist() == [features["start"][j] for _, j in pairs]
+
+    # 起始位置是Gene1最后一个碱基的DMR同时注释到Gene1（基因、转录本、外显子）和Gene2
+    boundary = df[df["start"] == 2000]
+    assert boundary["gene_name"].tolist() == ["Gene1", "Gene1", "Gene1", "Gene2"]
+    assert boundary["feature_type"].tolist() == ["gene", "transcript", "exon", "gene"]
+    # 内含子中的DMR只注释到基因和转录本
+    assert df[df["start"] == 1201]["feature_type"].tolist() == ["gene", "transcript"]
+    assert set(df["seqnames"]) == {"chr1", "chr2"}
+    # 同名的键保留最后一个值，只保留有值的属性列
+    assert df[df["feature_type"] == "transcript"]["tag"].unique().tolist() == ["CCDS"]
+    with open(tmp_path / "DMR_gene_all.tsv") as file:
+        header = file.readline().rstrip("\n").split("\t")
+    assert header == gtf_annotation.DMR_COLUMNS + [
+        "gene_start",
+        "gene_end",
+        "strand",
+        "source",
+        "feature_type",
+        "gene_id",
+        "gene_type",
+        "gene_name",
+        "level",
+        "transcript_id",
+        "transcript_type",
+        "transcript_name",
+        "tag",
+        "exon_number",
+        "exon_id",
+    ]
+
+
+# 注释文件只touch时继续使用缓存，内容变化后重新生成
+def test_cache_rebuilt_when_gtf_changes(tmp_path):
+    _, gtf_file = copy_data(tmp_path)
+    index = gtf_annotation.load_gtf_cache(gtf_file)
+    assert os.path.exists(gtf_annotation.gtf_index_file(gtf_file))
+    genes = gtf_annotation.read_cache(gtf_annotation.gene_table_file(gtf_file), gtf_file)
+    assert list(genes.columns) == gtf_annotation.GENE_TABLE_COLUMNS
+    assert (genes["width"] == genes["end"] - genes["start"] + 1).all()
+
+    os.utime(gtf_file, ns=(0, 0))
+    pd.testing.assert_frame_equal(gtf_annotation.read_cache(gtf_annotation.gtf_index_file(gtf_file), gtf_file), index)
+
+    with open(gtf_file, "a") as file:
+        file.write('chr2\tHAVANA\tgene\t650\t660\t.\t+\t.\tgene_id "ENSMUSG00000000006.1"; gene_name "Gene6";\n')
+    assert gtf_annotation.read_cache(gtf_annotation.gtf_index_file(gtf_file), gtf_file) is None
+    assert len(gtf_annotation.load_gtf_cache(gtf_file)) == len(index) + 1
@@ -0,0 +1,400 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import methylation_analyse as m
+
+# 甲基化提取（--bedGraph --CX --cytosine_report --split_by_chromosome --gzip）在输出文件夹中实际写出的文件
+CHROMOSOMES = ["NC_000067.7", "NC_000068.8"]
+EXTRACTOR_OUTPUTS = (
+    [
+        f"{context}_{strand}_S1_1_bismark_bt2_pe.deduplicated.txt.chr{chromosome}.txt.gz"
+        for context in ["CpG", "CHG", "CHH"]
+        for strand in ["OT", "OB"]
+        for chromosome in CHROMOSOMES
+    ]
+    + [f"S1_1_bismark_bt2_pe.deduplicated.CX_report.txt.chr{x}.CX_report.txt.gz" for x in CHROMOSOMES]
+    + [
+        "S1_1_bismark_bt2_pe.deduplicated_splitting_report.txt",
+        "S1_1_bismark_bt2_pe.deduplicated.M-bias.txt",
+        "S1_1_bismark_bt2_pe.deduplicated.bedGraph.gz",
+        "S1_1_bismark_bt2_pe.deduplicated.bismark.cov.gz",
+    ]
+)
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def touch(path, data=b"x" * 4096):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+# 按步骤在work_dir中写出与真实程序同名的输出文件，代替执行外部程序
+def fake_command(sample, config, executed):
+    def execute(cmd, log_dir="./log/", tag=None, stage=None, usage=None):
+        executed.append(stage)
+        work = m.work_dir(sample, config)
+        if stage == "mkdirs":
+            assert os.system(cmd) == 0
+        elif stage == "soapnuke_filter":
+            for path in m.clean_fastq_files(sample, config):
+                touch(path)
+            touch(f"{work}/soapnuke/Basic_Statistics_of_Sequencing_Quality.txt")
+        elif stage == "soapnuke_filter+bismark_alignment":
+            # 流式模式：R1不落盘，记录经管道传递的字节数
+            touch(f"{work}/soapnuke/Basic_Statistics_of_Sequencing_Quality.txt")
+            touch(m.stream_files(sample, config).bytes, b"8192")
+            touch(f"{work}/bismark_alignment/S1_1_bismark_bt2_pe.bam", b"y" * 4096 + m.BAM_EOF)
+            touch(f"{work}/bismark_alignment/S1_1_bismark_bt2_PE_report.txt")
+        elif stage == "bismark_alignment":
+            assert all(os.path.exists(path) for path in m.clean_fastq_files(sample, config))
+            touch(f"{work}/bismark_alignment/S1_1_bismark_bt2_pe.bam", b"y" * 4096 + m.BAM_EOF)
+            touch(f"{work}/bismark_alignment/S1_1_bismark_bt2_PE_report.txt")
+        elif stage == "bismark_deduplicate":
+            assert os.path.exists(f"{work}/bismark_alignment/S1_1_bismark_bt2_pe.bam")
+            touch(f"{work}/bismark_deduplicate/S1_1_bismark_bt2_pe.deduplicated.bam", b"z" * 4096 + m.BAM_EOF)
+            touch(f"{work}/bismark_deduplicate/S1_1_bismark_bt2_pe.deduplication_report.txt")
+        elif stage == "samtools_sort":
+            assert os.path.exists(m.deduplicated_bam_file(sample, config))
+            touch(m.sorted_bam_file(sample), m.BAM_EOF)
+            touch(f"{m.sorted_bam_file(sample)}.bai")
+        elif stage == "bismark_methylation_extractor":
+            assert os.path.exists(m.deduplicated_bam_file(sample, config))
+            for name in EXTRACTOR_OUTPUTS:
+                touch(f"{work}/bismark_methylation/{name}")
+        elif stage == "methylation_cx_report_analysis":
+            for path in m.methylation_report_files(sample):
+                touch(path)
+        elif stage == "sample_summary":
+            touch(m.sample_summary_file(sample))
+
+    return execute
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    (tmp_path / "genome").mkdir()
+    for name in ["S1_1.fq.gz", "S1_2.fq.gz"]:
+        touch(str(tmp_path / "S1" / name))
+
+    def run(**options):
+        data = {
+            "genome_folder": str(tmp_path / "genome"),
+            "utils_folder": REPO_DIR,
+            "skip_bigwig": True,
+            "skip_methylation_matrix": True,
+            **options,
+        }
+        config = m.parse_public_config(data)
+        config.concurrent_samples = 1
+        sample = m.parse_sample_config(
+            {
+                "sample_name": "S1",
+                "group_name": "g",
+                "input_1": str(tmp_path / "S1/S1_1.fq.gz"),
+                "input_2": str(tmp_path / "S1/S1_2.fq.gz"),
+            }
+        )
+        executed = []
+        monkeypatch.setattr(m, "execute_shell_command", fake_command(sample, config, executed))
+        m.process_sample(sample, config, m.ResourceScheduler(config.parallel_num, config.memory_limit))
+        return sample, executed
+
+    return run
+
+
+def output_files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, files in os.walk(directory)
+        for name in files
+        if "manifests" not in root
+    )
+
+
+def test_extractor_layout_matches_patterns():
+    sample = m.DotDict(prefix="S1_1")
+    names = [f"bismark_methylation/{name}" for name in EXTRACTOR_OUTPUTS]
+    context_files = [name for name in names if os.path.basename(name)[:3] in ["CpG", "CHG", "CHH"]]
+    cx_reports = [name for name in names if ".CX_report." in name]
+    assert sorted(m.fnmatch.filter(names, m.methylation_context_names(sample))) == sorted(context_files)
+    assert sorted(m.fnmatch.filter(names, m.cx_report_names(sample))) == sorted(cx_reports)
+
+
+def test_no_cleanup_without_scratch_dir(pipeline, tmp_path):
+    sample, executed = pipeline()
+    assert "sample_summary" in executed
+    files = output_files(sample.output_dir)
+    assert "soapnuke/S1_1.fq.gz" in files
+    assert "bismark_alignment/S1_1_bismark_bt2_pe.bam" in files
+    assert "bismark_deduplicate/S1_1_bismark_bt2_pe.deduplicated.bam" in files
+    assert all(f"bismark_methylation/{name}" in files for name in EXTRACTOR_OUTPUTS)
+    assert not os.path.exists(m.removed_record_path(sample))
+
+
+def test_scratch_staging_publishes_outputs_and_removes_intermediates(pipeline, tmp_path):
+    scratch_dir = tmp_path / "scratch"
+    sample, executed = pipeline(scratch_dir=str(scratch_dir))
+    files = output_files(sample.output_dir)
+    for name in EXTRACTOR_OUTPUTS:
+        published = f"bismark_methylation/{name}" in files
+        assert published == (not name.startswith(("CpG", "CHG", "CHH")))
+    assert "bismark_deduplicate/S1_1_bismark_bt2_pe.deduplicated.sort.bam" in files
+    assert "bismark_alignment/S1_1_bismark_bt2_PE_report.txt" in files
+    assert not any(name.endswith((".fq.gz", "_pe.bam", ".deduplicated.bam")) for name in files)
+    assert not os.path.exists(scratch_dir / "S1")
+    with open(f"{sample.log_dir}/disk_usage.json") as file:
+        usage = json.load(file)
+    assert usage["peak_scratch_bytes"] > 0 and usage["final_scratch_bytes"] == 0
+
+    # 中间文件删除后重新运行，所有步骤的完成记录仍然有效
+    _, executed = pipeline(scratch_dir=str(scratch_dir))
+    assert executed == ["mkdirs"]
+
+    # 强制重新执行甲基化提取时，重新生成已删除的输入文件
+    _, executed = pipeline(scratch_dir=str(scratch_dir), force_from="bismark_methylation_extractor")
+    assert executed[:5] == ["mkdirs", "soapnuke_filter", "bismark_alignment", "bismark_deduplicate", "samtools_sort"]
+
+
+def test_keep_intermediates(pipeline, tmp_path):
+    scratch_dir = tmp_path / "scratch"
+    sample, _ = pipeline(scratch_dir=str(scratch_dir), keep_intermediates=True)
+    work = scratch_dir / "S1"
+    assert (work / "bismark_alignment/S1_1_bismark_bt2_pe.bam").exists()
+    assert len(list((work / "bismark_methylation").glob("C??_*.txt.gz"))) == 12
+
+
+def test_streaming_skips_clean_r1(pipeline, tmp_path):
+    sample, executed = pipeline(streaming=True, parallel_alignment=1)
+    assert executed[:3] == ["mkdirs", "soapnuke_filter+bismark_alignment", "bismark_deduplicate"]
+    files = output_files(sample.output_dir)
+    assert "soapnuke/S1_1.fq.gz" not in files
+    assert "soapnuke/Basic_Statistics_of_Sequencing_Quality.txt" in files
+    clean_1 = f"{sample.output_dir}/soapnuke/S1_1.fq.gz"
+    with open(m.manifest_path("soapnuke_filter", sample)) as file:
+        manifest = json.load(file)
+    assert manifest["outputs"][clean_1] == {"streamed": True}
+    assert manifest["streamed_bytes"] == {clean_1: 8192}
+
+    # 完成记录在流式模式下仍然有效；关闭流式模式后清洗后的文件不存在，两个步骤分别重新执行
+    _, executed = pipeline(streaming=True, parallel_alignment=1)
+    assert executed == ["mkdirs"]
+    _, executed = pipeline(parallel_alignment=1)
+    assert executed[:3] == ["mkdirs", "soapnuke_filter", "bismark_alignment"]
+
+
+# 多实例比对、分片比对及跳过数据过滤时回退为普通文件
+@pytest.mark.parametrize(
+    "options", [{"parallel_alignment": 2}, {"parallel_alignment": 1, "alignment_chunks": 2}, {"skip_filter": True}]
+)
+def test_streaming_falls_back_to_files(tmp_path, options):
+    config = m.parse_public_config({"genome_folder": str(tmp_path), "utils_folder": REPO_DIR, "streaming": True, **options})
+    sample = m.DotDict(
+        sample_name="S1", prefix="S1_1", input_1="S1/S1_1.fq.gz", input_2="S1/S1_2.fq.gz", output_dir=str(tmp_path)
+    )
+    assert not m.streaming_enabled(config)
+    assert m.streamed_files(sample, config) == set()
+    assert "/stream/" not in m.soapnuke_filter(sample, config)
+    assert "/stream/" not in m.bismark_alignment(sample, config)
+
+
+def test_streaming_fallback_pipeline(pipeline):
+    sample, executed = pipeline(streaming=True, parallel_alignment=2)
+    assert executed[:3] == ["mkdirs", "soapnuke_filter", "bismark_alignment"]
+    assert "soapnuke/S1_1.fq.gz" in output_files(sample.output_dir)
+    with open(m.manifest_path("soapnuke_filter", sample)) as file:
+        assert "streamed_bytes" not in json.load(file)
+
+
+# 模拟SOAPnuke（交替写入R1、R2）及bismark（读完R1后才打开R2）的脚本
+FAKE_SOAPNUKE = """#!/bin/bash
+while [ $# -gt 0 ]; do case $1 in -1) i1=$2;; -2) i2=$2;; -C) c=$2;; -D) d=$2;; -o) o=$2;; esac; shift; done
+[ -n "$FAIL_SOAPNUKE" ] && exit 3
+exec 3>"$o/$c" 4>"$o/$d"
+for i in $(seq 200); do head -c 1024 "$i1" >&3; head -c 1024 "$i2" >&4; done
+echo report > "$o/Basic_Statistics_of_Sequencing_Quality.txt"
+"""
+FAKE_BISMARK = """#!/bin/bash
+while [ $# -gt 0 ]; do case $1 in -1) r1=$2;; -2) r2=$2;; -o) o=$2;; esac; shift; done
+[ -n "$FAIL_BISMARK" ] && exit 3
+cat "$r1" > "$o/S1_1_bismark_bt2_pe.bam" && cat "$r2" >> "$o/S1_1_bismark_bt2_pe.bam"
+"""
+
+
+def streaming_setup(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in [("SOAPnuke", FAKE_SOAPNUKE), ("bismark", FAKE_BISMARK)]:
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    touch(str(tmp_path / "S1/S1_1.fq.gz"), b"1" * 1024)
+    touch(str(tmp_path / "S1/S1_2.fq.gz"), b"2" * 1024)
+    config = m.parse_public_config(
+        {"genome_folder": str(tmp_path), "utils_folder": REPO_DIR, "streaming": True, "parallel_alignment": 1}
+    )
+    sample = m.parse_sample_config(
+        {
+            "sample_name": "S1",
+            "group_name": "g",
+            "input_1": str(tmp_path / "S1/S1_1.fq.gz"),
+            "input_2": str(tmp_path / "S1/S1_2.fq.gz"),
+        }
+    )
+    for name in ["soapnuke", "bismark_alignment"]:
+        os.makedirs(f"{sample.output_dir}/{name}", exist_ok=True)
+    cmd = m.streaming_command(sample, config, m.soapnuke_filter(sample, config), m.bismark_alignment(sample, config))
+    return sample, config, cmd
+
+
+def test_streaming_command(tmp_path, monkeypatch):
+    sample, config, cmd = streaming_setup(tmp_path, monkeypatch)
+    subprocess.run(cmd, shell=True, executable="/bin/bash", check=True, timeout=30)
+    with open(f"{sample.output_dir}/bismark_alignment/S1_1_bismark_bt2_pe.bam", "rb") as file:
+        assert file.read() == b"1" * 200 * 1024 + b"2" * 200 * 1024
+    with open(m.stream_files(sample, config).bytes) as file:
+        assert int(file.read()) == 200 * 1024
+    # 命名管道及R2文件已删除，统计报告移回soapnuke文件夹
+    assert sorted(os.listdir(f"{sample.output_dir}/soapnuke")) == [
+        "Basic_Statistics_of_Sequencing_Quality.txt",
+        "streamed_bytes",
+    ]
+
+
+# 任一端在打开命名管道之前失败时，阻塞在管道上的另一端被结束，命令返回失败
+@pytest.mark.parametrize("failed", ["FAIL_SOAPNUKE", "FAIL_BISMARK"])
+def test_streaming_command_failure_stops_other_end(tmp_path, monkeypatch, failed):
+    sample, config, cmd = streaming_setup(tmp_path, monkeypatch)
+    monkeypatch.setenv(failed, "1")
+    result = subprocess.run(cmd, shell=True, executable="/bin/bash", stderr=subprocess.DEVNULL, timeout=30)
+    processes = subprocess.run(["ps", "-ww", "-eo", "args"], capture_output=True, text=True).stdout
+    assert result.returncode != 0
+    assert m.stream_files(sample, config).alignment_1 not in processes
+    assert m.stream_files(sample, config).soapnuke_1 not in processes
+
+
+def test_chromosome_aliases_opt_in(tmp_path):
+    data = {"genome_folder": str(tmp_path), "utils_folder": REPO_DIR}
+    sample = m.DotDict(prefix="S1_1", output_dir=str(tmp_path / "output"), log_dir=str(tmp_path / "log"))
+    config = m.parse_public_config(data)
+    assert config.chromosome_aliases == ""
+    assert "--chromosome_aliases" not in m.methylation_cx_report_analysis(sample, config)
+    config = m.parse_public_config({**data, "chromosome_aliases": "{utils_folder}/chromosome_aliases.tsv"})
+    assert config.chromosome_aliases == os.path.join(REPO_DIR, "chromosome_aliases.tsv")
+    assert f"--chromosome_aliases {config.chromosome_aliases}" in m.methylation_cx_report_analysis(sample, config)
+
+
+def split_fastq_setup(tmp_path):
+    for name in ["S1_1.fq.gz", "S1_2.fq.gz"]:
+        touch(str(tmp_path / "S1" / name))
+    config = m.parse_public_config(
+        {"genome_folder": str(tmp_path), "utils_folder": REPO_DIR, "skip_filter": True, "alignment_chunks": 2}
+    )
+    sample = m.parse_sample_config(
+        {
+            "sample_name": "S1",
+            "group_name": "g",
+            "input_1": str(tmp_path / "S1/S1_1.fq.gz"),
+            "input_2": str(tmp_path / "S1/S1_2.fq.gz"),
+        }
+    )
+    return sample, config
+
+
+def test_split_fastq(tmp_path):
+    sample, config = split_fastq_setup(tmp_path)
+    for mate, path in enumerate([sample.input_1, sample.input_2], start=1):
+        with m.gzip.open(path, "wt") as file:
+            for read in range(5):
+                file.write(f"@r{read}/{mate}\nACGT\n+\nIIII\n")
+    subprocess.run(m.split_fastq(sample, config), shell=True, executable="/bin/bash", check=True, timeout=30)
+    for chunk, reads in enumerate([[0, 2, 4], [1, 3]]):
+        for mate, path in enumerate(m.chunk_fastq_files(sample, config, chunk), start=1):
+            with m.gzip.open(path, "rt") as file:
+                assert file.read() == "".join(f"@r{read}/{mate}\nACGT\n+\nIIII\n" for read in reads)
+
+
+# 一个文件拆分失败时另一个拆分进程被结束并回收（R1从一直没有数据写入的命名管道读取，R2不存在）
+def test_split_fastq_failure_stops_other_mate(tmp_path):
+    sample, config = split_fastq_setup(tmp_path)
+    os.remove(sample.input_1)
+    os.remove(sample.input_2)
+    os.mkfifo(sample.input_1)
+    # 保持写入端打开，使R1的读取一直阻塞而不是读到文件末尾
+    fd = os.open(sample.input_1, os.O_RDWR)
+    try:
+        result = subprocess.run(
+            m.split_fastq(sample, config), shell=True, executable="/bin/bash", stderr=subprocess.DEVNULL, timeout=30
+        )
+        processes = subprocess.run(["ps", "-ww", "-eo", "args"], capture_output=True, text=True).stdout
+    finally:
+        os.close(fd)
+    assert result.returncode != 0
+    assert sample.input_1 not in processes
+
+
+@pytest.mark.parametrize(
+    "buffer_size, expected",
+    [("25%", 16), ("32G", 32), ("512M", 0.5), ("1T", 1024), ("1048576K", 1), ("1048576", 1), ("1073741824b", 1)],
+)
+def test_buffer_size_gb(buffer_size, expected):
+    assert m.buffer_size_gb(m.DotDict(buffer_size=buffer_size, memory_limit=64)) == pytest.approx(expected)
+
+
+# 只忽略各步骤自己的资源参数，其他工具中同名参数的变化仍使完成记录失效
+def test_normalize_command_strips_only_stage_tuning_flags():
+    sort = "samtools sort -@ 8 -m 2048M -T /scratch/S1/sort/S1_1 -o S1.sort.bam S1.bam"
+    assert m.normalize_command(sort, "samtools_sort") == "samtools sort -o S1.sort.bam S1.bam"
+    extractor = "bismark_methylation_extractor --multicore 10 --buffer_size 25% -o out/ in.bam"
+    assert m.normalize_command(extractor, "bismark_methylation_extractor") == "bismark_methylation_extractor -o out/ in.bam"
+    soapnuke = "SOAPnuke filter -1 a.fq.gz -2 b.fq.gz -T 4 -m 0.1 -o soapnuke/"
+    assert m.normalize_command(soapnuke, "soapnuke_filter") == soapnuke
+    assert m.normalize_command(soapnuke.replace("-m 0.1", "-m 0.2"), "soapnuke_filter") != soapnuke
+
+
+# 在后台线程中申请资源，返回开始执行的事件及用于释放资源的事件
+def reserve_in_thread(scheduler, cores, memory):
+    started, release = m.threading.Event(), m.threading.Event()
+
+    def run():
+        with scheduler.reserve(cores, memory):
+            started.set()
+            release.wait(10)
+
+    thread = m.threading.Thread(target=run, daemon=True)
+    thread.start()
+    return started, release, thread
+
+
+def wait_waiting(scheduler, count):
+    for _ in range(1000):
+        with scheduler.condition:
+            if len(scheduler.waiting) == count:
+                return
+        m.time.sleep(0.005)
+    raise AssertionError("申请未进入等待")
+
+
+# 大的申请等待时，后面资源足够的小申请先执行；大的申请等待超时后不再允许插队
+@pytest.mark.parametrize("max_wait, backfilled", [(3600, True), (0, False)])
+def test_scheduler_backfills_until_max_wait(max_wait, backfilled):
+    scheduler = m.ResourceScheduler(4, 10, max_wait=max_wait)
+    running, release_running, _ = reserve_in_thread(scheduler, 3, 2)
+    assert running.wait(5)
+    large, release_large, large_thread = reserve_in_thread(scheduler, 4, 8)
+    wait_waiting(scheduler, 1)
+    small, release_small, small_thread = reserve_in_thread(scheduler, 1, 1)
+    assert small.wait(0.3) == backfilled
+    assert not large.is_set()
+
+    release_small.set()
+    release_running.set()
+    assert large.wait(5)
+    release_large.set()
+    large_thread.join(5)
+    small.wait(5)
+    small_thread.join(5)
+    assert scheduler.free_cores == 4 and scheduler.free_memory == 10
@@ -0,0 +1,126 @@
+import glob
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import methylation_bigwig
+from cx_report_analyse import CX_COLUMNS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_samples")
+METHYLATION_DIR = f"{DATA_DIR}/S1/output/bismark_methylation"
+BEDGRAPH = f"{METHYLATION_DIR}/S1_1_bismark_bt2_pe.deduplicated.bedGraph.gz"
+CX_REPORTS = sorted(glob.glob(f"{METHYLATION_DIR}/S1_1_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"))
+# 测试数据中的位点都在每条染色体的前13000个碱基内
+CHROM_SIZES = {"NC_000067.7": 20000, "NC_000068.8": 20000, "NW_023337853.1": 20000}
+RANKS = {chromosome: i for i, chromosome in enumerate(methylation_bigwig.chromosome_order(CHROM_SIZES))}
+
+
+def concat_blocks(blocks):
+    return tuple(np.concatenate(column) for column in zip(*blocks))
+
+
+# 按CX_report中有覆盖的位点计算的区间（从0开始的起始位置、结束位置、甲基化百分比）
+def expected_intervals(context):
+    df = pd.concat([pd.read_csv(path, sep="\t", header=None, names=CX_COLUMNS) for path in CX_REPORTS])
+    df = df[(df["context"] == context) & (df["readsM"] + df["readsU"] > 0)].sort_values(["chromosome", "position"])
+    value = (df["readsM"] / (df["readsM"] + df["readsU"]) * 100).astype(np.float32)
+    return df["chromosome"].tolist(), (df["position"] - 1).tolist(), df["position"].tolist(), value.to_numpy()
+
+
+def test_read_chrom_sizes(tmp_path):
+    with open(tmp_path / "genome.fa", "w") as file:
+        file.write(">chr1 description\nACGTACGTAC\nGTA\n>chr2\nAC\n")
+    with open(tmp_path / "other.fa.fai", "w") as file:
+        file.write("chr3\t100\t6\t60\t61\n")
+    (tmp_path / "other.fa").touch()
+    paths = [str(tmp_path / "genome.fa"), str(tmp_path / "other.fa")]
+    assert methylation_bigwig.read_chrom_sizes(paths) == {"chr1": 13, "chr2": 2, "chr3": 100}
+
+
+# CX_report按染色体顺序读取，只保留指定context有覆盖的位点
+def test_cx_report_blocks():
+    paths = methylation_bigwig.sort_cx_reports(CX_REPORTS[::-1], RANKS)
+    assert paths == CX_REPORTS
+    key, end, value = concat_blocks(methylation_bigwig.cx_report_blocks(paths, RANKS, "CHG"))
+    chromosomes, starts, ends, values = expected_intervals("CHG")
+    assert (key >> methylation_bigwig.START_BITS).tolist() == [RANKS[name] for name in chromosomes]
+    assert (key & ((1 << methylation_bigwig.START_BITS) - 1)).tolist() == starts
+    assert end.tolist() == ends
+    assert np.array_equal(value, values)
+
+
+def test_bedgraph_blocks_skip_track_line():
+    key, end, value = concat_blocks(methylation_bigwig.bedgraph_blocks(BEDGRAPH, RANKS))
+    df = pd.read_csv(BEDGRAPH, sep="\t", header=None, skiprows=1, names=["chromosome", "start", "end", "value"])
+    assert len(key) == len(df)
+    assert (key & ((1 << methylation_bigwig.START_BITS) - 1)).tolist() == df["start"].tolist()
+    assert end.tolist() == df["end"].tolist()
+    assert np.allclose(value, df["value"])
+    with pytest.raises(ValueError):
+        list(methylation_bigwig.bedgraph_blocks(BEDGRAPH, {"NC_000067.7": 0}))
+
+
+# 外部排序：小的有序段及归并块，结果与一次性排序相同
+def test_spill_and_merge_runs(tmp_path):
+    rng = np.random.default_rng(4)
+    key = rng.integers(0, 5 << methylation_bigwig.START_BITS, 1000)
+    end = np.arange(1000)
+    value = rng.random(1000).astype(np.float32)
+    blocks = [(key[i : i + 64], end[i : i + 64], value[i : i + 64]) for i in range(0, 1000, 64)]
+    with pytest.raises(methylation_bigwig.UnsortedInput):
+        list(methylation_bigwig.check_sorted(iter(blocks), {"records": 0}))
+
+    stats = {"records": 0}
+    runs = methylation_bigwig.spill_runs(iter(blocks), str(tmp_path), stats, run_size=200)
+    assert len(runs) == 4 and stats["records"] == 1000
+    merged = list(methylation_bigwig.merge_runs(runs, block_size=32))
+    assert all(len(block[0]) > 0 for block in merged)
+    merged_key, merged_end, merged_value = concat_blocks(merged)
+    order = np.argsort(key, kind="stable")
+    assert np.array_equal(merged_key, key[order])
+    assert np.array_equal(merged_end, end[order])
+    assert np.array_equal(merged_value, value[order])
+
+
+# 写出的bigWig与CX_report一致；输入未排序时改为外部排序，结果与已排序的输入相同
+def test_export_track(tmp_path):
+    pyBigWig = pytest.importorskip("pyBigWig")
+    aliases = {"NC_000067.7": "chr1"}
+    _, stats = methylation_bigwig.export_track(
+        "CG", "cx_report", CX_REPORTS, str(tmp_path / "S1.CG.bigwig"), CHROM_SIZES, str(tmp_path / "temp"), aliases
+    )
+    assert stats["sorted"] and stats["records"] > 0
+
+    shuffled = tmp_path / "S1_1_bismark_bt2_pe.deduplicated.CX_report.txt.chrNC_000068.8.CX_report.txt.gz"
+    with gzip.open(CX_REPORTS[1], "rt") as file:
+        lines = file.readlines()
+    with gzip.open(shuffled, "wt") as file:
+        file.writelines(np.random.default_rng(5).permutation(lines))
+    paths = [CX_REPORTS[0], str(shuffled), CX_REPORTS[2]]
+    _, stats = methylation_bigwig.export_track(
+        "CG", "cx_report", paths, str(tmp_path / "unsorted.CG.bigwig"), CHROM_SIZES, str(tmp_path / "temp"), aliases
+    )
+    assert not stats["sorted"] and stats["sort_runs"] == 1
+    assert not os.path.exists(tmp_path / "temp" / "CG")
+
+    _, starts, ends, values = expected_intervals("CG")
+    for name in ["S1.CG.bigwig", "unsorted.CG.bigwig"]:
+        bw = pyBigWig.open(str(tmp_path / name))
+        assert bw.chroms() == {"chr1": 20000, "NC_000068.8": 20000, "NW_023337853.1": 20000}
+        intervals = [item for chromosome in bw.chroms() for item in bw.intervals(chromosome)]
+        bw.close()
+        assert [item[0] for item in intervals] == starts
+        assert [item[1] for item in intervals] == ends
+        assert np.array_equal(np.array([item[2] for item in intervals], dtype=np.float32), values)
+
+
+def test_duplicated_alias_rejected(tmp_path):
+    pytest.importorskip("pyBigWig")
+    with pytest.raises(ValueError, match="chr1"):
+        methylation_bigwig.write_bigwig(
+            str(tmp_path / "S1.bigwig"), ["NC_000067.7", "chr1"], {"NC_000067.7": 10, "chr1": 10}, [], {"NC_000067.7": "chr1"}
+        )
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,164 @@
+import gc
+import glob
+import gzip
+import os
+import weakref
+
+import numpy as np
+import pandas as pd
+
+import cx_report_analyse
+import methylation_query
+from cx_report_analyse import CX_COLUMNS
+from methylation_matrix import (
+    MATRIX_COLUMNS,
+    ChromosomeWriter,
+    MethylationMatrix,
+    merge_blocks,
+    merge_matrices,
+    write_matrix_index,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_samples")
+CX_REPORTS = f"{DATA_DIR}/S1/output/bismark_methylation/S1_1_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"
+
+
+def write_matrix(matrix_dir, positions):
+    matrix_dir.mkdir()
+    writer = ChromosomeWriter(str(matrix_dir), "chr1")
+    positions = np.array(positions, dtype=np.uint32)
+    writer.append(
+        {
+            "position": positions,
+            "reads_m": np.arange(len(positions), dtype=np.uint32),
+            "reads_n": np.full(len(positions), 10, dtype=np.uint32),
+            "context": np.zeros(len(positions), dtype=np.uint8),
+            "strand": np.zeros(len(positions), dtype=np.uint8),
+        }
+    )
+    write_matrix_index(str(matrix_dir), {"chr1": writer.close()})
+    return str(matrix_dir)
+
+
+def test_query_region(tmp_path):
+    matrix = MethylationMatrix(write_matrix(tmp_path / "matrix", [5, 10, 20, 30]))
+    columns = matrix.query("chr1", 10, 25)
+    assert columns["position"].tolist() == [10, 20]
+    assert columns["reads_m"].tolist() == [1, 2]
+
+
+def test_matrix_released_after_cache_eviction(tmp_path):
+    matrix_dir = write_matrix(tmp_path / "matrix", [5, 10, 20, 30])
+    methylation_query.open_matrix.cache_clear()
+    references = []
+    for mtime in range(methylation_query.QUERY_CACHE_SIZE + 8):
+        matrix = methylation_query.open_matrix(matrix_dir, mtime)
+        matrix.query("chr1", 1, 100)
+        references.append(weakref.ref(matrix))
+    del matrix
+    methylation_query.open_matrix.cache_clear()
+    gc.collect()
+    assert all(reference() is None for reference in references)
+
+
+# 从测试数据的CX_report生成单个样本的甲基化矩阵
+def cx_report_matrix(tmp_path, name, pattern):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    cx_report_analyse.analyse_cx_reports(
+        pattern,
+        str(output_dir / "depth.txt"),
+        str(output_dir / "coverage.txt"),
+        str(output_dir / "distribution.txt"),
+        parallel_num=3,
+        matrix_dir=str(output_dir / "matrix"),
+    )
+    return MethylationMatrix(str(output_dir / "matrix"))
+
+
+def read_cx_reports(sample):
+    paths = sorted(glob.glob(f"{DATA_DIR}/{sample}/output/bismark_methylation/*.CX_report.txt.gz"))
+    df = pd.concat([pd.read_csv(path, sep="\t", header=None, names=CX_COLUMNS) for path in paths])
+    return df[df["readsM"] + df["readsU"] > 0].reset_index(drop=True)
+
+
+# 矩阵中的位点与CX_report中有覆盖的位点完全一致，按区间查询的结果与直接筛选相同
+def test_matrix_matches_cx_reports(tmp_path):
+    matrix = cx_report_matrix(tmp_path, "S1", CX_REPORTS)
+    expected = read_cx_reports("S1")
+    assert sorted(matrix.chromosomes) == sorted(expected["chromosome"].unique())
+    for chromosome, item in matrix.chromosomes.items():
+        rows = expected[expected["chromosome"] == chromosome]
+        assert item["count"] == len(rows)
+        assert (item["start"], item["end"]) == (rows["position"].min(), rows["position"].max())
+        df = matrix.query_frame(chromosome, 1, 2**32 - 1)
+        columns = ["chromosome", "position", "strand", "readsM", "readsU", "context"]
+        pd.testing.assert_frame_equal(df, rows[columns].reset_index(drop=True), check_dtype=False)
+        start, end = rows["position"].iloc[[len(rows) // 4, len(rows) // 2]]
+        region = rows[(rows["position"] >= start) & (rows["position"] <= end) & (rows["context"] == "CG")]
+        assert matrix.query(chromosome, start, end, context="CG")["position"].tolist() == region["position"].tolist()
+
+
+# 输入未按位置排序时重新排序，结果与排序的输入相同
+def test_unsorted_input_sorted_in_place(tmp_path):
+    shuffled_dir = tmp_path / "shuffled"
+    shuffled_dir.mkdir()
+    rng = np.random.default_rng(1)
+    for path in glob.glob(CX_REPORTS):
+        with gzip.open(path, "rt") as file:
+            lines = file.readlines()
+        with gzip.open(shuffled_dir / os.path.basename(path), "wt") as file:
+            file.writelines(rng.permutation(lines))
+    expected = cx_report_matrix(tmp_path, "sorted", CX_REPORTS)
+    matrix = cx_report_matrix(tmp_path, "unsorted", f"{shuffled_dir}/*.gz")
+    assert matrix.chromosomes == expected.chromosomes
+    for chromosome in expected.chromosomes:
+        for column in MATRIX_COLUMNS:
+            assert np.array_equal(matrix.column(chromosome, column), expected.column(chromosome, column))
+
+
+# 合并矩阵与各样本CX_report中有覆盖位点的外连接一致，样本在该位点没有覆盖时为0
+def test_merge_matches_outer_join(tmp_path):
+    samples = ["S1", "S2", "S3"]
+    sample_dirs = []
+    for sample in samples:
+        pattern = f"{DATA_DIR}/{sample}/output/bismark_methylation/{sample}_1_bismark_bt2_pe.deduplicated.CX_report.txt*.gz"
+        matrix = cx_report_matrix(tmp_path, sample, pattern)
+        sample_dirs.append(matrix.matrix_dir)
+    merge_matrices(samples, sample_dirs, str(tmp_path / "cohort"), parallel_num=3)
+    cohort = MethylationMatrix(str(tmp_path / "cohort"))
+    assert cohort.samples == samples
+
+    keys = ["chromosome", "position", "strand", "context"]
+    expected = None
+    for sample in samples:
+        df = read_cx_reports(sample)
+        df[f"readsM_{sample}"] = df["readsM"]
+        df[f"readsN_{sample}"] = df["readsM"] + df["readsU"]
+        df = df[keys + [f"readsM_{sample}", f"readsN_{sample}"]]
+        expected = df if expected is None else expected.merge(df, on=keys, how="outer")
+    expected = expected.fillna(0).sort_values(["chromosome", "position"])
+    columns = ["chromosome", "position", "strand"] + [f"reads{x}_{s}" for s in samples for x in "MN"] + ["context"]
+    for chromosome in cohort.chromosomes:
+        rows = expected[expected["chromosome"] == chromosome][columns].reset_index(drop=True)
+        df = cohort.query_frame(chromosome, 1, 2**32 - 1)
+        pd.testing.assert_frame_equal(df, rows, check_dtype=False)
+
+    # 各样本矩阵未变化时跳过合并
+    mtime = os.stat(tmp_path / "cohort" / "index.json").st_mtime_ns
+    merge_matrices(samples, sample_dirs, str(tmp_path / "cohort"))
+    assert os.stat(tmp_path / "cohort" / "index.json").st_mtime_ns == mtime
+
+
+# 分块归并的结果与一次性求并集相同，每个样本每块最多读取block_size个位点
+def test_merge_blocks():
+    rng = np.random.default_rng(2)
+    positions = [np.sort(rng.choice(200, size, replace=False)) for size in [50, 120, 0, 7]]
+    blocks = list(merge_blocks(positions, block_size=8))
+    union = np.concatenate([block for block, _ in blocks])
+    assert np.array_equal(union, np.unique(np.concatenate(positions)))
+    for i, position in enumerate(positions):
+        ranges = [ranges[i] for _, ranges in blocks]
+        assert all(last - first <= 8 for first, last in ranges)
+        assert [first for first, _ in ranges] == [0] + [last for _, last in ranges[:-1]]
+        assert ranges[-1][1] == len(position)
@@ -0,0 +1,134 @@
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import cx_report_analyse
+import qc_report
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_samples")
+
+
+# 汇总报告所需的数据片段及对应的依赖记录
+def cohort_results(sample_names):
+    results = []
+    for sample_name in sample_names:
+        fragments = qc_report.DotDict(
+            qc={"Sample Id": sample_name},
+            coverage=pd.DataFrame({"Sample Id": [sample_name]}),
+            qc_deduplicated={"Sample Id": sample_name},
+            methylation_level=pd.DataFrame({"Sample Id": [sample_name]}),
+            context_proportion={"Sample Id": sample_name},
+        )
+        manifest = {name: {"inputs": sample_name} for name, _ in qc_report.COHORT_OUTPUTS.values()}
+        results.append((fragments, manifest))
+    return results
+
+
+def test_cohort_manifest_does_not_overwrite_sample_manifest(tmp_path):
+    samples = [qc_report.DotDict(sample_name=name, report_dir=str(tmp_path)) for name in ["S1", "S2"]]
+    sample_manifest = {"qc": {"inputs": "S1"}}
+    qc_report.write_json(f"{tmp_path}/.qc_report_manifest.json", sample_manifest)
+
+    qc_report.write_cohort_reports(samples, cohort_results(["S1", "S2"]), str(tmp_path), incremental=True)
+    with open(f"{tmp_path}/.qc_report_manifest.json") as file:
+        assert json.load(file) == sample_manifest
+    with open(f"{tmp_path}/.qc_report_cohort_manifest.json") as file:
+        assert set(json.load(file)) == set(qc_report.COHORT_OUTPUTS)
+    table = pd.read_csv(tmp_path / "QC quality control table for each sample.tsv", sep="\t")
+    assert list(table["Sample Id"]) == ["S1", "S2"]
+
+
+# 复制测试数据并生成甲基化深度、覆盖度及分布报告
+@pytest.fixture
+def samples(tmp_path):
+    shutil.copytree(DATA_DIR, tmp_path / "data")
+    samples = []
+    for sample_name in ["S1", "S2", "S3"]:
+        sample = qc_report.parse_sample_config(
+            {
+                "sample_name": sample_name,
+                "input_1": str(tmp_path / "data" / sample_name / f"{sample_name}_1.fq.gz"),
+                "input_2": str(tmp_path / "data" / sample_name / f"{sample_name}_2.fq.gz"),
+            }
+        )
+        input_files = qc_report.sample_input_files(sample)
+        cx_report_analyse.analyse_cx_reports(
+            f"{sample.output_dir}/bismark_methylation/*.CX_report.txt.gz",
+            input_files["depth_report"],
+            input_files["coverage_report"],
+            input_files["distribution_report"],
+        )
+        samples.append(sample)
+    qc_report.set_render_options("draft")
+    yield samples
+    qc_report.set_render_options("default")
+
+
+# 生成全部样本的报告，返回每个样本读取的输入文件
+def build_reports(samples, report_dir, monkeypatch):
+    loaded = {}
+    load_sample = qc_report.load_sample
+
+    def load(sample, keys=None):
+        loaded[sample.sample_name] = set(keys)
+        return load_sample(sample, keys)
+
+    monkeypatch.setattr(qc_report, "load_sample", load)
+    results = [qc_report.build_sample_report(sample, incremental=True) for sample in samples]
+    qc_report.write_cohort_reports(samples, results, report_dir, incremental=True)
+    return loaded
+
+
+# 报告文件夹中输出文件（不包括依赖记录等隐藏文件）的修改时间
+def modification_times(directories):
+    return {
+        path: os.stat(path).st_mtime_ns
+        for directory in directories
+        for path in glob.glob(f"{directory}/*")
+        if os.path.isfile(path)
+    }
+
+
+# 增量模式下第二次运行跳过全部报告项，输入文件变化后只重新生成依赖该文件的图表及汇总报告
+def test_incremental_rebuilds_only_stale_outputs(samples, tmp_path, monkeypatch):
+    report_dir = str(tmp_path / "report")
+    os.makedirs(report_dir)
+    loaded = build_reports(samples, report_dir, monkeypatch)
+    assert loaded == {sample.sample_name: set(qc_report.INPUT_PARSERS) for sample in samples}
+    directories = [report_dir] + [sample.report_dir for sample in samples]
+    assert all(os.path.exists(f"{report_dir}/{file_name}") for file_name in qc_report.COHORT_OUTPUTS)
+    assert os.path.exists(f"{samples[0].report_dir}/M-bias R1.png")
+    before = modification_times(directories)
+
+    assert build_reports(samples, report_dir, monkeypatch) == {}
+    assert modification_times(directories) == before
+
+    # 修改S2的覆盖度报告：只重新生成S2中依赖该文件的报告项及对应的汇总报告
+    coverage_report = qc_report.sample_input_files(samples[1])["coverage_report"]
+    mtime = os.stat(coverage_report).st_mtime_ns + 10**9
+    os.utime(coverage_report, ns=(mtime, mtime))
+    assert build_reports(samples, report_dir, monkeypatch) == {
+        "S2": {"pe_report", "deduplication_percentage", "splitting_report", "depth_report", "coverage_report"}
+    }
+    after = modification_times(directories)
+    changed = {os.path.relpath(path, tmp_path) for path in after if after[path] != before[path]}
+    assert changed == {
+        "data/S2/report/Coverage Rate Group By Chromosome.tsv",
+        "data/S2/report/Methylation Level Groupp By Chromosome.tsv",
+        "report/Coverage Rate Group By Chromosome.tsv",
+        "report/QC quality control table for each sample (deduplicated).tsv",
+        "report/Methylation Level Groupp By Chromosome.tsv",
+    }
+
+    # 增量生成的汇总报告与完整生成的结果相同
+    full_dir = tmp_path / "full"
+    full_dir.mkdir()
+    results = [qc_report.build_sample_report(sample) for sample in samples]
+    qc_report.write_cohort_reports(samples, results, str(full_dir))
+    for file_name in qc_report.COHORT_OUTPUTS:
+        with open(f"{report_dir}/{file_name}") as incremental, open(full_dir / file_name) as full:
+            assert incremental.read() == full.read()